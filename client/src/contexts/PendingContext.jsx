@@ -43,8 +43,9 @@ export const PendingSessionProvider = ({ children }) => {
         const newEmailToInitiate = parkedEmails.find(email => email.status === 'initiating');
 
         if (newEmailToInitiate) {
-            console.log(`New parked email detected. Checking recipient status for session: ${newEmailToInitiate.session_id}`);
-            socket.emit('check_user_status', { user_id: newEmailToInitiate.recipientId });
+            console.log(`New parked email detected. Subscribing to recipient presence for session: ${newEmailToInitiate.session_id}`);
+            // The server answers right away with a 'presence_changed' snapshot and keeps pushing changes.
+            socket.emit('subscribe_presence', { user_ids: [newEmailToInitiate.recipientId] });
         }
     }, [parkedEmails, socket, user]);
 
@@ -92,9 +93,20 @@ export const PendingSessionProvider = ({ children }) => {
             }
         };
 
-        const handlePendingRequest = (request) => {
-            console.log("Received a pending handshake request:", request);
-            setPendingRequests(prev => [...prev, request]);
+        const handlePresenceChanged = ({ users }) => {
+            (users || []).forEach(handleUserStatusResponse);
+        };
+
+        const handlePendingBatch = ({ requests, next_cursor }) => {
+            console.log(`Received ${requests.length} pending handshake request(s).`);
+            setPendingRequests(prev => {
+                const known = new Set(prev.map(req => req.session_id));
+                return [...prev, ...requests.filter(req => !known.has(req.session_id))];
+            });
+            // Acknowledge the whole page at once; the server answers with the next one.
+            if (next_cursor) {
+                socket.emit('qkd_pending_ack', { cursor: next_cursor });
+            }
         };
 
         const handleRecipientOffline = ({ session_id }) => {
@@ -159,14 +171,16 @@ export const PendingSessionProvider = ({ children }) => {
         };
 
         socket.on('user_status_response', handleUserStatusResponse);
-        socket.on('qkd_pending_request', handlePendingRequest);
+        socket.on('presence_changed', handlePresenceChanged);
+        socket.on('qkd_pending_batch', handlePendingBatch);
         socket.on('qkd_initiate', handleQkdInitiate);
         socket.on('qkd_recipient_offline', handleRecipientOffline);
         socket.on('initiate_from_pending', handleInitiateFromPending);
 
         return () => {
             socket.off('user_status_response', handleUserStatusResponse);
-            socket.off('qkd_pending_request', handlePendingRequest);
+            socket.off('presence_changed', handlePresenceChanged);
+            socket.off('qkd_pending_batch', handlePendingBatch);
             socket.off('qkd_initiate', handleQkdInitiate);
             socket.off('qkd_recipient_offline', handleRecipientOffline);
             socket.off('initiate_from_pending', handleInitiateFromPending);
@@ -77,15 +77,24 @@ const DashboardPage = () => {
             window.electronAPI.syncFolder(folder);
         };
 
+        // Sends are queued on the server; failures only surface here.
+        const handleDeliveryStatus = ({ status, recipient, error }) => {
+            if (status === 'failed') {
+                setNotification(`Error: Could not deliver email to ${recipient}. ${error || ''}`);
+            }
+        };
+
         console.log("Dashboard: Attaching force_sync listener to socket.");
         socket.on('force_sync', handleForceSync);
+        socket.on('mail_delivery_status', handleDeliveryStatus);
 
         // Cleanup the listener when the component unmounts or the socket changes
         return () => {
             console.log("Dashboard: Cleaning up force_sync listener.");
             socket.off('force_sync', handleForceSync);
+            socket.off('mail_delivery_status', handleDeliveryStatus);
         };
-    }, [socket]); 
+    }, [socket, setNotification]); 
 
     // Effect for when the user navigates to a new folder
      useEffect(() => {
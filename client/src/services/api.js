@@ -92,6 +92,25 @@ export const sendFinalEmail = (payload) => {
     return apiClient.post('/emails/send', payload);
 };
 
+/**
+ * Sends an email with attachments as multipart/form-data, so large files are
+ * streamed to the server instead of being base64-encoded into a JSON body.
+ * Pass a large (e.g. encrypted) body as `bodyBlob` rather than in `fields.body`.
+ * Corresponds to: POST /api/v1/emails/send/multipart
+ */
+export const sendFinalEmailMultipart = (fields, attachments = [], bodyBlob = null) => {
+    // fields: { recipient, subject, body?, is_encrypted, protocol }
+    const form = new FormData();
+    Object.entries(fields).forEach(([key, value]) => form.append(key, value));
+    if (bodyBlob) {
+        form.append('body_file', bodyBlob, 'body.txt');
+    }
+    attachments.forEach((file) => form.append('attachments', file, file.name));
+    return apiClient.post('/emails/send/multipart', form, {
+        headers: { 'Content-Type': 'multipart/form-data' },
+    });
+};
+
 /**
  * Moves a specific email to the trash on the provider's server.
  * Corresponds to: POST /api/v1/emails/{email_id}/delete
@@ -120,4 +139,24 @@ export const starEmail = (emailId, folder) => {
  */
 export const unstarEmail = (emailId, folder) => {
     return apiClient.post(`/emails/${emailId}/unstar`, { folder });
-};
\ No newline at end of file
+};
+/**
+ * Searches the server-side header index of the linked account, newest first.
+ * Supports prefix words, "quoted phrases" and from:/to:/subject: filters.
+ * Pass the previous response's next_cursor to get the next page.
+ * Corresponds to: GET /api/v1/emails/search
+ */
+export const searchEmails = (q, { folder, limit, cursor } = {}) => {
+    return apiClient.get('/emails/search', { params: { q, folder, limit, cursor } });
+};
+
+/**
+ * Opts the linked account in to (or out of) server-side search indexing.
+ * Corresponds to: PUT / DELETE /api/v1/emails/search/index
+ */
+export const enableSearchIndex = () => {
+    return apiClient.put('/emails/search/index');
+};
+export const disableSearchIndex = () => {
+    return apiClient.delete('/emails/search/index');
+};
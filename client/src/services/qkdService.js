@@ -18,6 +18,11 @@ const RAW_KEY_TARGET_BITS = 512;
 const PHOTON_MULTIPLIER = 10;  
 const TARGET_KEY_BITS = 256; 
 
+// Opt-in wire format: bases and orientations travel as packed bit arrays
+// (binary Socket.IO attachments) once both sides have advertised support.
+// Peers that don't advertise it keep receiving plain JSON lists.
+const WIRE_PACKED_BITS = 'packed-bits-v1';
+
 // --- STATE MAPS ---
 const STATE_MAP_BB84 = { '00': 0, '10': 1, '01': 2, '11': 3 };
 const INVERSE_STATE_MAP_BB84 = { 0: {bit:0, basis:0}, 1: {bit:1, basis:0}, 2: {bit:0, basis:1}, 3: {bit:1, basis:1} };
@@ -32,6 +37,43 @@ const INVERSE_STATE_MAP_MF = {
 // --- INTERNAL ALGORITHMIC HELPERS ---
 const _generateRandomArray = (len) => Array.from({ length: len }, () => Math.round(Math.random()));
 
+// Packs an array of 0/1 values into bytes, least significant bit first.
+function _packBits(bits) {
+    const packed = new Uint8Array(Math.ceil(bits.length / 8));
+    for (let i = 0; i < bits.length; i++) {
+        if (bits[i]) packed[i >> 3] |= 1 << (i & 7);
+    }
+    return packed;
+}
+
+function _unpackBits(buffer, length) {
+    const bytes = buffer instanceof Uint8Array ? buffer : new Uint8Array(buffer);
+    return Array.from({ length }, (_, i) => (bytes[i >> 3] >> (i & 7)) & 1);
+}
+
+// Bases and orientations in the peer's chosen format, always returned as plain arrays.
+function _readBasesPayload(payload) {
+    if (payload.packed_bases === undefined) {
+        return { bases: payload.bases, orientations: payload.orientations };
+    }
+    return {
+        bases: _unpackBits(payload.packed_bases, payload.count),
+        orientations: payload.packed_orientations ? _unpackBits(payload.packed_orientations, payload.count) : null,
+    };
+}
+
+function _writeBasesPayload(bases, orientations, packed) {
+    if (!packed) {
+        return { bases, orientations, wire: [WIRE_PACKED_BITS] };
+    }
+    return {
+        packed_bases: _packBits(bases),
+        packed_orientations: orientations ? _packBits(orientations) : null,
+        count: bases.length,
+        wire: [WIRE_PACKED_BITS],
+    };
+}
+
 function _alicePreparesData(numPhotons, protocol) {
     const bits = _generateRandomArray(numPhotons);
     const bases = _generateRandomArray(numPhotons);
@@ -118,6 +160,7 @@ class QKDHandshakeManager {
         this.senderId = senderId;         
         this.recipientId = recipientId; 
         this.sessionId = sessionId;  
+        this.peerAcceptsPacked = false;
         this.resolve = null;
         this.reject = null;
 
@@ -152,18 +195,21 @@ class QKDHandshakeManager {
             this.alicePrivate = privateData;
 
             this.onProgress('Transmitting quantum states...');
-            this.ws.emit('qkd_initiate', { to: this.recipientId, from: this.senderId, protocol: this.protocol, session_id: this.sessionId, to_email: to_email, ...publicPayload });
+            // Bob's capabilities are unknown yet, so the initiation stays JSON and advertises ours.
+            this.ws.emit('qkd_initiate', { to: this.recipientId, from: this.senderId, protocol: this.protocol, session_id: this.sessionId, to_email: to_email, wire: [WIRE_PACKED_BITS], ...publicPayload });
         });
     }
 
     _handleBobBases(payload) {
         if (payload.from !== this.recipientId) return; 
         this.onProgress('Received Bob\'s bases. Sifting...');
-        const siftIndices = _getSiftIndices(this.alicePrivate.bases, payload.bases, this.alicePrivate.orientations, payload.orientations, this.protocol);
+        this.peerAcceptsPacked = (payload.wire || []).includes(WIRE_PACKED_BITS);
+        const bob = _readBasesPayload(payload);
+        const siftIndices = _getSiftIndices(this.alicePrivate.bases, bob.bases, this.alicePrivate.orientations, bob.orientations, this.protocol);
         this.aliceSiftedKey = _getSiftedKey(this.alicePrivate.bits, siftIndices);
 
         this.onProgress('Sifting complete. Sending my bases...');
-        this.ws.emit('qkd_alice_bases', { to: this.recipientId, from: this.senderId, session_id: this.sessionId, bases: this.alicePrivate.bases, orientations: this.alicePrivate.orientations });
+        this.ws.emit('qkd_alice_bases', { to: this.recipientId, from: this.senderId, session_id: this.sessionId, ..._writeBasesPayload(this.alicePrivate.bases, this.alicePrivate.orientations, this.peerAcceptsPacked) });
 
         const numSamples = Math.floor(this.aliceSiftedKey.length * SAMPLE_SIZE);
         const sampleIndices = Array.from(Array(this.aliceSiftedKey.length).keys()).sort(() => 0.5 - Math.random()).slice(0, numSamples);
@@ -190,19 +236,21 @@ class QKDHandshakeManager {
         return new Promise((resolve, reject) => {
             this.resolve = resolve; this.reject = reject;
             this.protocol = payload.protocol;
+            this.peerAcceptsPacked = (payload.wire || []).includes(WIRE_PACKED_BITS);
 
             this.onProgress('Quantum states received. Measuring...');
             this.bobPrivate = _bobMeasuresData(payload.photon_states, this.protocol);
 
             this.onProgress('Measurement complete. Sending my bases...');
-            this.ws.emit('qkd_bob_bases', { to: this.recipientId, from: this.senderId, session_id: this.sessionId, bases: this.bobPrivate.bases, orientations: this.bobPrivate.orientations });
+            this.ws.emit('qkd_bob_bases', { to: this.recipientId, from: this.senderId, session_id: this.sessionId, ..._writeBasesPayload(this.bobPrivate.bases, this.bobPrivate.orientations, this.peerAcceptsPacked) });
         });
     }
     
     _handleAliceBases(payload) {
         if (payload.from !== this.recipientId || payload.session_id !== this.sessionId) return;
         this.onProgress('Received Alice\'s bases. Sifting...');
-        const siftIndices = _getSiftIndices(this.bobPrivate.bases, payload.bases, this.bobPrivate.orientations, payload.orientations, this.protocol);
+        const alice = _readBasesPayload(payload);
+        const siftIndices = _getSiftIndices(this.bobPrivate.bases, alice.bases, this.bobPrivate.orientations, alice.orientations, this.protocol);
         this.bobSiftedKey = _getSiftedKey(this.bobPrivate.measuredBits, siftIndices);
         this.onProgress('Sifting complete. Awaiting final sample check...');
     }
@@ -5,12 +5,32 @@ from pydantic import ValidationError
 
 from app.core.config import settings
 from app.services import user_service
+from app.services.principal_cache import principal_cache
 from app.schemas.token import TokenData
 from app.schemas.user import User
 from typing import Optional
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
 
+async def _get_user_for_token(token: str) -> Optional[User]:
+    """
+    Decodes and validates the JWT, then resolves its subject to a `User`,
+    served from the principal cache when possible.
+    Raises JWTError or ValidationError for an invalid token.
+    """
+    payload = jwt.decode(token, settings.JWT_SECRET_KEY, algorithms=[settings.ALGORITHM])
+    token_data = TokenData(**payload)
+    user_id = str(token_data.sub)
+
+    user = principal_cache.get(user_id)
+    if user is None:
+        user_dict = await user_service.get_user_by_id(user_id=user_id)
+        if not user_dict:
+            return None
+        user = User(**user_dict)
+        principal_cache.put(user_id, user, payload.get("exp"))
+    return user
+
 async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -18,28 +38,21 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, settings.JWT_SECRET_KEY, algorithms=[settings.ALGORITHM])
-        token_data = TokenData(**payload)
+        user = await _get_user_for_token(token)
     except (JWTError, ValidationError):
         raise credentials_exception
     
-    user = await user_service.get_user_by_id(user_id=str(token_data.sub))
     if user is None:
         raise credentials_exception
-    return User(**user)
+    return user
 
 async def get_user_from_token_ws(token: str = Query(...)) -> Optional[dict]:
     if not token:
         return None
     try:
-        payload = jwt.decode(token, settings.JWT_SECRET_KEY, algorithms=[settings.ALGORITHM])
-        token_data = TokenData(**payload)
-        if token_data is None:
-            return None
-        user_dict = await user_service.get_user_by_id(user_id=str(token_data.sub))
-        if user_dict:
-            user_model = User(**user_dict)
+        user_model = await _get_user_for_token(token)
+        if user_model:
             return {"token": token, "user": user_model}
         return None
     except (JWTError, ValidationError):
-        return None
\ No newline at end of file
+        return None
@@ -2,8 +2,9 @@
 from fastapi import APIRouter, Depends, HTTPException
 from app.api import deps
 from app.schemas.user import User
-from app.db.supabase_client import supabase
+from app.db.supabase_client import get_db, execute
 from app.services import email_service
+from app.services.token_cache import token_cache
 from app.schemas.account import LinkedAccount 
 from uuid import UUID
 import httpx
@@ -16,7 +17,10 @@ async def get_linked_accounts(current_user: User = Depends(deps.get_current_user
     Fetches a list of all email accounts the current user has linked to QuMail.
     """
     try:
-        response = supabase.table('linked_accounts').select("id, email_address, provider, created_at").eq('user_id', str(current_user.id)).execute()
+        response = await execute(
+            get_db().table('linked_accounts').select("id, email_address, provider, created_at, needs_reauth").eq('user_id', str(current_user.id)),
+            "linked_accounts.list"
+        )
         return response.data or []
     except Exception as e:
         print(f"Error fetching linked accounts: {e}")
@@ -30,7 +34,10 @@ async def get_sync_credentials(account_id: str, current_user: User = Depends(dep
     account, allowing the client's background process to sync email.
     """
     try:
-        response = supabase.table('linked_accounts').select('*').eq('id', account_id).eq('user_id', str(current_user.id)).single().execute()
+        response = await execute(
+            get_db().table('linked_accounts').select('*').eq('id', account_id).eq('user_id', str(current_user.id)).single(),
+            "linked_accounts.get"
+        )
         
         if not response.data:
             raise HTTPException(status_code=404, detail="Linked account not found or you do not have permission to access it.")
@@ -63,17 +70,20 @@ async def get_sync_credentials(account_id: str, current_user: User = Depends(dep
 @router.delete("/{account_id}", status_code=200, response_model=dict)
 async def remove_linked_account(account_id: UUID, current_user: User = Depends(deps.get_current_user)):
     try:
-        response = supabase.table('linked_accounts') \
-            .delete() \
-            .eq('id', str(account_id)) \
-            .eq('user_id', str(current_user.id)) \
-            .execute()
+        response = await execute(
+            get_db().table('linked_accounts') \
+                .delete() \
+                .eq('id', str(account_id)) \
+                .eq('user_id', str(current_user.id)),
+            "linked_accounts.delete"
+        )
          
         if not response.data:
             raise HTTPException(
                 status_code=404,
                 detail="Linked account not found or you do not have permission to remove it."
             )
+        token_cache.invalidate(str(account_id))
         print(f"User {current_user.email} successfully removed linked account {account_id}")
         return {"message": "Linked account removed successfully."}
     except Exception as e:
@@ -3,8 +3,6 @@ import httpx
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.responses import RedirectResponse,JSONResponse
-from google.oauth2 import id_token
-from google.auth.transport import requests as google_requests
 from datetime import datetime, timedelta
 from urllib.parse import urlencode
 
@@ -12,10 +10,12 @@ from app.api import deps
 from app.core import security
 from app.core.constants import EmailProvider
 from app.core.config import settings
+from app.core.http_client import get_http_client
 from app.schemas.token import Token
 from app.schemas.user import User, UserCreate
-from app.services import user_service
-from app.db.supabase_client import supabase
+from app.services import email_service, user_service
+from app.services.google_id_token import verify_google_id_token
+from app.db.supabase_client import get_db, execute
 
 router = APIRouter()
 
@@ -65,22 +65,21 @@ async def handle_google_signin(payload: dict):
 
     try:
         # Step 1: Exchange code for Google tokens
-        async with httpx.AsyncClient() as client:
-            token_uri = "https://oauth2.googleapis.com/token"
-            token_data = {
-                "code": code,
-                "client_id": settings.GOOGLE_CLIENT_ID,
-                "client_secret": settings.GOOGLE_CLIENT_SECRET,
-                # THIS MUST BE THE SERVER'S REDIRECT URI for this flow
-                "redirect_uri": "http://localhost:5173/auth/google/callback", 
-                "grant_type": "authorization_code"
-            }
-            token_res = await client.post(token_uri, data=token_data)
-            token_res.raise_for_status()
-            tokens = token_res.json()
+        token_uri = "https://oauth2.googleapis.com/token"
+        token_data = {
+            "code": code,
+            "client_id": settings.GOOGLE_CLIENT_ID,
+            "client_secret": settings.GOOGLE_CLIENT_SECRET,
+            # THIS MUST BE THE SERVER'S REDIRECT URI for this flow
+            "redirect_uri": "http://localhost:5173/auth/google/callback", 
+            "grant_type": "authorization_code"
+        }
+        token_res = await get_http_client().post(token_uri, data=token_data)
+        token_res.raise_for_status()
+        tokens = token_res.json()
 
         # Step 2: Verify token and get user info
-        id_info = id_token.verify_oauth2_token(tokens['id_token'], google_requests.Request(), settings.GOOGLE_CLIENT_ID)
+        id_info = await verify_google_id_token(tokens['id_token'], settings.GOOGLE_CLIENT_ID)
         email = id_info['email']
         name = id_info.get('name', 'Google User')
 
@@ -142,31 +141,30 @@ async def handle_google_link_callback(code: str, state: str):
     
     current_user = await deps.get_current_user(token=state)
     try:
-        async with httpx.AsyncClient() as client:
-            token_uri = "https://oauth2.googleapis.com/token"
-            token_data = {
-                "code": code,
-                "client_id": settings.GOOGLE_CLIENT_ID,
-                "client_secret": settings.GOOGLE_CLIENT_SECRET,
-                "redirect_uri": settings.GOOGLE_REDIRECT_URI, # Must match step 1
-                "grant_type": "authorization_code"
-            }
-            token_res = await client.post(token_uri, data=token_data)
-            token_res.raise_for_status()
-            tokens = token_res.json()
-
-        id_info = id_token.verify_oauth2_token(tokens['id_token'], google_requests.Request(), settings.GOOGLE_CLIENT_ID)
+        token_uri = "https://oauth2.googleapis.com/token"
+        token_data = {
+            "code": code,
+            "client_id": settings.GOOGLE_CLIENT_ID,
+            "client_secret": settings.GOOGLE_CLIENT_SECRET,
+            "redirect_uri": settings.GOOGLE_REDIRECT_URI, # Must match step 1
+            "grant_type": "authorization_code"
+        }
+        token_res = await get_http_client().post(token_uri, data=token_data)
+        token_res.raise_for_status()
+        tokens = token_res.json()
+
+        id_info = await verify_google_id_token(tokens['id_token'], settings.GOOGLE_CLIENT_ID)
         email = id_info['email']
 
-        # **THE FIX**: Added `await` to the Supabase call
-        await supabase.table('linked_accounts').upsert({
+        await execute(get_db().table('linked_accounts').upsert({
             "user_id": str(current_user.id),
             "email_address": email,
             "provider": EmailProvider.GMAIL,
             "encrypted_access_token": security.encrypt_token(tokens['access_token']),
             "encrypted_refresh_token": security.encrypt_token(tokens['refresh_token']),
-            "token_expiry": (datetime.utcnow() + timedelta(seconds=tokens['expires_in'])).isoformat()
-        }).execute()
+            "token_expiry": (datetime.utcnow() + timedelta(seconds=tokens['expires_in'])).isoformat(),
+            **email_service.REFRESH_STATE_RESET,
+        }), "linked_accounts.upsert")
 
         # Redirect the user's browser back to the settings page in the client app
         return RedirectResponse(url="http://localhost:5173/settings?link_status=success")
@@ -187,37 +185,37 @@ async def handle_yahoo_callback(payload: dict, current_user: User = Depends(deps
         raise HTTPException(status_code=400, detail="Authorization code not found.")
 
     try:
-        async with httpx.AsyncClient() as client:
-            token_uri = "https://api.login.yahoo.com/oauth2/get_token"
-            
-            # Yahoo requires Basic Auth for the client credentials
-            auth_header = httpx.BasicAuth(settings.YAHOO_CLIENT_ID, settings.YAHOO_CLIENT_SECRET)
-            
-            token_data = {
-                "code": code,
-                "redirect_uri": settings.YAHOO_REDIRECT_URI,
-                "grant_type": "authorization_code"
-            }
-            token_res = await client.post(token_uri, data=token_data, auth=auth_header)
-            token_res.raise_for_status()
-            tokens = token_res.json()
-
-            # Use the access token to get the user's profile info
-            profile_uri = "https://api.login.yahoo.com/openid/v1/userinfo"
-            profile_res = await client.get(profile_uri, headers={"Authorization": f"Bearer {tokens['access_token']}"})
-            profile_res.raise_for_status()
-            profile_info = profile_res.json()
-            email = profile_info['email']
+        token_uri = "https://api.login.yahoo.com/oauth2/get_token"
+        
+        # Yahoo requires Basic Auth for the client credentials
+        auth_header = httpx.BasicAuth(settings.YAHOO_CLIENT_ID, settings.YAHOO_CLIENT_SECRET)
+        
+        token_data = {
+            "code": code,
+            "redirect_uri": settings.YAHOO_REDIRECT_URI,
+            "grant_type": "authorization_code"
+        }
+        token_res = await get_http_client().post(token_uri, data=token_data, auth=auth_header)
+        token_res.raise_for_status()
+        tokens = token_res.json()
+
+        # Use the access token to get the user's profile info
+        profile_uri = "https://api.login.yahoo.com/openid/v1/userinfo"
+        profile_res = await get_http_client().get(profile_uri, headers={"Authorization": f"Bearer {tokens['access_token']}"})
+        profile_res.raise_for_status()
+        profile_info = profile_res.json()
+        email = profile_info['email']
 
         # Securely store the tokens
-        supabase.table('linked_accounts').upsert({
+        await execute(get_db().table('linked_accounts').upsert({
             "user_id": str(current_user['id']),
             "email_address": email,
             "provider": EmailProvider.YAHOO,
             "encrypted_access_token": security.encrypt_token(tokens['access_token']),
             "encrypted_refresh_token": security.encrypt_token(tokens['refresh_token']),
-            "token_expiry": (datetime.utcnow() + timedelta(seconds=tokens['expires_in'])).isoformat()
-        }, on_conflict="user_id, email_address").execute()
+            "token_expiry": (datetime.utcnow() + timedelta(seconds=tokens['expires_in'])).isoformat(),
+            **email_service.REFRESH_STATE_RESET,
+        }, on_conflict="user_id, email_address"), "linked_accounts.upsert")
 
         return {"message": f"Successfully linked Yahoo account: {email}"}
         
@@ -1,11 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException
-from app.schemas.email import EmailSend
-from pydantic import BaseModel
+import json
+from fastapi import APIRouter, Depends, File, Form, HTTPException, Query, UploadFile
+from fastapi.responses import Response, StreamingResponse
+from typing import List, Optional
+from app.schemas.email import EmailSend, EmailBatchAction
+from pydantic import BaseModel, ValidationError
 from app.api import deps
 from app.schemas.user import User
 from app.api import deps
 from app.services import email_service
-from app.db.supabase_client import supabase
+from app.services.outbox_service import mail_outbox
+from app.services.mail_spool import mail_spool
+from app.services.search_index import search_indexer
+from app.db.supabase_client import get_db, execute
+from app.core.config import settings
 
 class EmailActionPayload(BaseModel):
     folder: str
@@ -14,7 +21,10 @@ router = APIRouter()
 
 async def get_user_linked_account(current_user: User = Depends(deps.get_current_user)):
     try:
-        response = supabase.table('linked_accounts').select('*').eq('user_id', str(current_user.id)).limit(1).single().execute()
+        response = await execute(
+            get_db().table('linked_accounts').select('*').eq('user_id', str(current_user.id)).limit(1).single(),
+            "linked_accounts.get_for_user"
+        )
         if not response.data:
             raise HTTPException(status_code=404, detail="No linked email account found for this user.")
         return response.data
@@ -27,28 +37,257 @@ async def send_email_endpoint(
     email_in: EmailSend,
     linked_account: dict = Depends(get_user_linked_account)
 ):
+    """
+    Queues the email in the outbox and returns immediately. Delivery happens in
+    the background; its progress arrives as `mail_delivery_status` events.
+    """
     try:
-        await email_service.send_email(
-            linked_account=linked_account,
-            email_data=email_in 
-        )
-        return {"message": "Email has been accepted for delivery."}
+        queued = await mail_outbox.enqueue(linked_account=linked_account, email_data=email_in)
+        return {"message": "Email has been accepted for delivery.", "outbox_id": str(queued['id']), "status": queued['status']}
     except HTTPException as e:
         raise e 
     except Exception as e:
         print(f"ERROR in /send endpoint: {e}")
         raise HTTPException(status_code=500, detail="An unexpected server error occurred while sending the email.")
     
+@router.post("/send/multipart", status_code=202)
+async def send_multipart_email_endpoint(
+    recipient: str = Form(...),
+    subject: str = Form(...),
+    is_encrypted: bool = Form(...),
+    protocol: str = Form(...),
+    body: str = Form(""),
+    body_file: Optional[UploadFile] = File(None),
+    attachments: Optional[List[UploadFile]] = File(None),
+    linked_account: dict = Depends(get_user_linked_account)
+):
+    """
+    Like /send, but as multipart/form-data with any number of `attachments`.
+    A large body (e.g. an encrypted payload) should be uploaded as the
+    `body_file` part instead of the `body` field. Uploads are spooled to disk
+    and the message is generated from the spools while it is being sent, so
+    memory use doesn't grow with their size. The request size is checked
+    against OUTBOX_MAX_UPLOAD_BYTES before the form is parsed (see
+    BodyLimitMiddleware); the exact content size is checked while spooling.
+    """
+    try:
+        email_in = EmailSend(recipient=recipient, subject=subject, body=body, is_encrypted=is_encrypted, protocol=protocol)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False, include_context=False))
+
+    spooled = []
+    try:
+        budget = settings.OUTBOX_MAX_UPLOAD_BYTES - len(body.encode('utf-8'))
+        body_spool = None
+        if body_file is not None:
+            saved = await mail_spool.save(body_file, budget)
+            spooled.append(saved['spool'])
+            body_spool, budget = saved['spool'], budget - saved['size']
+        files = []
+        for upload in attachments or []:
+            saved = await mail_spool.save(upload, budget)
+            spooled.append(saved['spool'])
+            budget -= saved['size']
+            files.append({
+                **saved,
+                "filename": upload.filename or "attachment",
+                "content_type": upload.content_type or "application/octet-stream",
+            })
+
+        queued = await mail_outbox.enqueue(linked_account=linked_account, email_data=email_in, body_spool=body_spool, attachments=files)
+        return {"message": "Email has been accepted for delivery.", "outbox_id": str(queued['id']), "status": queued['status']}
+    except HTTPException as e:
+        await mail_spool.discard(spooled)
+        raise e
+    except Exception as e:
+        await mail_spool.discard(spooled)
+        print(f"ERROR in /send/multipart endpoint: {e}")
+        raise HTTPException(status_code=500, detail="An unexpected server error occurred while sending the email.")
+
+# Changed messages per NDJSON line of the delta response.
+DELTA_CHUNK_SIZE = 500
+
+@router.get("/delta")
+async def delta_sync_endpoint(
+    folder: str = Query("INBOX"),
+    uidvalidity: Optional[int] = Query(None),
+    highestmodseq: Optional[int] = Query(None),
+    linked_account: dict = Depends(get_user_linked_account)
+):
+    """
+    Returns what changed in a folder since the client's last UIDVALIDITY and
+    HIGHESTMODSEQ, as newline-delimited JSON:
+
+    - {"type": "state", "mode", "uidvalidity", "highestmodseq", "uidnext", "exists"} first.
+      mode "reset" means the client's state is stale (or missing) and it must
+      resync the folder; "unsupported" means the server can't do delta sync.
+    - {"type": "vanished", "uids": "3:5,9"} with QRESYNC, or
+      {"type": "present", "uids": "1:2,6:40"} with only CONDSTORE, which the
+      client diffs against its own UIDs to find expunges.
+    - {"type": "changed", "items": [[uid, [flags], modseq], ...]} in chunks; UIDs
+      at or above the client's previous UIDNEXT are new messages.
+    """
+    try:
+        delta = await email_service.delta_sync(linked_account, folder, uidvalidity, highestmodseq)
+    except Exception as e:
+        print(f"ERROR in /delta endpoint: {e}")
+        raise HTTPException(status_code=502, detail="Could not compute the mailbox delta.")
+    # The folder changed for the client, so it probably changed for the search index too.
+    search_indexer.refresh(linked_account, folder)
+
+    def lines():
+        state = {key: delta.get(key) for key in ("mode", "uidvalidity", "highestmodseq", "uidnext", "exists")}
+        yield json.dumps({"type": "state", **state}, separators=(",", ":")) + "\n"
+        if "vanished" in delta:
+            yield json.dumps({"type": "vanished", "uids": delta["vanished"]}, separators=(",", ":")) + "\n"
+        if "present" in delta:
+            yield json.dumps({"type": "present", "uids": delta["present"]}, separators=(",", ":")) + "\n"
+        changed = delta.get("changed", [])
+        for start in range(0, len(changed), DELTA_CHUNK_SIZE):
+            yield json.dumps({"type": "changed", "items": changed[start:start + DELTA_CHUNK_SIZE]}, separators=(",", ":")) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@router.get("/search")
+async def search_emails_endpoint(
+    q: str = Query(..., min_length=1, max_length=500),
+    folder: Optional[str] = Query(None),
+    limit: int = Query(settings.SEARCH_PAGE_SIZE, ge=1, le=200),
+    cursor: Optional[str] = Query(None),
+    linked_account: dict = Depends(get_user_linked_account)
+):
+    """
+    Searches the server-side header index of the linked account, newest first.
+    Words match as prefixes of the sender, recipients, subject or snippet;
+    "quoted phrases" match exactly and from:, to: and subject: restrict a term
+    to one field. Pass back `next_cursor` to get the next page.
+    """
+    if not settings.SEARCH_INDEX_ENABLED:
+        raise HTTPException(status_code=404, detail="Server-side search is not enabled on this server.")
+    account_id = str(linked_account['id'])
+    if not await search_indexer.is_indexed(account_id):
+        raise HTTPException(status_code=409, detail="Search indexing is not enabled for this account.")
+    try:
+        results, next_cursor = await search_indexer.search(account_id, q, folder, limit, cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    return {"results": results, "next_cursor": next_cursor}
+
+@router.put("/search/index")
+async def enable_search_index_endpoint(linked_account: dict = Depends(get_user_linked_account)):
+    """Opts the linked account in to the server-side index and starts filling it."""
+    if not settings.SEARCH_INDEX_ENABLED:
+        raise HTTPException(status_code=404, detail="Server-side search is not enabled on this server.")
+    await search_indexer.enable(linked_account)
+    return {"message": "Search indexing enabled. Results fill in as the mailbox is indexed.", "enabled": True}
+
+@router.delete("/search/index")
+async def disable_search_index_endpoint(linked_account: dict = Depends(get_user_linked_account)):
+    """Opts the linked account out and deletes everything indexed for it."""
+    if not settings.SEARCH_INDEX_ENABLED:
+        raise HTTPException(status_code=404, detail="Server-side search is not enabled on this server.")
+    await search_indexer.disable(str(linked_account['id']))
+    return {"message": "Search indexing disabled and the index deleted.", "enabled": False}
+
+def _check_uid(email_id: str):
+    if not (email_id.isascii() and email_id.isdigit()):
+        raise HTTPException(status_code=400, detail="The email id must be a numeric IMAP UID.")
+
+@router.get("/{email_id}/structure")
+async def email_structure_endpoint(email_id: str, folder: str = Query("INBOX"), linked_account: dict = Depends(get_user_linked_account)):
+    """
+    Returns the message's size and its MIME parts (section, type, encoding,
+    size, filename) from the BODYSTRUCTURE, without downloading any content.
+    The sections are what /part expects.
+    """
+    _check_uid(email_id)
+    try:
+        structure = await email_service.fetch_structure(linked_account, folder, email_id)
+    except Exception as e:
+        print(f"ERROR in /structure endpoint: {e}")
+        raise HTTPException(status_code=502, detail="Could not fetch the message structure.")
+    if structure is None:
+        raise HTTPException(status_code=404, detail=f"Email {email_id} not found in {folder}.")
+    return structure
+
+@router.get("/{email_id}/headers")
+async def email_headers_endpoint(email_id: str, folder: str = Query("INBOX"), linked_account: dict = Depends(get_user_linked_account)):
+    """Returns the raw header block of the message, without its body."""
+    _check_uid(email_id)
+    try:
+        headers = await email_service.fetch_headers(linked_account, folder, email_id)
+    except Exception as e:
+        print(f"ERROR in /headers endpoint: {e}")
+        raise HTTPException(status_code=502, detail="Could not fetch the message headers.")
+    if headers is None:
+        raise HTTPException(status_code=404, detail=f"Email {email_id} not found in {folder}.")
+    return Response(content=headers, media_type="text/rfc822-headers")
+
+@router.get("/{email_id}/part")
+async def email_part_endpoint(
+    email_id: str,
+    folder: str = Query("INBOX"),
+    section: str = Query("", description="Body section, e.g. '2', '1.2', '1.MIME' or 'TEXT'; empty for the whole message."),
+    offset: int = Query(0, ge=0),
+    length: Optional[int] = Query(None, gt=0),
+    linked_account: dict = Depends(get_user_linked_account)
+):
+    """
+    Streams a body section, or a byte range of it. The bytes are the part as
+    stored, still in its Content-Transfer-Encoding (see /structure), so ranges
+    of an encrypted attachment can be resumed. Content-Length is sent when the
+    size is known from the structure, otherwise the response is chunked.
+    """
+    _check_uid(email_id)
+    section = section.upper()
+    if not email_service.SECTION_RE.fullmatch(section):
+        raise HTTPException(status_code=400, detail=f"Invalid body section '{section}'.")
+    try:
+        streamed = await email_service.stream_message_part(linked_account, folder, email_id, section, offset, length)
+    except Exception as e:
+        print(f"ERROR in /part endpoint: {e}")
+        raise HTTPException(status_code=502, detail="Could not fetch the message part.")
+    if streamed is None:
+        raise HTTPException(status_code=404, detail=f"Email {email_id} not found in {folder}.")
+    chunks, total = streamed
+    headers = {"Content-Length": str(total)} if total is not None else None
+    return StreamingResponse(chunks, media_type="application/octet-stream", headers=headers)
+
+def _trash_folder(linked_account: dict) -> str:
+    return "[Gmail]/Trash" if linked_account['provider'] == 'gmail' else 'Trash'
+
+def _archive_folder(linked_account: dict) -> str:
+    return "[Gmail]/All Mail" if linked_account['provider'] == 'gmail' else 'Archive'
+
+@router.post("/batch")
+async def batch_email_action_endpoint(payload: EmailBatchAction, linked_account: dict = Depends(get_user_linked_account)):
+    """
+    Applies one action to many emails in a folder using a single IMAP session.
+    UIDs are grouped into sequence sets, so a few commands cover the whole selection.
+    Returns the outcome ("ok", "failed" or "invalid") for every requested UID.
+    """
+    if payload.action == 'read':
+        results = await email_service.batch_set_email_flag(linked_account, payload.folder, payload.uids, '(\\Seen)')
+    elif payload.action == 'star':
+        results = await email_service.batch_set_email_flag(linked_account, payload.folder, payload.uids, '(\\Flagged)')
+    elif payload.action == 'unstar':
+        results = await email_service.batch_remove_email_flag(linked_account, payload.folder, payload.uids, '(\\Flagged)')
+    elif payload.action == 'archive':
+        results = await email_service.batch_archive_emails(linked_account, payload.folder, payload.uids, _archive_folder(linked_account))
+    else:
+        results = await email_service.batch_move_emails(linked_account, payload.folder, payload.uids, _trash_folder(linked_account))
+
+    succeeded = sum(1 for status in results.values() if status == "ok")
+    return {"message": f"Applied '{payload.action}' to {succeeded} of {len(results)} email(s).", "results": results}
+
 @router.post("/{email_id}/delete")
 async def delete_email_endpoint(email_id: str, payload: EmailActionPayload, linked_account: dict = Depends(get_user_linked_account)):
-    trash_folder = "[Gmail]/Trash" if linked_account['provider'] == 'gmail' else 'Trash'
-    await email_service.move_email(linked_account, payload.folder, email_id, trash_folder)
+    await email_service.move_email(linked_account, payload.folder, email_id, _trash_folder(linked_account))
     return {"message": f"Email {email_id} moved to trash."}
 
 @router.post("/{email_id}/archive")
 async def archive_email_endpoint(email_id: str, payload: EmailActionPayload, linked_account: dict = Depends(get_user_linked_account)):
-    archive_folder = "[Gmail]/All Mail" if linked_account['provider'] == 'gmail' else 'Archive'
-    await email_service.move_email(linked_account, payload.folder, email_id, archive_folder)
+    await email_service.archive_email(linked_account, payload.folder, email_id, _archive_folder(linked_account))
     return {"message": f"Email {email_id} archived."}
 
 @router.post("/{email_id}/read")
@@ -0,0 +1,38 @@
+# app/core/body_limit.py
+import json
+from typing import Dict
+
+
+class BodyLimitMiddleware:
+    """
+    Rejects requests to the given paths whose declared Content-Length exceeds
+    the path's limit with a 413, before anything reads the body. FastAPI parses
+    form bodies before the endpoint (or any dependency) runs, so an endpoint
+    can't do this itself. Requests without a Content-Length get a 411.
+    """
+    def __init__(self, app, limits: Dict[str, int]):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope["path"]) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        length = dict(scope["headers"]).get(b"content-length")
+        if length is None or not length.isdigit():
+            await self._reject(send, 411, "A Content-Length header is required.")
+        elif int(length) > limit:
+            await self._reject(send, 413, "The message and its attachments are too large.")
+        else:
+            await self.app(scope, receive, send)
+
+    async def _reject(self, send, status: int, detail: str):
+        body = json.dumps({"detail": detail}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
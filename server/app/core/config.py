@@ -7,8 +7,15 @@ class Settings(BaseSettings):
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24 
     TOKEN_ENCRYPTION_KEY: str
 
+    # Password hashing
+    BCRYPT_ROUNDS: int = 12
+    PASSWORD_HASH_WORKERS: int = 4
+    PASSWORD_HASH_MAX_QUEUE: int = 32
+
     SUPABASE_URL: str
     SUPABASE_KEY: str
+    DB_POOL_SIZE: int = 20
+    DB_QUERY_TIMEOUT_SECONDS: float = 10.0
 
     # Google OAuth Credentials
     GOOGLE_CLIENT_ID: str
@@ -20,6 +27,113 @@ class Settings(BaseSettings):
     YAHOO_CLIENT_SECRET: Optional[str] = None
     YAHOO_REDIRECT_URI: Optional[str] = None
 
+    # Access tokens are refreshed once they are this close to expiring
+    TOKEN_REFRESH_MARGIN_SECONDS: int = 60
+
+    # Background token refresher
+    TOKEN_REFRESHER_ENABLED: bool = True
+    TOKEN_REFRESHER_INTERVAL_SECONDS: int = 60
+    TOKEN_REFRESHER_WINDOW_SECONDS: int = 600
+    TOKEN_REFRESHER_BATCH_SIZE: int = 50
+    TOKEN_REFRESHER_CONCURRENCY: int = 5
+    TOKEN_REFRESHER_JITTER_SECONDS: int = 10
+
+    # Cache of authenticated users for deps.get_current_user and the socket handshake
+    PRINCIPAL_CACHE_MAX_SIZE: int = 10000
+    PRINCIPAL_CACHE_TTL_SECONDS: int = 60
+
+    # Socket.IO backplane. With a redis:// URL, emits and presence are shared by
+    # every worker and host; without one, everything stays in-process.
+    SOCKETIO_BACKPLANE_URL: Optional[str] = None
+    SOCKETIO_BACKPLANE_CHANNEL: str = "qmail-socketio"
+    PRESENCE_TTL_SECONDS: int = 90
+    PRESENCE_MAX_SUBSCRIPTIONS: int = 500
+    PRESENCE_DEBOUNCE_SECONDS: float = 0.5
+
+    # Pending QKD sessions delivered on connect, per qkd_pending_batch event
+    PENDING_SESSIONS_PAGE_SIZE: int = 50
+    PENDING_SESSION_TTL_SECONDS: int = 7 * 24 * 3600
+    PENDING_SESSIONS_MAX_PER_RECIPIENT: int = 200
+    PENDING_SESSION_SWEEPER_ENABLED: bool = True
+    PENDING_SESSION_SWEEP_INTERVAL_SECONDS: int = 300
+    PENDING_SESSION_SWEEP_BATCH_SIZE: int = 500
+
+    # Live QKD handshakes relayed between two online users
+    HANDSHAKE_STEP_TIMEOUT_SECONDS: float = 60.0
+    HANDSHAKE_TIMER_TICK_SECONDS: float = 1.0
+    HANDSHAKE_MAX_ACTIVE_PER_USER: int = 20
+
+    # Per-user token buckets for Socket.IO events, by event class
+    WS_RATE_HANDSHAKE_PER_SECOND: float = 20.0
+    WS_RATE_HANDSHAKE_BURST: int = 60
+    WS_RATE_STORE_PER_SECOND: float = 1.0
+    WS_RATE_STORE_BURST: int = 5
+    WS_RATE_NOTIFY_PER_SECOND: float = 2.0
+    WS_RATE_NOTIFY_BURST: int = 10
+    WS_RATE_PRESENCE_PER_SECOND: float = 5.0
+    WS_RATE_PRESENCE_BURST: int = 20
+    WS_RATE_CONTROL_PER_SECOND: float = 5.0
+    WS_RATE_CONTROL_BURST: int = 20
+    # Packets queued for one socket before it counts as a slow consumer; "drop" or "disconnect"
+    WS_SEND_QUEUE_HIGH_WATERMARK: int = 256
+    WS_SLOW_CONSUMER_POLICY: str = "drop"
+
+    # Shared outbound HTTP client (OAuth and provider APIs)
+    HTTP_CLIENT_TIMEOUT_SECONDS: float = 10.0
+    HTTP_CLIENT_CONNECT_TIMEOUT_SECONDS: float = 5.0
+    HTTP_CLIENT_MAX_CONNECTIONS: int = 100
+    HTTP_CLIENT_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    HTTP_CLIENT_KEEPALIVE_EXPIRY_SECONDS: float = 30.0
+    HTTP_RETRY_ATTEMPTS: int = 3
+    HTTP_RETRY_BACKOFF_SECONDS: float = 0.5
+
+    # IMAP session pool
+    IMAP_POOL_MAX_CONNECTIONS_PER_ACCOUNT: int = 3
+    IMAP_POOL_IDLE_TIMEOUT_SECONDS: int = 300
+    IMAP_POOL_HEALTH_CHECK_INTERVAL_SECONDS: int = 30
+    IMAP_POOL_ACQUIRE_TIMEOUT_SECONDS: int = 30
+    # Bytes per partial FETCH when streaming message parts
+    IMAP_FETCH_CHUNK_BYTES: int = 256 * 1024
+
+    # Authenticated SMTP connections reused by the outbox workers
+    SMTP_TIMEOUT_SECONDS: float = 30.0
+    SMTP_POOL_MAX_CONNECTIONS_PER_ACCOUNT: int = 2
+    SMTP_POOL_IDLE_TIMEOUT_SECONDS: int = 120
+    SMTP_POOL_HEALTH_CHECK_INTERVAL_SECONDS: int = 15
+    SMTP_POOL_ACQUIRE_TIMEOUT_SECONDS: int = 60
+
+    # IMAP IDLE push watchers for the linked accounts of connected users
+    IMAP_IDLE_ENABLED: bool = True
+    IMAP_IDLE_FOLDER: str = "INBOX"
+    IMAP_IDLE_RENEW_SECONDS: float = 540.0
+    IMAP_IDLE_COMMAND_TIMEOUT_SECONDS: float = 30.0
+    IMAP_IDLE_RETRY_MAX_SECONDS: float = 300.0
+    IMAP_IDLE_MAX_WATCHERS: int = 5000
+    IMAP_IDLE_CONNECT_CONCURRENCY: int = 20
+
+    # Outbound mail queue
+    OUTBOX_POLL_INTERVAL_SECONDS: float = 5.0
+    OUTBOX_BATCH_SIZE: int = 20
+    OUTBOX_MAX_ATTEMPTS: int = 6
+    OUTBOX_RETRY_BACKOFF_SECONDS: float = 30.0
+    OUTBOX_LEASE_SECONDS: int = 120
+    OUTBOX_MAX_CONCURRENCY_PER_PROVIDER: int = 4
+    # Uploaded bodies and attachments of queued mail; empty means a directory under the system temp dir.
+    OUTBOX_SPOOL_DIR: str = ""
+    OUTBOX_SPOOL_CHUNK_BYTES: int = 1024 * 1024
+    OUTBOX_MAX_UPLOAD_BYTES: int = 50 * 1024 * 1024
+    # Spool files older than this that no queued message refers to are deleted, every sweep interval.
+    OUTBOX_SPOOL_ORPHAN_AGE_SECONDS: int = 6 * 3600
+    OUTBOX_SPOOL_SWEEP_INTERVAL_SECONDS: float = 3600.0
+
+    # Opt-in server-side header index (SQLite FTS5) behind /api/emails/search
+    SEARCH_INDEX_ENABLED: bool = False
+    SEARCH_INDEX_PATH: str = "data/search_index.db"
+    SEARCH_INDEX_REFRESH_INTERVAL_SECONDS: float = 900.0
+    SEARCH_INDEX_BACKFILL_MAX_MESSAGES: int = 5000
+    SEARCH_INDEX_SYNC_CONCURRENCY: int = 4
+    SEARCH_PAGE_SIZE: int = 50
+
     class Config:
         env_file = ".env"
 
@@ -0,0 +1,90 @@
+# app/core/http_client.py
+import asyncio
+import random
+import httpx
+from typing import Optional
+
+from app.core.config import settings
+
+# Status codes from OAuth token endpoints that are worth retrying.
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _create_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        http2=_http2_available(),
+        timeout=httpx.Timeout(settings.HTTP_CLIENT_TIMEOUT_SECONDS, connect=settings.HTTP_CLIENT_CONNECT_TIMEOUT_SECONDS),
+        limits=httpx.Limits(
+            max_connections=settings.HTTP_CLIENT_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.HTTP_CLIENT_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.HTTP_CLIENT_KEEPALIVE_EXPIRY_SECONDS,
+        ),
+    )
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Returns the application-wide HTTP client. It is normally opened by the
+    FastAPI lifespan hook; it is created lazily here for code running outside it.
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _create_client()
+    return _client
+
+
+async def open_http_client():
+    get_http_client()
+
+
+async def close_http_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def post_with_retry(url: str, **kwargs) -> httpx.Response:
+    """
+    POSTs through the shared client, retrying transient failures (connection
+    errors, 429 and 5xx) with exponential backoff and jitter. A Retry-After
+    header from the server takes precedence over the computed delay.
+    Raises httpx.HTTPStatusError for any non-success response that is left.
+
+    Only for requests that are safe to repeat, such as refresh-token grants.
+    An authorization code is single-use: if the response to its exchange is
+    lost, a retry fails with invalid_grant, so those are posted only once.
+    """
+    client = get_http_client()
+    attempts = settings.HTTP_RETRY_ATTEMPTS
+    for attempt in range(attempts):
+        delay = settings.HTTP_RETRY_BACKOFF_SECONDS * (2 ** attempt) + random.uniform(0, settings.HTTP_RETRY_BACKOFF_SECONDS)
+        try:
+            response = await client.post(url, **kwargs)
+        except httpx.TransportError as e:
+            if attempt == attempts - 1:
+                raise
+            print(f"WARNING: POST {url} failed ({e}). Retrying in {delay:.2f}s.")
+            await asyncio.sleep(delay)
+            continue
+
+        if response.status_code in RETRYABLE_STATUS_CODES and attempt < attempts - 1:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after and retry_after.isdigit():
+                delay = min(float(retry_after), settings.HTTP_CLIENT_TIMEOUT_SECONDS)
+            print(f"WARNING: POST {url} returned {response.status_code}. Retrying in {delay:.2f}s.")
+            await asyncio.sleep(delay)
+            continue
+
+        response.raise_for_status()
+        return response
@@ -0,0 +1,75 @@
+# app/core/metrics.py
+import bisect
+import threading
+from typing import Dict, Sequence, Tuple
+
+# Latency buckets in seconds, from sub-millisecond relay hops to slow provider calls.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Counter:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: int = 1):
+        self.value += amount
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self) -> dict:
+        bounds = [str(b) for b in self.buckets] + ["+Inf"]
+        return {"buckets": dict(zip(bounds, self.counts)), "sum": self.sum, "count": self.count}
+
+
+class MetricsRegistry:
+    """
+    Minimal in-process counters and histograms, keyed by name plus labels.
+    Everything is exposed as a JSON snapshot on GET /metrics.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Tuple], Counter] = {}
+        self._histograms: Dict[Tuple[str, Tuple], Histogram] = {}
+
+    def counter(self, name: str, **labels) -> Counter:
+        key = (name, tuple(sorted(labels.items())))
+        counter = self._counters.get(key)
+        if counter is None:
+            with self._lock:
+                counter = self._counters.setdefault(key, Counter())
+        return counter
+
+    def histogram(self, name: str, buckets: Sequence[float] = DEFAULT_BUCKETS, **labels) -> Histogram:
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, Histogram(buckets))
+        return histogram
+
+    def snapshot(self) -> dict:
+        def label_key(name, labels):
+            return name if not labels else name + "{" + ",".join(f"{k}={v}" for k, v in labels) + "}"
+
+        return {
+            "counters": {label_key(n, l): c.value for (n, l), c in list(self._counters.items())},
+            "histograms": {label_key(n, l): h.snapshot() for (n, l), h in list(self._histograms.items())},
+        }
+
+
+metrics = MetricsRegistry()
@@ -1,13 +1,23 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Tuple
+from fastapi import HTTPException, status
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 from cryptography.fernet import Fernet
 from .config import settings
 
 # --- Password Hashing for QuMail User Accounts ---
-# We use bcrypt, the industry standard for hashing passwords.
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# We use bcrypt, the industry standard for hashing passwords. Hashes made with a
+# different cost than BCRYPT_ROUNDS are flagged by verify_and_update for rehashing.
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.BCRYPT_ROUNDS)
+
+# bcrypt is pure CPU work (tens to hundreds of ms), so it runs on a dedicated
+# bounded pool instead of the event loop. Beyond the queue limit we reject
+# with 503 straight away rather than let a login burst pile up.
+_password_executor = ThreadPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+_password_jobs_in_flight = 0
 
 if not settings.TOKEN_ENCRYPTION_KEY:
     raise ValueError("TOKEN_ENCRYPTION_KEY is not set in the environment.")
@@ -25,6 +35,32 @@ def get_password_hash(password: str) -> str:
     """Hashes a plain password for storage."""
     return pwd_context.hash(password)
 
+async def _run_password_job(func, *args):
+    global _password_jobs_in_flight
+    if _password_jobs_in_flight >= settings.PASSWORD_HASH_WORKERS + settings.PASSWORD_HASH_MAX_QUEUE:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="The server is busy. Please try again shortly.",
+            headers={"Retry-After": "1"},
+        )
+    _password_jobs_in_flight += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_password_executor, func, *args)
+    finally:
+        _password_jobs_in_flight -= 1
+
+async def verify_and_update_password_async(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    Verifies a password on the hashing pool. Also returns a replacement hash
+    when the stored one was made with a different cost than BCRYPT_ROUNDS
+    (None otherwise). Raises a 503 HTTPException when the pool is saturated.
+    """
+    return await _run_password_job(pwd_context.verify_and_update, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    """Hashes a password on the hashing pool. Raises a 503 HTTPException when it is saturated."""
+    return await _run_password_job(pwd_context.hash, password)
+
 # --- JWT Token Handling ---
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Creates a JSON Web Token."""
@@ -0,0 +1,5 @@
+-- Serves the pending-request lookup run on every socket connect:
+--   where recipient_id = ? and status = 'pending' order by session_id limit ?
+-- session_id is the keyset-paging column, so pages are read straight off the index.
+create index concurrently if not exists pending_sessions_recipient_status_idx
+    on pending_sessions (recipient_id, status, session_id);
@@ -0,0 +1,19 @@
+-- Pending handshake requests expire. Each row is the key of one undelivered
+-- email, so a recipient may hold several from the same initiator; the number
+-- per recipient is bounded by the service and the expiry, not by a constraint.
+
+-- No default: the service sets expires_at from PENDING_SESSION_TTL_SECONDS.
+alter table pending_sessions
+    add column if not exists expires_at timestamptz;
+
+-- Rows stored before expiry existed get the default TTL (7 days) from now.
+update pending_sessions
+    set expires_at = now() + interval '7 days'
+    where expires_at is null;
+
+alter table pending_sessions
+    alter column expires_at set not null;
+
+-- Serves the sweeper's "expires_at < now()" batches.
+create index if not exists pending_sessions_expires_at_idx
+    on pending_sessions (expires_at);
@@ -0,0 +1,22 @@
+-- Durable queue of outgoing mail, delivered by the outbox workers.
+create table if not exists outbox (
+    id uuid primary key default gen_random_uuid(),
+    user_id uuid not null,
+    linked_account_id uuid not null,
+    from_name text not null,
+    recipient text not null,
+    subject text not null,
+    body text not null,
+    -- queued -> sending -> sent | failed (back to queued between retries)
+    status text not null default 'queued',
+    attempts integer not null default 0,
+    -- When the row is next due; while sending, the end of the worker's lease.
+    next_attempt_at timestamptz not null default now(),
+    last_error text,
+    created_at timestamptz not null default now()
+);
+
+-- Serves the workers' "due rows" poll.
+create index if not exists outbox_due_idx
+    on outbox (next_attempt_at)
+    where status in ('queued', 'sending');
@@ -0,0 +1,8 @@
+-- Queued mail whose body or attachments were uploaded as files. The content
+-- lives in the outbox spool directory and rows refer to it by spool name.
+alter table outbox
+    add column if not exists body_spool text;
+
+-- [{"spool": "...", "filename": "...", "content_type": "...", "size": 123}, ...]
+alter table outbox
+    add column if not exists attachments jsonb not null default '[]'::jsonb;
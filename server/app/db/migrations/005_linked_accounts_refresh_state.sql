@@ -0,0 +1,18 @@
+-- Outcome of the token refresher's last failed attempts, shared by all workers
+-- so that revoked or failing accounts don't crowd the due-for-refresh query.
+alter table linked_accounts
+    add column if not exists needs_reauth boolean not null default false;
+
+alter table linked_accounts
+    add column if not exists refresh_failures integer not null default 0;
+
+alter table linked_accounts
+    add column if not exists refresh_failed_at timestamptz;
+
+alter table linked_accounts
+    add column if not exists refresh_retry_at timestamptz;
+
+-- Serves the refresher's "due accounts" query.
+create index if not exists linked_accounts_refresh_due_idx
+    on linked_accounts (token_expiry)
+    where not needs_reauth;
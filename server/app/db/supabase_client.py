@@ -1,4 +1,59 @@
-from supabase import create_client, Client
+import time
+import httpx
+from typing import Optional
+from postgrest import AsyncPostgrestClient
 from app.core.config import settings
+from app.core.metrics import metrics
 
-supabase: Client = create_client(settings.SUPABASE_URL, settings.SUPABASE_KEY)
\ No newline at end of file
+# Async PostgREST client for the Supabase database. It talks to the same REST
+# endpoint as the synchronous supabase-py client did, but over a pooled
+# httpx.AsyncClient so queries never block the event loop.
+_db: Optional[AsyncPostgrestClient] = None
+
+
+def _create_db() -> AsyncPostgrestClient:
+    http_client = httpx.AsyncClient(
+        timeout=httpx.Timeout(settings.DB_QUERY_TIMEOUT_SECONDS),
+        limits=httpx.Limits(
+            max_connections=settings.DB_POOL_SIZE,
+            max_keepalive_connections=settings.DB_POOL_SIZE,
+        ),
+        follow_redirects=True,
+    )
+    return AsyncPostgrestClient(
+        f"{settings.SUPABASE_URL}/rest/v1",
+        headers={
+            "apiKey": settings.SUPABASE_KEY,
+            "Authorization": f"Bearer {settings.SUPABASE_KEY}",
+        },
+        http_client=http_client,
+    )
+
+
+def get_db() -> AsyncPostgrestClient:
+    global _db
+    if _db is None or _db.session.is_closed:
+        _db = _create_db()
+    return _db
+
+
+async def close_db():
+    global _db
+    if _db is not None:
+        await _db.aclose()
+        _db = None
+
+
+async def execute(query, name: str):
+    """
+    Executes a query built from get_db() and records its latency under `name`
+    (e.g. "users.get_by_id") in the db_query_seconds histogram.
+    """
+    start = time.perf_counter()
+    try:
+        return await query.execute()
+    except Exception:
+        metrics.counter("db_query_errors", query=name).inc()
+        raise
+    finally:
+        metrics.histogram("db_query_seconds", query=name).observe(time.perf_counter() - start)
@@ -1,5 +1,8 @@
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends
 from fastapi.middleware.cors import CORSMiddleware
+from app.core.body_limit import BodyLimitMiddleware
+from fastapi.concurrency import run_in_threadpool
+from contextlib import asynccontextmanager
 from app.ws_manager import ConnectionManager
 import socketio
 from socketio import AsyncServer, ASGIApp
@@ -8,13 +11,60 @@ from app.schemas.user import User
 from app.api.deps import get_user_from_token_ws
 
 from app.api.api import api_router
-
-sio = AsyncServer(async_mode='asgi',  cors_allowed_origins="*")
+from app.services.imap_pool import imap_pool
+from app.services.smtp_pool import smtp_pool
+from app.services.outbox_service import mail_outbox
+from app.services.idle_watcher import idle_watcher
+from app.services.search_index import search_indexer
+from app.services.token_refresher import token_refresher
+from app.services.pending_session_sweeper import pending_session_sweeper
+from app.services.handshake_sessions import handshake_table
+from app.services.google_id_token import google_cert_cache
+from app.core.config import settings
+from app.core.http_client import open_http_client, close_http_client
+from app.core.metrics import metrics
+from app.db.supabase_client import close_db
+from app.services.presence import create_client_manager, create_presence_store
+
+sio = AsyncServer(async_mode='asgi',  cors_allowed_origins="*", client_manager=create_client_manager())
+presence_store = create_presence_store()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await open_http_client()
+    await presence_store.start()
+    imap_pool.start()
+    smtp_pool.start()
+    google_cert_cache.start()
+    handshake_table.start()
+    mail_outbox.start(sio)
+    idle_watcher.start(sio)
+    await search_indexer.start()
+    if settings.TOKEN_REFRESHER_ENABLED:
+        token_refresher.start()
+    if settings.PENDING_SESSION_SWEEPER_ENABLED:
+        pending_session_sweeper.start()
+    yield
+    await idle_watcher.stop()
+    await search_indexer.stop()
+    await mail_outbox.stop()
+    await pending_session_sweeper.stop()
+    await handshake_table.stop()
+    await token_refresher.stop()
+    await google_cert_cache.stop()
+    await close_http_client()
+    await close_db()
+    await presence_store.stop()
+    # Log out of any pooled IMAP and SMTP sessions so the provider isn't left holding them.
+    await run_in_threadpool(imap_pool.close_all)
+    await run_in_threadpool(smtp_pool.close_all)
 
 
 app = FastAPI(
     title="QMail API",
-    description="Backend services for the QuMail secure email client."
+    description="Backend services for the QuMail secure email client.",
+    lifespan=lifespan
 )
 
 app_asgi = ASGIApp(sio, other_asgi_app=app, socketio_path='socket.io')
@@ -28,11 +78,18 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Multipart uploads are capped before they are parsed (and spooled); the form
+# fields and part headers get a little room on top of the content limit.
+app.add_middleware(
+    BodyLimitMiddleware,
+    limits={"/api/emails/send/multipart": settings.OUTBOX_MAX_UPLOAD_BYTES + 1024 * 1024},
+)
+
 # --- API Routers ---
 
 app.include_router(api_router, prefix="/api")
 
-manager = ConnectionManager(sio)
+manager = ConnectionManager(sio, presence_store, handshake_table)
 
 @sio.event
 async def connect(sid, environ, auth):
@@ -53,7 +110,8 @@ async def connect(sid, environ, auth):
         user_email = user.email
 
         await manager.connect(sid, user_id, user_email)
-        await sio.save_session(sid, {'user_id': user_id, 'user_email': user_email})
+        if settings.IMAP_IDLE_ENABLED:
+            await idle_watcher.watch(user_id, sid)
         print(f"WebSocket connected: user_id={user_id}, sid={sid}")
         return True
     
@@ -64,25 +122,24 @@ async def connect(sid, environ, auth):
 @sio.event
 async def disconnect(sid):
     try:
-        session = await sio.get_session(sid)
-        if session:
-            await manager.disconnect(session['user_id'])
-            print(f"WebSocket disconnected: user_id={session['user_id']}, sid={sid}")
+        ctx = manager.connections.get(sid)
+        if ctx:
+            await manager.disconnect(ctx.user_id, sid)
+            await idle_watcher.unwatch(ctx.user_id, sid)
+            print(f"WebSocket disconnected: user_id={ctx.user_id}, sid={sid}")
     except Exception as e:
         print(f"WebSocket disconnection error: {e}")
 
 @sio.on('*')
-async def catch_all(event, sid, data):
-
-    allowed_prefixes = ['qkd_', 'check_', 'new_', 'store_']
-
-    if any(event.startswith(prefix) for prefix in allowed_prefixes):
-        session = await sio.get_session(sid)
-        if session:
-            sender_id = session['user_id']
-            sender_email = session['user_email']
-            await manager.handle_message(event, data, sender_id, sender_email)
+async def catch_all(event, sid, data=None):
+    # Unknown events are rejected by the manager's event table in O(1).
+    await manager.handle_message(event, data, sid)
 
 @app.get("/")
 def read_root():
-    return {"status": "QuMail API is running"}
\ No newline at end of file
+    return {"status": "QuMail API is running"}
+
+@app.get("/metrics")
+def read_metrics():
+    """In-process counters and latency histograms for this worker."""
+    return metrics.snapshot()
\ No newline at end of file
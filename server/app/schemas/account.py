@@ -8,6 +8,8 @@ class LinkedAccount(BaseModel):
     email_address: EmailStr
     provider: str
     created_at: datetime
+    # The refresh token was revoked; the user has to link the account again.
+    needs_reauth: bool = False
 
     class Config:
         from_attributes = True
\ No newline at end of file
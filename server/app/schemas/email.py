@@ -1,4 +1,5 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
+from typing import List, Literal
 
 class EmailAccountBase(BaseModel):
     email_address: EmailStr
@@ -19,4 +20,9 @@ class EmailSend(BaseModel):
     subject: str
     body: str 
     is_encrypted: bool
-    protocol: str
\ No newline at end of file
+    protocol: str
+
+class EmailBatchAction(BaseModel):
+    folder: str
+    action: Literal['read', 'star', 'unstar', 'archive', 'delete']
+    uids: List[str] = Field(..., min_length=1, max_length=5000)
@@ -0,0 +1,34 @@
+from pydantic import BaseModel, ConfigDict, Field
+from typing import List, Optional
+
+# Payloads of the Socket.IO events clients may send. Relayed QKD payloads keep
+# any extra fields (bases, orientations, samples...) untouched; only the
+# routing fields are checked. Binary attachments (the packed bit arrays of
+# clients using the 'packed-bits-v1' wire format) arrive as bytes and are
+# forwarded as the same objects, never decoded.
+
+class CheckUserStatusPayload(BaseModel):
+    user_id: str
+
+class PresenceSubscriptionPayload(BaseModel):
+    user_ids: List[str]
+
+class StorePendingSessionPayload(BaseModel):
+    session_id: str
+    initiator_id: str
+    recipient_id: str
+    initiator_email: str
+    recipient_email: str
+
+class PendingAckPayload(BaseModel):
+    cursor: str = Field(..., min_length=1)
+
+class NewMailNotificationPayload(BaseModel):
+    to: str
+    folder: str = "INBOX"
+
+class QkdRelayPayload(BaseModel):
+    model_config = ConfigDict(extra='allow')
+
+    to: str = Field(..., min_length=1)
+    session_id: Optional[str] = None
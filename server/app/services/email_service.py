@@ -1,20 +1,27 @@
-import httpx
+import re
 import smtplib
 import imaplib
 import base64
-import asyncio
+import email
+import email.policy
+import email.utils
+import anyio
 from fastapi.concurrency import run_in_threadpool
-from fastapi import HTTPException
 from email.message import EmailMessage
 from email.utils import formataddr
 from app.core.config import settings
 from app.core.constants import EmailProvider
+from app.core.http_client import post_with_retry
 from app.core.security import decrypt_token, encrypt_token
-from app.db.supabase_client import supabase
-from app.services import user_service
-from app.schemas.email import EmailSend
+from app.db.supabase_client import get_db, execute
+from app.services.imap_pool import ImapSession, imap_pool
+from app.services.mime_stream import SpooledPart, StreamedMessage, send_streamed
+from app.services.mime_structure import bodystructure_parts, join_fetch_response, parse_imap_list
+from app.services.smtp_pool import smtp_pool
+from app.services.token_cache import token_cache
 from datetime import datetime, timedelta, timezone
 from dateutil import parser
+from typing import AsyncIterator, Dict, List, Optional, Tuple, Union
 
 
 IMAP_SERVERS = {EmailProvider.GMAIL: "imap.gmail.com", EmailProvider.YAHOO: "imap.mail.yahoo.com"}
@@ -23,6 +30,10 @@ TOKEN_URIS = {
     EmailProvider.GMAIL: "https://oauth2.googleapis.com/token",
     EmailProvider.YAHOO: "https://api.login.yahoo.com/oauth2/get_token"
 }
+# Clears the token refresher's failure state once the account has working tokens again.
+REFRESH_STATE_RESET = {'needs_reauth': False, 'refresh_failures': 0, 'refresh_failed_at': None, 'refresh_retry_at': None}
+# Keeps each UID STORE/MOVE command line well below provider line-length limits.
+MAX_UID_SET_LENGTH = 1000
 
 async def _refresh_and_update_tokens(linked_account: dict):
     """Async helper to perform the token refresh and DB update."""
@@ -34,14 +45,13 @@ async def _refresh_and_update_tokens(linked_account: dict):
     
     token_data = {'client_id': client_id, 'client_secret': client_secret, 'refresh_token': refresh_token, 'grant_type': 'refresh_token'}
     
-    async with httpx.AsyncClient() as client:
-        res = await client.post(TOKEN_URIS[provider], data=token_data)
-        res.raise_for_status()
-        new_tokens = res.json()
+    res = await post_with_retry(TOKEN_URIS[provider], data=token_data)
+    new_tokens = res.json()
 
     update_payload = {
         'encrypted_access_token': encrypt_token(new_tokens['access_token']),
-        'token_expiry': (datetime.now(timezone.utc) + timedelta(seconds=new_tokens['expires_in'])).isoformat()
+        'token_expiry': (datetime.now(timezone.utc) + timedelta(seconds=new_tokens['expires_in'])).isoformat(),
+        **REFRESH_STATE_RESET,
     }
 
     if 'refresh_token' in new_tokens:
@@ -49,125 +59,271 @@ async def _refresh_and_update_tokens(linked_account: dict):
         # 3. If so, add it to our update payload.
         update_payload['encrypted_refresh_token'] = encrypt_token(new_tokens['refresh_token'])
 
-    supabase.table('linked_accounts').update(update_payload).eq('id', linked_account['id']).execute()
+    await execute(get_db().table('linked_accounts').update(update_payload).eq('id', linked_account['id']), "linked_accounts.update_tokens")
+    token_cache.store(str(linked_account['id']), new_tokens['access_token'], parser.isoparse(update_payload['token_expiry']))
     
     print(f"INFO: Token refresh successful for {linked_account['email_address']}")
     return new_tokens['access_token']
 
-def _get_valid_access_token_sync(linked_account: dict) -> str:
+def _get_cached_access_token(linked_account: dict) -> Optional[str]:
     """
-    Synchronous version of get_valid_access_token.
-    Checks expiry and runs the async refresh function in a new event loop if needed.
+    Returns a usable access token without any network I/O: from the in-process
+    cache if present, otherwise by decrypting the stored token if it isn't
+    about to expire. Returns None when a refresh is needed.
     """
+    account_id = str(linked_account['id'])
+    access_token = token_cache.get(account_id)
+    if access_token:
+        return access_token
+
     expiry_time_str = linked_account.get('token_expiry')
     expiry_time = parser.isoparse(expiry_time_str) if expiry_time_str else None
+    if not token_cache.is_fresh(expiry_time):
+        return None
+
+    access_token = decrypt_token(linked_account['encrypted_access_token'])
+    token_cache.store(account_id, access_token, expiry_time)
+    return access_token
+
+def _get_valid_access_token_sync(linked_account: dict) -> str:
+    """
+    Synchronous version of get_valid_access_token, for code running in the
+    threadpool. A needed refresh is handed to the main event loop so it shares
+    the single-flight refresh with the async path.
+    """
+    access_token = _get_cached_access_token(linked_account)
+    if access_token:
+        return access_token
 
-    if not expiry_time or expiry_time < datetime.now(timezone.utc) + timedelta(seconds=60):
-        print(f"INFO: Token needs refresh in synchronous context for {linked_account['email_address']}.")
-        # Run the async refresh function in a new event loop
-        # This is the standard pattern for calling async code from a sync function.
-        return asyncio.run(_refresh_and_update_tokens(linked_account))
-        
-    return decrypt_token(linked_account['encrypted_access_token'])
+    print(f"INFO: Token needs refresh in synchronous context for {linked_account['email_address']}.")
+    return anyio.from_thread.run(_get_valid_access_token_async, linked_account)
 
 async def _get_valid_access_token_async(linked_account: dict) -> str:
     """
     Checks if the stored access token is expired. If so, uses the refresh token
     to get a new one, updates the database, and returns the new token.
-    Uses httpx for non-blocking network I/O.
+    Concurrent refreshes for the same account collapse into one request.
     """
-    expiry_time_str = linked_account.get('token_expiry')
-    expiry_time =  parser.isoparse(expiry_time_str) if expiry_time_str else None
+    access_token = _get_cached_access_token(linked_account)
+    if access_token:
+        return access_token
 
-    if not expiry_time or expiry_time < (datetime.now(timezone.utc) + timedelta(seconds=60)):
-        return await _refresh_and_update_tokens(linked_account)
-        
-    return decrypt_token(linked_account['encrypted_access_token'])
+    return await token_cache.refresh(str(linked_account['id']), lambda: _refresh_and_update_tokens(linked_account))
 
 def _generate_oauth2_string(email: str, access_token: str) -> str:
     """Generates the XOAUTH2 authentication string for IMAP and SMTP."""
     return f"user={email}\1auth=Bearer {access_token}\1\1"
 
-async def send_email(linked_account: dict, email_data: EmailSend):
-    user_email = linked_account['email_address']
-    qmail_user_profile = await user_service.get_user_by_id(user_id=str(linked_account['user_id']))
-    if not qmail_user_profile:
-        raise HTTPException(status_code=404, detail="Could not find the QMail user profile for this linked account.")
-    
-    display_name = qmail_user_profile['name']
-    provider = linked_account['provider']
-    
-    smtp_host = SMTP_SERVERS.get(provider)
+def build_outgoing_message(from_name: str, from_address: str, recipient: str, subject: str, body: str) -> EmailMessage:
+    msg = EmailMessage()
+    msg['Subject'] = subject
+    msg["From"] = formataddr((from_name, from_address))
+    msg['To'] = recipient
+    msg.set_content(body, subtype='plain', charset='utf-8')
+    return msg
+
+def build_streamed_message(from_name: str, from_address: str, recipient: str, subject: str, body: str, body_path: Optional[str], attachments: List[dict]) -> StreamedMessage:
+    """
+    Builds a message whose body and attachments are read from spooled files
+    while it is being sent. `attachments` are dicts with path, filename and content_type.
+    """
+    parts = [SpooledPart('text/plain; charset="utf-8"', path=body_path, text=None if body_path else body)]
+    parts.extend(
+        SpooledPart(attachment['content_type'], path=attachment['path'], filename=attachment['filename'])
+        for attachment in attachments
+    )
+    return StreamedMessage(from_name, from_address, recipient, subject, parts)
+
+class _TrackingSMTP(smtplib.SMTP_SSL):
+    """SMTP_SSL that records whether the server has accepted MAIL FROM for the current message."""
+    mail_accepted = False
+
+    def mail(self, sender, options=()):
+        code, response = super().mail(sender, options)
+        self.mail_accepted = code == 250
+        return code, response
+
+def _open_smtp_connection(linked_account: dict, access_token: str) -> smtplib.SMTP_SSL:
+    """Opens a new SMTP connection and authenticates it with XOAUTH2."""
+    smtp_host = SMTP_SERVERS.get(linked_account['provider'])
     if not smtp_host:
-        raise HTTPException(status_code=500, detail=f"Unsupported provider: {provider}")
-    
-    access_token = await _get_valid_access_token_async(linked_account)
-    auth_string = _generate_oauth2_string(user_email, access_token)
+        raise ValueError(f"Unsupported provider: {linked_account['provider']}")
+
+    auth_string = _generate_oauth2_string(linked_account['email_address'], access_token)
     xoauth_string = base64.b64encode(auth_string.encode('utf-8')).decode('ascii')
-    
-    msg = EmailMessage()
-    msg['Subject'] = email_data.subject
-    msg["From"] = formataddr((display_name, user_email))
-    msg['To'] = email_data.recipient
-    msg.set_content(email_data.body, subtype='plain', charset='utf-8')
 
-    def _blocking_smtp_send():
-        try:
-            with smtplib.SMTP_SSL(smtp_host, 465) as server:
-                server.ehlo()
-                code, response = server.docmd("AUTH", "XOAUTH2 " + xoauth_string)
-
-                if code != 235:  # 235 = Auth successful
-                    detail = response.decode(errors="ignore")
-                    print(f"SMTP AUTH ERROR: {code} - {detail}")
-                    raise HTTPException(status_code=401, detail=f"Authentication failed: {detail}")
-
-                server.send_message(msg)
-            print(f"Successfully sent email from {user_email}")
-        except smtplib.SMTPAuthenticationError as e:
-            error_detail = e.smtp_error.decode() if hasattr(e.smtp_error, 'decode') else str(e.smtp_error)
-            print(error_detail)
-            raise HTTPException(status_code=401, detail=f"SMTP Authentication failed: {error_detail}")
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Failed to send email: {e}")
-            
-    await run_in_threadpool(_blocking_smtp_send)
-    
-def _execute_imap_command(linked_account: dict, folder: str, command, *args):
-    """A helper function to handle the async IMAP connection and authentication."""
-    user_email = linked_account['email_address']
-    provider = linked_account['provider']
-    imap = None
+    smtp = _TrackingSMTP(smtp_host, 465, timeout=settings.SMTP_TIMEOUT_SECONDS)
     try:
-        access_token = _get_valid_access_token_sync(linked_account)
-        auth_string = _generate_oauth2_string(user_email, access_token)
+        smtp.ehlo()
+        code, response = smtp.docmd("AUTH", "XOAUTH2 " + xoauth_string)
+        if code != 235:  # 235 = Auth successful
+            raise smtplib.SMTPAuthenticationError(code, response)
+    except Exception:
+        smtp.close()
+        raise
+    return smtp
 
-        imap = imaplib.IMAP4_SSL(host=IMAP_SERVERS.get(provider))
-        imap.authenticate('XOAUTH2', lambda x: auth_string.encode('utf-8'))
-        imap.select(f'"{folder}"')
+def _send(smtp: smtplib.SMTP, msg: Union[EmailMessage, StreamedMessage]):
+    smtp.mail_accepted = False
+    if isinstance(msg, StreamedMessage):
+        send_streamed(smtp, msg)
+    else:
+        smtp.send_message(msg)
 
-        result = command(imap, *args)
-        return result
+def deliver_message(linked_account: dict, access_token: str, msg: Union[EmailMessage, StreamedMessage]):
+    """
+    Sends a message over a pooled, authenticated SMTP connection. Runs in the
+    threadpool. A pooled connection the server dropped while it sat idle is
+    replaced once, but only if the server never accepted MAIL FROM on it: a
+    disconnect later in the transaction (after DATA, or while waiting for its
+    reply) may follow a delivery, so it is left to the outbox's retry policy.
+    """
+    account_id = str(linked_account['id'])
+    connect = lambda: _open_smtp_connection(linked_account, access_token)
+    smtp = None
+    try:
+        with smtp_pool.connection(account_id, access_token, connect) as smtp:
+            _send(smtp, msg)
+    except smtplib.SMTPServerDisconnected:
+        if smtp is None or smtp.mail_accepted:
+            raise
+        with smtp_pool.connection(account_id, access_token, connect) as smtp:
+            _send(smtp, msg)
+    print(f"Successfully sent email from {linked_account['email_address']}")
+
+def _open_imap_connection(linked_account: dict, access_token: str) -> imaplib.IMAP4_SSL:
+    """Opens a new IMAP connection and authenticates it with XOAUTH2."""
+    auth_string = _generate_oauth2_string(linked_account['email_address'], access_token)
+    imap = imaplib.IMAP4_SSL(host=IMAP_SERVERS.get(linked_account['provider']))
+    imap.authenticate('XOAUTH2', lambda x: auth_string.encode('utf-8'))
+    return imap
+
+def _execute_imap_command(linked_account: dict, folder: Optional[str], command, *args):
+    """
+    Runs an IMAP command on a pooled, authenticated session with `folder` selected
+    (or, with folder=None, leaves selecting to the command).
+    The command receives the ImapSession so it can consult the cached capabilities.
+    """
+    try:
+        access_token = _get_valid_access_token_sync(linked_account)
+        with imap_pool.session(
+            str(linked_account['id']),
+            access_token,
+            lambda: _open_imap_connection(linked_account, access_token)
+        ) as session:
+            if folder is not None:
+                session.select(folder)
+            return command(session, *args)
     except Exception as e:
         print(f"ERROR in IMAP command execution: {e}")
         raise
-    finally:
-        if imap:
-            try:
-                imap.logout()
-            except:
-                pass
 
-def imap_set_flag(imap, uid, flag):
-    imap.uid('store', uid, '+FLAGS', flag)
+async def run_imap_command(linked_account: dict, folder: Optional[str], command, *args):
+    """Runs `command(session, *args)` in the threadpool on a pooled session; see _execute_imap_command."""
+    return await run_in_threadpool(_execute_imap_command, linked_account, folder, command, *args)
 
-def imap_remove_flag(imap, uid, flag):
-    imap.uid('store', uid, '-FLAGS', flag)
+def compress_uid_set(uids: List[int]) -> List[Tuple[str, List[int]]]:
+    """
+    Collapses UIDs into compact IMAP sequence sets such as '1:50,52,60:80'.
+    Long selections are split so that no single set exceeds MAX_UID_SET_LENGTH
+    characters. Returns (sequence_set, member_uids) pairs.
+    """
+    ranges: List[List[int]] = []
+    for uid in sorted(set(uids)):
+        if ranges and uid == ranges[-1][1] + 1:
+            ranges[-1][1] = uid
+        else:
+            ranges.append([uid, uid])
 
-def imap_move_email(imap, uid, destination):
-    imap.uid('copy', uid, destination)
+    groups: List[Tuple[str, List[int]]] = []
+    parts: List[str] = []
+    members: List[int] = []
+    length = 0
+    for start, end in ranges:
+        part = str(start) if start == end else f"{start}:{end}"
+        if parts and length + len(part) + 1 > MAX_UID_SET_LENGTH:
+            groups.append((",".join(parts), members))
+            parts, members, length = [], [], 0
+        parts.append(part)
+        members.extend(range(start, end + 1))
+        length += len(part) + 1
+    if parts:
+        groups.append((",".join(parts), members))
+    return groups
+
+def imap_set_flag(session: ImapSession, uid, flag):
+    typ, _ = session.imap.uid('store', uid, '+FLAGS', flag)
+    return typ == 'OK'
+
+def imap_remove_flag(session: ImapSession, uid, flag):
+    typ, _ = session.imap.uid('store', uid, '-FLAGS', flag)
+    return typ == 'OK'
+
+def imap_move_email(session: ImapSession, uid, destination):
+    """
+    Moves messages using RFC 6851 UID MOVE when available. Otherwise falls back
+    to COPY + \\Deleted, expunging only the moved UIDs when the server supports
+    UIDPLUS so that unrelated deleted messages are left alone.
+    """
+    imap = session.imap
+    destination = f'"{destination}"'
+    if session.has_capability('MOVE'):
+        typ, _ = imap.uid('MOVE', uid, destination)
+        return typ == 'OK'
+
+    typ, _ = imap.uid('copy', uid, destination)
+    if typ != 'OK':
+        return False
     imap.uid('store', uid, '+FLAGS', '(\\Deleted)')
-    imap.expunge()
+    if session.has_capability('UIDPLUS'):
+        imap.uid('EXPUNGE', uid)
+    else:
+        imap.expunge()
+    return True
+
+def imap_archive_email(session: ImapSession, uid, archive_folder):
+    """
+    On Gmail, archiving from the inbox only needs the \\Inbox label removed, which
+    leaves the message where it is instead of copying it to All Mail.
+    """
+    if session.has_capability('X-GM-EXT-1') and (session.selected_folder or '').upper() == 'INBOX':
+        typ, _ = session.imap.uid('store', uid, '-X-GM-LABELS', '(\\Inbox)')
+        return typ == 'OK'
+    return imap_move_email(session, uid, archive_folder)
+
+def imap_apply_to_uid_sets(session: ImapSession, uid_sets: List[Tuple[str, List[int]]], operation, *args) -> Dict[str, str]:
+    """Runs `operation` once per UID sequence set and reports the outcome for every member UID."""
+    results = {}
+    for uid_set, members in uid_sets:
+        try:
+            ok = operation(session, uid_set, *args)
+        except imaplib.IMAP4.abort:
+            raise
+        except imaplib.IMAP4.error as e:
+            print(f"ERROR applying IMAP operation to UID set {uid_set}: {e}")
+            ok = False
+        for uid in members:
+            results[str(uid)] = "ok" if ok else "failed"
+    return results
+
+async def _apply_batch(linked_account: dict, folder: str, email_uids: List[str], operation, *args) -> Dict[str, str]:
+    """Applies `operation` to all `email_uids` on a single IMAP session, grouped into UID sets."""
+    results: Dict[str, str] = {}
+    uid_map: Dict[int, List[str]] = {}
+    for uid in email_uids:
+        if uid.isascii() and uid.isdigit() and int(uid) > 0:
+            uid_map.setdefault(int(uid), []).append(uid)
+        else:
+            results[uid] = "invalid"
+
+    if uid_map:
+        set_results = await run_in_threadpool(
+            _execute_imap_command, linked_account, folder, imap_apply_to_uid_sets, compress_uid_set(list(uid_map)), operation, *args
+        )
+        for uid, originals in uid_map.items():
+            for original in originals:
+                results[original] = set_results[str(uid)]
+    return results
 
 async def set_email_flag(linked_account: dict, folder: str, email_uid: str, flag: str):
     await run_in_threadpool(_execute_imap_command, linked_account, folder, imap_set_flag, email_uid, flag)
@@ -179,4 +335,312 @@ async def remove_email_flag(linked_account: dict, folder: str, email_uid: str, f
 
 async def move_email(linked_account: dict, current_folder: str, email_uid: str, destination_folder: str):
     await run_in_threadpool(_execute_imap_command, linked_account, current_folder, imap_move_email, email_uid, destination_folder)
-    print(f"Production: Moved email {email_uid} to {destination_folder}")
\ No newline at end of file
+    print(f"Production: Moved email {email_uid} to {destination_folder}")
+
+async def archive_email(linked_account: dict, current_folder: str, email_uid: str, archive_folder: str):
+    await run_in_threadpool(_execute_imap_command, linked_account, current_folder, imap_archive_email, email_uid, archive_folder)
+    print(f"Production: Archived email {email_uid}")
+
+async def batch_set_email_flag(linked_account: dict, folder: str, email_uids: List[str], flag: str) -> Dict[str, str]:
+    results = await _apply_batch(linked_account, folder, email_uids, imap_set_flag, flag)
+    print(f"Production: Set flag {flag} for {len(email_uids)} email(s)")
+    return results
+
+async def batch_remove_email_flag(linked_account: dict, folder: str, email_uids: List[str], flag: str) -> Dict[str, str]:
+    results = await _apply_batch(linked_account, folder, email_uids, imap_remove_flag, flag)
+    print(f"Production: Removed flag {flag} for {len(email_uids)} email(s)")
+    return results
+
+async def batch_move_emails(linked_account: dict, current_folder: str, email_uids: List[str], destination_folder: str) -> Dict[str, str]:
+    results = await _apply_batch(linked_account, current_folder, email_uids, imap_move_email, destination_folder)
+    print(f"Production: Moved {len(email_uids)} email(s) to {destination_folder}")
+    return results
+
+async def batch_archive_emails(linked_account: dict, current_folder: str, email_uids: List[str], archive_folder: str) -> Dict[str, str]:
+    results = await _apply_batch(linked_account, current_folder, email_uids, imap_archive_email, archive_folder)
+    print(f"Production: Archived {len(email_uids)} email(s)")
+    return results
+
+FETCH_UID_RE = re.compile(rb'UID (\d+)')
+FETCH_FLAGS_RE = re.compile(rb'FLAGS \(([^)]*)\)')
+FETCH_MODSEQ_RE = re.compile(rb'MODSEQ \((\d+)\)')
+
+def format_uid_ranges(uids: List[int]) -> str:
+    """Formats UIDs as one compact sequence set ('1:50,52,60:80'), however long."""
+    return ",".join(uid_set for uid_set, _ in compress_uid_set(uids))
+
+def _response_int(responses: Dict[str, list], name: str) -> Optional[int]:
+    values = responses.get(name)
+    if not values or values[-1] is None:
+        return None
+    return int(values[-1].split()[0])
+
+def _parse_changed(fetch_responses: list) -> List[Tuple[int, List[str], int]]:
+    """Parses untagged FETCH data into (uid, flags, modseq) tuples."""
+    changed = []
+    for data in fetch_responses:
+        if isinstance(data, tuple):
+            data = data[0]
+        uid = FETCH_UID_RE.search(data)
+        if not uid:
+            continue
+        flags = FETCH_FLAGS_RE.search(data)
+        modseq = FETCH_MODSEQ_RE.search(data)
+        changed.append((
+            int(uid.group(1)),
+            flags.group(1).decode(errors='ignore').split() if flags else [],
+            int(modseq.group(1)) if modseq else 0,
+        ))
+    return changed
+
+def imap_delta_sync(session: ImapSession, folder: str, uidvalidity: Optional[int], highestmodseq: Optional[int]) -> dict:
+    """
+    Computes what changed in `folder` since the client's (uidvalidity, highestmodseq).
+
+    With QRESYNC a single SELECT returns the vanished UIDs and the changed
+    messages. With only CONDSTORE the changes come from UID FETCH ... CHANGEDSINCE
+    and, as expunges can't be listed, the current UIDs are returned as a compact
+    sequence set for the client to diff against. When the UIDVALIDITY no longer
+    matches, mode is "reset" and the client must resync. Without CONDSTORE mode
+    is "unsupported", still with the folder's UIDVALIDITY and UIDNEXT.
+    """
+    can_resume = uidvalidity is not None and highestmodseq is not None
+    use_qresync = can_resume and session.has_capability('QRESYNC') and session.enable('QRESYNC')
+    if use_qresync:
+        responses = session.select_with(folder, f'(QRESYNC ({uidvalidity} {highestmodseq}))')
+    elif session.has_capability('CONDSTORE'):
+        responses = session.select_with(folder, '(CONDSTORE)')
+    else:
+        responses = session.select_with(folder)
+
+    state = {
+        "uidvalidity": _response_int(responses, 'UIDVALIDITY'),
+        "highestmodseq": _response_int(responses, 'HIGHESTMODSEQ'),
+        "uidnext": _response_int(responses, 'UIDNEXT'),
+        "exists": _response_int(responses, 'EXISTS'),
+    }
+    if state["highestmodseq"] is None:
+        # No CONDSTORE, or the server answered NOMODSEQ: this mailbox doesn't keep mod-sequences.
+        return {"mode": "unsupported", **state}
+    if not can_resume or state["uidvalidity"] != uidvalidity:
+        return {"mode": "reset", **state}
+
+    if use_qresync:
+        vanished = [
+            data.split(b')', 1)[-1].strip() if data.startswith(b'(') else data.strip()
+            for data in responses.get('VANISHED', []) if data
+        ]
+        return {
+            "mode": "qresync", **state,
+            "vanished": b",".join(vanished).decode(),
+            "changed": _parse_changed(responses.get('FETCH', [])),
+        }
+
+    typ, data = session.imap.uid('FETCH', '1:*', '(UID FLAGS)', f'(CHANGEDSINCE {highestmodseq})')
+    if typ != 'OK':
+        raise imaplib.IMAP4.error(f"CHANGEDSINCE fetch failed: {data}")
+    changed = _parse_changed([item for item in data if item])
+    typ, data = session.imap.uid('SEARCH', 'ALL')
+    if typ != 'OK':
+        raise imaplib.IMAP4.error(f"UID SEARCH failed: {data}")
+    present = [int(uid) for uid in (data[0] or b'').split()]
+    return {"mode": "condstore", **state, "present": format_uid_ranges(present), "changed": changed}
+
+async def delta_sync(linked_account: dict, folder: str, uidvalidity: Optional[int], highestmodseq: Optional[int]) -> dict:
+    return await run_in_threadpool(_execute_imap_command, linked_account, None, imap_delta_sync, folder, uidvalidity, highestmodseq)
+
+# A body section as accepted by BODY[...] (match the whole string): empty, HEADER or TEXT, or
+# a part number optionally followed by .HEADER, .TEXT or .MIME.
+SECTION_RE = re.compile(r'(?:[0-9]+(?:\.[0-9]+)*(?:\.(?:HEADER|TEXT|MIME))?|HEADER|TEXT)?')
+PART_NUMBER_RE = re.compile(r'[0-9]+(?:\.[0-9]+)*')
+FETCH_SIZE_RE = re.compile(rb'RFC822\.SIZE (\d+)')
+
+def _fetch_item(session: ImapSession, uid: str, item: str) -> Optional[bytes]:
+    """
+    Fetches one literal item of a message. Returns None if the UID doesn't exist
+    and b'' if the item is empty (e.g. a partial fetch past the end).
+    """
+    typ, data = session.imap.uid('FETCH', uid, item)
+    if typ != 'OK':
+        raise imaplib.IMAP4.error(f"UID FETCH {item} failed: {data}")
+    if not any(data):
+        return None
+    for entry in data:
+        if isinstance(entry, tuple):
+            return entry[1]
+    return b''
+
+def imap_fetch_headers(session: ImapSession, uid: str) -> Optional[bytes]:
+    return _fetch_item(session, uid, '(BODY.PEEK[HEADER])')
+
+def imap_fetch_structure(session: ImapSession, uid: str) -> Optional[dict]:
+    typ, data = session.imap.uid('FETCH', uid, '(RFC822.SIZE BODYSTRUCTURE)')
+    if typ != 'OK':
+        raise imaplib.IMAP4.error(f"UID FETCH BODYSTRUCTURE failed: {data}")
+    if not any(data):
+        return None
+    line = join_fetch_response(data)
+    size = FETCH_SIZE_RE.search(line)
+    start = line.find(b'BODYSTRUCTURE ')
+    if start < 0:
+        raise imaplib.IMAP4.error(f"No BODYSTRUCTURE in response: {line[:200]!r}")
+    structure = parse_imap_list(line[start + len(b'BODYSTRUCTURE '):])[0]
+    return {"uid": uid, "size": int(size.group(1)) if size else None, "parts": bodystructure_parts(structure)}
+
+def imap_fetch_partial(session: ImapSession, uid: str, section: str, offset: int, length: int) -> Optional[bytes]:
+    return _fetch_item(session, uid, f'(BODY.PEEK[{section}]<{offset}.{length}>)')
+
+def imap_section_size(session: ImapSession, uid: str, section: str) -> Optional[int]:
+    """
+    The size of a body section as BODYSTRUCTURE reports it, i.e. what a full
+    BODY[section] fetch returns. None for HEADER, TEXT and MIME sections and
+    parts the structure doesn't list.
+    """
+    if section and not PART_NUMBER_RE.fullmatch(section):
+        return None
+    structure = imap_fetch_structure(session, uid)
+    if structure is None:
+        return None
+    if not section:
+        return structure["size"]
+    return next((part["size"] for part in structure["parts"] if part["section"] == section), None)
+
+def imap_fetch_first_partial(session: ImapSession, uid: str, section: str, offset: int, length: int) -> Optional[Tuple[bytes, Optional[int]]]:
+    """A partial fetch plus, when it didn't reach the end of the section, the section's size."""
+    data = imap_fetch_partial(session, uid, section, offset, length)
+    if data is None:
+        return None
+    return data, imap_section_size(session, uid, section) if len(data) == length else None
+
+async def fetch_headers(linked_account: dict, folder: str, email_uid: str) -> Optional[bytes]:
+    return await run_in_threadpool(_execute_imap_command, linked_account, folder, imap_fetch_headers, email_uid)
+
+async def fetch_structure(linked_account: dict, folder: str, email_uid: str) -> Optional[dict]:
+    return await run_in_threadpool(_execute_imap_command, linked_account, folder, imap_fetch_structure, email_uid)
+
+async def stream_message_part(linked_account: dict, folder: str, email_uid: str, section: str, offset: int = 0, length: Optional[int] = None) -> Optional[Tuple[AsyncIterator[bytes], Optional[int]]]:
+    """
+    Streams `length` bytes (or everything) of a body section from `offset`, in
+    partial fetches of IMAP_FETCH_CHUNK_BYTES, so neither the message nor the
+    part is ever held in memory whole. Each chunk borrows a pooled session only
+    for its own fetch, so a slow client doesn't pin an IMAP connection.
+
+    The first chunk is fetched before returning, so that a missing message can
+    still be answered with a 404; None is returned in that case. Otherwise
+    returns the chunks and how many bytes they add up to, which is known when
+    the first chunk already reached the end or the section is a part whose
+    size BODYSTRUCTURE gives (and None otherwise).
+    """
+    chunk_bytes = settings.IMAP_FETCH_CHUNK_BYTES
+
+    async def fetch(position: int, size: int) -> Optional[bytes]:
+        return await run_in_threadpool(_execute_imap_command, linked_account, folder, imap_fetch_partial, email_uid, section, position, size)
+
+    size = min(chunk_bytes, length) if length is not None else chunk_bytes
+    fetched = await run_in_threadpool(
+        _execute_imap_command, linked_account, folder, imap_fetch_first_partial, email_uid, section, offset, size
+    )
+    if fetched is None:
+        return None
+    first, section_size = fetched
+    if len(first) < size:
+        total = len(first)
+    elif section_size is not None:
+        available = max(section_size - offset, 0)
+        total = min(available, length) if length is not None else available
+    else:
+        total = None
+
+    async def chunks():
+        data, position, remaining, requested = first, offset, length, size
+        while data:
+            yield data
+            position += len(data)
+            if remaining is not None:
+                remaining -= len(data)
+            if len(data) < requested or remaining == 0:
+                return
+            requested = min(chunk_bytes, remaining) if remaining is not None else chunk_bytes
+            data = await fetch(position, requested)
+
+    return chunks(), total
+
+# What the search index stores per message: the address and subject headers,
+# plus enough of the body for a snippet (and the QMail armor with its SessionID).
+INDEX_FETCH_ITEMS = '(UID FLAGS BODY.PEEK[HEADER.FIELDS (FROM TO CC SUBJECT DATE CONTENT-TYPE CONTENT-TRANSFER-ENCODING)] BODY.PEEK[TEXT]<0.4096>)'
+FETCH_START_RE = re.compile(rb'^\d+ \(')
+QMAIL_ARMOR = '---BEGIN QMail MESSAGE---'
+QMAIL_SESSION_RE = re.compile(r'SessionID: ([\w-]+)')
+SNIPPET_LENGTH = 200
+
+def imap_search_all(session: ImapSession) -> List[int]:
+    typ, data = session.imap.uid('SEARCH', 'ALL')
+    if typ != 'OK':
+        raise imaplib.IMAP4.error(f"UID SEARCH failed: {data}")
+    return sorted(int(uid) for uid in (data[0] or b'').split())
+
+def _first_text(msg: email.message.Message) -> str:
+    for part in msg.walk():
+        if part.get_content_type() == 'text/plain' and not part.is_attachment():
+            try:
+                return part.get_content()
+            except Exception:
+                # A body cut off mid-encoding; keep whatever decodes.
+                payload = part.get_payload(decode=True) or b''
+                return payload.decode(part.get_content_charset() or 'utf-8', errors='ignore')
+    return ''
+
+def _index_record(uid: int, flags: List[str], header: bytes, text: bytes) -> dict:
+    msg = email.message_from_bytes(header + text, policy=email.policy.default)
+    recipients = ", ".join(str(msg[name]) for name in ('To', 'Cc') if msg[name])
+    try:
+        sent_at = int(email.utils.parsedate_to_datetime(str(msg['Date'])).timestamp())
+    except Exception:
+        sent_at = 0
+
+    body = _first_text(msg).lstrip()
+    session_id = snippet = None
+    if body.startswith(QMAIL_ARMOR):
+        match = QMAIL_SESSION_RE.search(body)
+        session_id = match.group(1) if match else None
+    else:
+        snippet = " ".join(body[:SNIPPET_LENGTH * 2].split())[:SNIPPET_LENGTH]
+    return {
+        "uid": uid,
+        "sender": str(msg['From'] or ''),
+        "recipients": recipients,
+        "subject": str(msg['Subject'] or ''),
+        "sent_at": sent_at,
+        "flags": flags,
+        "session_id": session_id,
+        "snippet": snippet,
+    }
+
+def imap_fetch_index_records(session: ImapSession, uids: List[int]) -> List[dict]:
+    """Fetches the searchable headers, flags and a body snippet of `uids` in the selected folder."""
+    typ, data = session.imap.uid('FETCH', format_uid_ranges(uids), INDEX_FETCH_ITEMS)
+    if typ != 'OK':
+        raise imaplib.IMAP4.error(f"UID FETCH for indexing failed: {data}")
+
+    records, current = [], None
+    for item in data:
+        prefix = item[0] if isinstance(item, tuple) else item
+        if not prefix:
+            continue
+        if FETCH_START_RE.match(prefix):
+            current = {"uid": None, "flags": [], "header": b'', "text": b''}
+            records.append(current)
+        if current is None:
+            continue
+        uid = FETCH_UID_RE.search(prefix)
+        if uid:
+            current["uid"] = int(uid.group(1))
+        flags = FETCH_FLAGS_RE.search(prefix)
+        if flags:
+            current["flags"] = flags.group(1).decode(errors='ignore').split()
+        if isinstance(item, tuple):
+            current["header" if b'HEADER.FIELDS' in prefix else "text"] = item[1]
+    return [
+        _index_record(record["uid"], record["flags"], record["header"], record["text"])
+        for record in records if record["uid"] is not None
+    ]
@@ -0,0 +1,109 @@
+# app/services/google_id_token.py
+import asyncio
+import re
+import time
+from typing import Dict, Optional
+
+from google.auth import jwt as google_jwt
+from jose import jwt as jose_jwt
+
+from app.core.http_client import get_http_client
+
+GOOGLE_CERTS_URL = "https://www.googleapis.com/oauth2/v1/certs"
+GOOGLE_ISSUERS = ("accounts.google.com", "https://accounts.google.com")
+# Used when Google's response carries no usable Cache-Control max-age.
+DEFAULT_MAX_AGE_SECONDS = 3600
+# Refresh this long before the cached certificates expire.
+REFRESH_AHEAD_SECONDS = 300
+CLOCK_SKEW_SECONDS = 10
+UNKNOWN_KEY_REFETCH_SECONDS = 60
+
+
+class GoogleCertCache:
+    """
+    Keeps Google's ID-token signing certificates in memory for as long as the
+    Cache-Control max-age allows, and refreshes them in the background ahead
+    of expiry. Sign-ins therefore verify signatures locally instead of making
+    a blocking request to Google on the event loop.
+    """
+    def __init__(self):
+        self._certs: Dict[str, str] = {}
+        self._expires_at = 0.0
+        self._fetched_at = float('-inf')
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                print(f"ERROR: Could not refresh Google signing certificates: {e}")
+                await asyncio.sleep(30)
+                continue
+            await asyncio.sleep(max(self._expires_at - time.monotonic() - REFRESH_AHEAD_SECONDS, 30))
+
+    async def refresh(self):
+        async with self._lock:
+            await self._fetch()
+
+    async def _fetch(self):
+        response = await get_http_client().get(GOOGLE_CERTS_URL)
+        response.raise_for_status()
+        match = re.search(r"max-age=(\d+)", response.headers.get("Cache-Control", ""))
+        max_age = int(match.group(1)) if match else DEFAULT_MAX_AGE_SECONDS
+        self._certs = response.json()
+        self._fetched_at = time.monotonic()
+        self._expires_at = self._fetched_at + max_age
+
+    def _needs_refresh(self, key_id: Optional[str]) -> bool:
+        now = time.monotonic()
+        if now >= self._expires_at:
+            return True
+        # An unknown key id usually means Google rotated its keys, but don't let
+        # tokens with made-up key ids trigger a fetch on every request.
+        return bool(key_id) and key_id not in self._certs and now - self._fetched_at >= UNKNOWN_KEY_REFETCH_SECONDS
+
+    async def get_certs(self, key_id: Optional[str] = None) -> Dict[str, str]:
+        """
+        Returns the cached certificates, fetching them only if they have expired
+        or don't contain `key_id`. Concurrent callers share a single fetch.
+        """
+        if self._needs_refresh(key_id):
+            async with self._lock:
+                if self._needs_refresh(key_id):
+                    await self._fetch()
+        return self._certs
+
+
+google_cert_cache = GoogleCertCache()
+
+
+async def verify_google_id_token(token: str, audience: str) -> dict:
+    """
+    Verifies a Google ID token's signature, audience, expiry and issuer
+    against the cached certificates. Raises ValueError if it isn't valid.
+    """
+    try:
+        key_id = jose_jwt.get_unverified_header(token).get("kid")
+    except Exception as e:
+        raise ValueError(f"Malformed ID token: {e}")
+
+    certs = await google_cert_cache.get_certs(key_id)
+    claims = google_jwt.decode(token, certs=certs, audience=audience, clock_skew_in_seconds=CLOCK_SKEW_SECONDS)
+    if claims.get("iss") not in GOOGLE_ISSUERS:
+        raise ValueError(f"Wrong issuer: {claims.get('iss')}")
+    return claims
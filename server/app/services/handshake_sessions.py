@@ -0,0 +1,307 @@
+# app/services/handshake_sessions.py
+import asyncio
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from app.core.config import settings
+from app.core.metrics import metrics
+
+INITIATOR = "initiator"
+RESPONDER = "responder"
+
+# The handshake's messages in protocol order, with the side allowed to send each.
+HANDSHAKE_STEPS = (
+    ("qkd_initiate", INITIATOR),
+    ("qkd_bob_bases", RESPONDER),
+    ("qkd_alice_bases", INITIATOR),
+    ("qkd_alice_sample", INITIATOR),
+    ("qkd_handshake_complete", RESPONDER),
+    ("qkd_alice_pa_choice", INITIATOR),
+)
+STEP_INDEX = {event: index for index, (event, _) in enumerate(HANDSHAKE_STEPS)}
+STEP_ROLE = dict(HANDSHAKE_STEPS)
+FINAL_STEP = len(HANDSHAKE_STEPS) - 1
+LAST_STEP_OF_ROLE = {role: index for index, (_, role) in enumerate(HANDSHAKE_STEPS)}
+
+# Whole handshakes take seconds, not milliseconds.
+HANDSHAKE_DURATION_BUCKETS = (0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+class HandshakeSession:
+    __slots__ = ("session_id", "initiator_id", "responder_id", "owner_id", "step", "started_at", "deadline", "slot", "adopted")
+
+    def __init__(self, session_id: str, initiator_id: str, responder_id: str, owner_id: str, step: int, now: float, deadline: float):
+        self.session_id = session_id
+        self.initiator_id = initiator_id
+        self.responder_id = responder_id
+        # The local user the record counts against in max_active_per_user.
+        self.owner_id = owner_id
+        self.step = step
+        self.started_at = now
+        self.deadline = deadline
+        self.slot = -1
+        self.adopted = False
+
+    def participant(self, role: str) -> str:
+        return self.initiator_id if role == INITIATOR else self.responder_id
+
+    def counterpart(self, user_id: str) -> str:
+        return self.responder_id if user_id == self.initiator_id else self.initiator_id
+
+
+class RedisHandshakeDirectory:
+    """
+    Who the two participants of each handshake are, shared by every worker
+    through Redis. The initiator's worker registers a session on `qkd_initiate`
+    and the other worker looks it up before relaying a step it hasn't seen,
+    so a session can't be adopted under participants a client made up.
+    Entries expire after `ttl` seconds, the longest a handshake can take.
+    """
+    KEY_PREFIX = "qmail:handshake:"
+
+    def __init__(self, url: str, ttl: int):
+        import redis.asyncio as redis_asyncio
+        self._redis = redis_asyncio.from_url(url, decode_responses=True)
+        self.ttl = ttl
+
+    async def close(self):
+        await self._redis.aclose()
+
+    async def register(self, session_id: str, initiator_id: str, responder_id: str) -> bool:
+        """Claims the session_id for the pair. Returns False if another pair already holds it."""
+        key, value = self.KEY_PREFIX + session_id, f"{initiator_id}\n{responder_id}"
+        if await self._redis.set(key, value, ex=self.ttl, nx=True):
+            return True
+        if await self._redis.get(key) != value:
+            return False
+        await self._redis.expire(key, self.ttl)  # The initiator restarted the same handshake.
+        return True
+
+    async def lookup(self, session_id: str) -> Optional[Tuple[str, str]]:
+        """Returns (initiator_id, responder_id), or None for an unknown session."""
+        value = await self._redis.get(self.KEY_PREFIX + session_id)
+        if not value:
+            return None
+        initiator_id, _, responder_id = value.partition("\n")
+        return initiator_id, responder_id
+
+    async def forget(self, session_id: str):
+        await self._redis.delete(self.KEY_PREFIX + session_id)
+
+
+class HandshakeTable:
+    """
+    In-memory table of the QKD handshakes relayed by this worker, keyed by
+    session_id. Each record holds the two participants, the last step seen and
+    a deadline that every accepted step pushes `step_timeout` seconds out.
+
+    Messages are routed to the other participant of the session rather than to
+    whatever 'to' the client names, and a step is only accepted from the side
+    that owns it and after the steps before it. Handshakes that stall are
+    evicted by a timer wheel: records sit in the slot of their deadline, and a
+    tick every `tick` seconds only looks at the slot that just came due.
+
+    With a backplane the two participants are usually connected to different
+    workers, each of which only sees its own user's messages. In that case a
+    `directory` shared by the workers records each session's participants on
+    `qkd_initiate`. A worker adopts a session it doesn't know from the first
+    step its local user sends, but only if the directory lists that user in the
+    step's role, and relays it to the participants named there. An adopted
+    session counts against its local sender's limit, may skip the steps the
+    other worker relayed, and is dropped after its local participant's last step.
+    """
+    def __init__(self, step_timeout: float, tick: float, max_active_per_user: int, directory: Optional[RedisHandshakeDirectory] = None):
+        self.step_timeout = step_timeout
+        self.tick = tick
+        self.max_active_per_user = max_active_per_user
+        self.directory = directory
+        self._sessions: Dict[str, HandshakeSession] = {}
+        self._active_by_user: Dict[str, int] = {}
+        self._wheel: List[Set[str]] = [set() for _ in range(int(step_timeout // tick) + 2)]
+        self._next_tick = int(time.monotonic() // tick)
+        self._task: Optional[asyncio.Task] = None
+
+        self._durations = metrics.histogram("qkd_handshake_seconds", buckets=HANDSHAKE_DURATION_BUCKETS)
+        self._outcomes = {
+            outcome: metrics.counter("qkd_handshakes", outcome=outcome)
+            for outcome in ("started", "completed", "timed_out", "rejected_step", "rejected_limit")
+        }
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.directory is not None:
+            await self.directory.close()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    async def begin(self, session_id: str, initiator_id: str, responder_id: str) -> Optional[str]:
+        """
+        Records a new handshake from `qkd_initiate` and returns the user to relay
+        it to, or None if the initiator already has too many handshakes open or
+        the session_id belongs to someone else's handshake.
+        """
+        existing = self._sessions.get(session_id)
+        if existing is not None:
+            if existing.initiator_id != initiator_id or existing.responder_id != responder_id:
+                self._outcomes["rejected_step"].inc()
+                return None
+        elif self._active_by_user.get(initiator_id, 0) >= self.max_active_per_user:
+            self._outcomes["rejected_limit"].inc()
+            return None
+
+        if self.directory is not None and not await self._register(session_id, initiator_id, responder_id):
+            self._outcomes["rejected_step"].inc()
+            return None
+        existing = self._sessions.get(session_id)
+        if existing is not None:
+            # The initiator restarted the same handshake.
+            self._remove(existing)
+        self._add(session_id, initiator_id, responder_id, initiator_id, STEP_INDEX["qkd_initiate"])
+        self._outcomes["started"].inc()
+        return responder_id
+
+    async def _register(self, session_id: str, initiator_id: str, responder_id: str) -> bool:
+        try:
+            return await self.directory.register(session_id, initiator_id, responder_id)
+        except Exception as e:
+            print(f"ERROR: Could not register QKD handshake {session_id}: {e}")
+            return False
+
+    async def advance(self, session_id: str, event: str, sender_id: str) -> Optional[str]:
+        """
+        Accepts the next step of a handshake from `sender_id` and returns the user
+        to relay it to, or None if the step is out of order, from the wrong side
+        or for a session neither this worker nor the directory knows.
+        """
+        step = STEP_INDEX[event]
+        role = STEP_ROLE[event]
+        record = self._sessions.get(session_id) or await self._adopt(session_id, role, sender_id, step)
+        if record is None:
+            return None
+
+        expected = record.step + 1
+        in_order = step == expected or (self.directory is not None and step > record.step)
+        if not in_order or record.participant(role) != sender_id:
+            self._outcomes["rejected_step"].inc()
+            return None
+
+        recipient_id = record.counterpart(sender_id)
+        if step == FINAL_STEP:
+            self._durations.observe(time.monotonic() - record.started_at)
+            self._outcomes["completed"].inc()
+            self._remove(record)
+            if self.directory is not None:
+                await self._forget(session_id)
+        elif record.adopted and step == LAST_STEP_OF_ROLE[role]:
+            # The other side's worker relays the rest and records the completion.
+            self._remove(record)
+        else:
+            record.step = step
+            self._schedule(record, time.monotonic() + self.step_timeout)
+        return recipient_id
+
+    async def _adopt(self, session_id: str, role: str, sender_id: str, step: int) -> Optional[HandshakeSession]:
+        """Starts tracking a session another worker began, as the directory recorded it."""
+        if self.directory is None:
+            self._outcomes["rejected_step"].inc()
+            return None
+        try:
+            participants = await self.directory.lookup(session_id)
+        except Exception as e:
+            print(f"ERROR: Could not look up QKD handshake {session_id}: {e}")
+            participants = None
+        if participants is None or participants[0 if role == INITIATOR else 1] != sender_id:
+            self._outcomes["rejected_step"].inc()
+            return None
+        record = self._sessions.get(session_id)
+        if record is not None:
+            return record  # Adopted by a concurrent step while looking it up.
+        if self._active_by_user.get(sender_id, 0) >= self.max_active_per_user:
+            self._outcomes["rejected_limit"].inc()
+            return None
+        record = self._add(session_id, participants[0], participants[1], sender_id, step - 1)
+        record.adopted = True
+        return record
+
+    async def _forget(self, session_id: str):
+        try:
+            await self.directory.forget(session_id)
+        except Exception as e:
+            print(f"WARNING: Could not remove QKD handshake {session_id} from the directory: {e}")
+
+    def _add(self, session_id: str, initiator_id: str, responder_id: str, owner_id: str, step: int) -> HandshakeSession:
+        now = time.monotonic()
+        record = HandshakeSession(session_id, initiator_id, responder_id, owner_id, step, now, now + self.step_timeout)
+        self._sessions[session_id] = record
+        self._active_by_user[owner_id] = self._active_by_user.get(owner_id, 0) + 1
+        self._schedule(record, record.deadline)
+        return record
+
+    def _remove(self, record: HandshakeSession):
+        del self._sessions[record.session_id]
+        self._wheel[record.slot].discard(record.session_id)
+        remaining = self._active_by_user[record.owner_id] - 1
+        if remaining:
+            self._active_by_user[record.owner_id] = remaining
+        else:
+            del self._active_by_user[record.owner_id]
+
+    def _schedule(self, record: HandshakeSession, deadline: float):
+        record.deadline = deadline
+        slot = int(deadline // self.tick) % len(self._wheel)
+        if slot != record.slot:
+            if record.slot >= 0:
+                self._wheel[record.slot].discard(record.session_id)
+            self._wheel[slot].add(record.session_id)
+            record.slot = slot
+
+    def expire(self, now: float) -> int:
+        """
+        Evicts the handshakes whose deadline has passed, visiting only the wheel
+        slots whose ticks elapsed since the last call.
+        """
+        current_tick = int(now // self.tick)
+        # A slot is only complete once its tick is over; catch up on any a late wakeup skipped.
+        first_tick = max(self._next_tick, current_tick - len(self._wheel) + 1)
+        expired = []
+        for tick in range(first_tick, current_tick):
+            for session_id in self._wheel[tick % len(self._wheel)]:
+                record = self._sessions[session_id]
+                if record.deadline <= now:
+                    expired.append(record)
+        self._next_tick = max(self._next_tick, current_tick)
+
+        for record in expired:
+            print(f"INFO: QKD handshake {record.session_id} timed out after step '{HANDSHAKE_STEPS[record.step][0]}'.")
+            self._remove(record)
+        self._outcomes["timed_out"].inc(len(expired))
+        return len(expired)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.tick)
+            try:
+                self.expire(time.monotonic())
+            except Exception as e:
+                print(f"ERROR: Handshake timeout sweep failed: {e}")
+
+handshake_table = HandshakeTable(
+    step_timeout=settings.HANDSHAKE_STEP_TIMEOUT_SECONDS,
+    tick=settings.HANDSHAKE_TIMER_TICK_SECONDS,
+    max_active_per_user=settings.HANDSHAKE_MAX_ACTIVE_PER_USER,
+    directory=RedisHandshakeDirectory(
+        settings.SOCKETIO_BACKPLANE_URL,
+        ttl=int(settings.HANDSHAKE_STEP_TIMEOUT_SECONDS * len(HANDSHAKE_STEPS)) + 1,
+    ) if settings.SOCKETIO_BACKPLANE_URL else None,
+)
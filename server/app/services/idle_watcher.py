@@ -0,0 +1,243 @@
+# app/services/idle_watcher.py
+import asyncio
+import random
+import re
+from typing import Dict, List, Optional, Set
+
+import aioimaplib
+
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.db.supabase_client import get_db, execute
+from app.services import email_service
+from app.services.presence import user_room
+from app.services.search_index import search_indexer
+
+UIDNEXT_RE = re.compile(rb'\[UIDNEXT (\d+)\]')
+PUSH_RE = re.compile(rb'^(\d+) (EXISTS|EXPUNGE|FETCH)\b', re.IGNORECASE)
+
+
+class MailboxWatcher:
+    """
+    Holds one IMAP IDLE session on a linked account's folder and turns the
+    server's pushes into `force_sync` events for the account's owner.
+
+    New messages (EXISTS) are resolved to their UIDs with a UID SEARCH from the
+    last known UIDNEXT; removals (EXPUNGE) and flag changes (FETCH) only mark
+    the folder as changed. IDLE is re-issued every `renew` seconds, well before
+    providers drop idle connections (RFC 2177 allows 29 minutes; some cut sooner).
+    """
+    def __init__(self, service: "IdleWatcherService", linked_account: dict, folder: str):
+        self.service = service
+        self.account = linked_account
+        self.user_id = str(linked_account['user_id'])
+        self.folder = folder
+        self.uidnext: Optional[int] = None
+        self.task: Optional[asyncio.Task] = None
+
+    async def run(self):
+        failures = 0
+        while True:
+            imap = None
+            try:
+                async with self.service.connect_slots:
+                    imap = await self._open()
+                if imap is None:
+                    return
+                failures = 0
+                await self._idle_loop(imap)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                failures += 1
+                delay = min(self.service.retry_max, 2 ** failures) * random.uniform(0.5, 1.0)
+                print(f"WARNING: IDLE watcher for {self.account['email_address']} failed ({e}); reconnecting in {delay:.0f}s.")
+                self.service.reconnects.inc()
+                await asyncio.sleep(delay)
+            finally:
+                if imap is not None:
+                    self._logout_in_background(imap)
+
+    async def _open(self) -> Optional[aioimaplib.IMAP4_SSL]:
+        access_token = await email_service._get_valid_access_token_async(self.account)
+        imap = aioimaplib.IMAP4_SSL(host=email_service.IMAP_SERVERS.get(self.account['provider']), timeout=settings.IMAP_IDLE_COMMAND_TIMEOUT_SECONDS)
+        try:
+            await imap.wait_hello_from_server()
+            response = await imap.xoauth2(self.account['email_address'], access_token)
+            if response.result != 'OK':
+                raise aioimaplib.Abort(f"authentication failed: {response.lines[-1:]}")
+            if not imap.has_capability('IDLE'):
+                print(f"INFO: {self.account['email_address']} does not support IDLE; the client keeps polling it.")
+                await self._logout(imap)
+                return None
+
+            response = await imap.select(self.folder)
+            if response.result != 'OK':
+                raise aioimaplib.Abort(f"could not select {self.folder}: {response.lines[-1:]}")
+        except BaseException:
+            self._logout_in_background(imap)
+            raise
+        for line in response.lines:
+            match = UIDNEXT_RE.search(line if isinstance(line, bytes) else str(line).encode())
+            if match:
+                self.uidnext = int(match.group(1))
+        return imap
+
+    async def _idle_loop(self, imap: aioimaplib.IMAP4_SSL):
+        while True:
+            idle = await imap.idle_start(timeout=self.service.renew)
+            exists = changed = False
+            while imap.has_pending_idle():
+                lines = await imap.wait_server_push(timeout=self.service.renew + 60)
+                if lines == aioimaplib.STOP_WAIT_SERVER_PUSH:
+                    break
+                for line in lines:
+                    match = PUSH_RE.match(line if isinstance(line, bytes) else str(line).encode())
+                    if match:
+                        changed = True
+                        exists = exists or match.group(2).upper() == b'EXISTS'
+                if changed:
+                    break
+            imap.idle_done()
+            await asyncio.wait_for(idle, timeout=settings.IMAP_IDLE_COMMAND_TIMEOUT_SECONDS)
+
+            if changed:
+                new_uids = await self._new_uids(imap) if exists else []
+                await self.service.notify(self.user_id, self.folder, new_uids)
+                search_indexer.refresh(self.account, self.folder)
+
+    async def _new_uids(self, imap: aioimaplib.IMAP4_SSL) -> List[str]:
+        if self.uidnext is None:
+            return []
+        response = await imap.uid_search(f'UID {self.uidnext}:*', charset=None)
+        if response.result != 'OK':
+            return []
+        uids = [
+            int(uid) for line in response.lines
+            for uid in (line.decode() if isinstance(line, bytes) else str(line)).split()
+            if uid.isdigit()
+        ]
+        # "n:*" always matches the last message, even when it is older than n.
+        uids = sorted(uid for uid in uids if uid >= self.uidnext)
+        if uids:
+            self.uidnext = uids[-1] + 1
+        return [str(uid) for uid in uids]
+
+    def _logout_in_background(self, imap: aioimaplib.IMAP4_SSL):
+        # Also runs while the watcher is being cancelled, so it can't await the logout itself.
+        task = asyncio.create_task(self._logout(imap))
+        self.service.logouts.add(task)
+        task.add_done_callback(self.service.logouts.discard)
+
+    async def _logout(self, imap: aioimaplib.IMAP4_SSL):
+        try:
+            if imap.has_pending_idle():
+                imap.idle_done()
+            await asyncio.wait_for(imap.logout(), timeout=5)
+        except Exception:
+            pass
+
+
+class IdleWatcherService:
+    """
+    Keeps an IDLE watcher on every linked account of the users connected to
+    this worker, so new mail reaches their devices as `force_sync` events
+    instead of being found by client polling. A user's watchers start with
+    their first local socket and stop with their last.
+
+    Each watcher is a coroutine on a single connection, so one worker can hold
+    thousands of them; `max_watchers` caps the total and a semaphore spreads
+    out the logins of a reconnect storm.
+    """
+    def __init__(self, folder: str, renew: float, retry_max: float, max_watchers: int, connect_concurrency: int):
+        self.folder = folder
+        self.renew = renew
+        self.retry_max = retry_max
+        self.max_watchers = max_watchers
+        self.connect_slots = asyncio.Semaphore(connect_concurrency)
+        self.sio = None
+        self._sids: Dict[str, Set[str]] = {}
+        self._watchers: Dict[str, List[MailboxWatcher]] = {}
+        self._count = 0
+        # Logouts of closed watcher connections, kept referenced until they finish.
+        self.logouts: Set[asyncio.Task] = set()
+
+        self.pushes = metrics.counter("imap_idle_pushes")
+        self.reconnects = metrics.counter("imap_idle_reconnects")
+        self.rejected = metrics.counter("imap_idle_rejected")
+
+    def start(self, sio):
+        self.sio = sio
+
+    async def stop(self):
+        for user_id in list(self._watchers):
+            await self._stop_user(user_id)
+        await asyncio.gather(*self.logouts, return_exceptions=True)
+
+    async def watch(self, user_id: str, sid: str):
+        """Registers a local socket of the user, starting their watchers on the first one."""
+        sids = self._sids.setdefault(user_id, set())
+        first = not sids
+        sids.add(sid)
+        if not first or user_id in self._watchers:
+            return
+
+        try:
+            response = await execute(
+                get_db().table('linked_accounts').select('*').eq('user_id', user_id),
+                "linked_accounts.get_for_idle"
+            )
+        except Exception as e:
+            # Forget the user's sockets so that their next connection tries again.
+            print(f"ERROR: Could not load linked accounts to watch for user {user_id}: {e}")
+            if user_id not in self._watchers:
+                self._sids.pop(user_id, None)
+            return
+        if user_id not in self._sids or user_id in self._watchers:
+            return  # The user left (or another socket started the watchers) meanwhile.
+
+        watchers = []
+        for account in response.data or []:
+            if account['provider'] not in email_service.IMAP_SERVERS:
+                continue
+            if self._count >= self.max_watchers:
+                self.rejected.inc()
+                print(f"WARNING: IDLE watcher limit ({self.max_watchers}) reached; {account['email_address']} falls back to polling.")
+                continue
+            watcher = MailboxWatcher(self, account, self.folder)
+            watcher.task = asyncio.create_task(watcher.run())
+            watchers.append(watcher)
+            self._count += 1
+        self._watchers[user_id] = watchers
+
+    async def unwatch(self, user_id: str, sid: str):
+        """Unregisters a local socket, stopping the user's watchers with the last one."""
+        sids = self._sids.get(user_id)
+        if sids is None:
+            return
+        sids.discard(sid)
+        if not sids:
+            del self._sids[user_id]
+            await self._stop_user(user_id)
+
+    async def _stop_user(self, user_id: str):
+        watchers = self._watchers.pop(user_id, [])
+        self._count -= len(watchers)
+        for watcher in watchers:
+            watcher.task.cancel()
+        await asyncio.gather(*(watcher.task for watcher in watchers), return_exceptions=True)
+
+    async def notify(self, user_id: str, folder: str, uids: List[str]):
+        self.pushes.inc()
+        if self.sio is None:
+            return
+        await self.sio.emit('force_sync', {"folder": folder, "uids": uids}, to=user_room(user_id))
+
+
+idle_watcher = IdleWatcherService(
+    folder=settings.IMAP_IDLE_FOLDER,
+    renew=settings.IMAP_IDLE_RENEW_SECONDS,
+    retry_max=settings.IMAP_IDLE_RETRY_MAX_SECONDS,
+    max_watchers=settings.IMAP_IDLE_MAX_WATCHERS,
+    connect_concurrency=settings.IMAP_IDLE_CONNECT_CONCURRENCY,
+)
@@ -0,0 +1,123 @@
+# app/services/imap_pool.py
+import imaplib
+from typing import Callable, Dict, FrozenSet, Optional, Set
+
+from app.core.config import settings
+from app.services.session_pool import PooledSession, SessionPool
+
+
+class ImapSession(PooledSession):
+    """
+    A single authenticated IMAP connection plus the state we need to reuse it:
+    the access token it logged in with, the server's capabilities, the
+    currently selected folder and when it was last used.
+    """
+    def __init__(self, imap: imaplib.IMAP4_SSL, access_token: str):
+        super().__init__(access_token)
+        self.imap = imap
+        self.capabilities: Optional[FrozenSet[str]] = None
+        self.selected_folder: Optional[str] = None
+        self.enabled: Set[str] = set()
+
+    def has_capability(self, name: str) -> bool:
+        """
+        Checks the post-authentication CAPABILITY list, which is fetched once
+        per session (servers often advertise more after login than before).
+        """
+        if self.capabilities is None:
+            typ, data = self.imap.capability()
+            if typ == 'OK' and data and data[-1]:
+                self.capabilities = frozenset(data[-1].decode(errors='ignore').upper().split())
+            else:
+                self.capabilities = frozenset(cap.upper() for cap in self.imap.capabilities)
+            # imaplib checks its own (pre-login) list before commands such as ENABLE.
+            self.imap.capabilities = tuple(self.capabilities)
+        return name.upper() in self.capabilities
+
+    def select(self, folder: str):
+        """SELECTs the folder, skipping the round trip if it is already selected."""
+        if self.selected_folder == folder:
+            return
+        typ, data = self.imap.select(f'"{folder}"')
+        if typ != 'OK':
+            self.selected_folder = None
+            raise imaplib.IMAP4.error(f"Could not select folder '{folder}': {data}")
+        self.selected_folder = folder
+
+    def enable(self, extension: str) -> bool:
+        """
+        ENABLEs an extension (e.g. QRESYNC) once per session; `enabled` lists
+        what a session has turned on. ENABLE is only valid before a folder is
+        selected, so a selected session is UNSELECTed first; without UNSELECT
+        the extension is reported as unavailable.
+
+        The extension stays on for the life of the pooled session. With
+        QRESYNC the server reports expunges as VANISHED instead of EXPUNGE
+        responses, so callers sharing the pool must not rely on the untagged
+        EXPUNGE data (e.g. what imaplib's expunge() returns).
+        """
+        if extension in self.enabled:
+            return True
+        if not self.has_capability('ENABLE'):
+            return False
+        if self.imap.state == 'SELECTED':
+            if not self.has_capability('UNSELECT'):
+                return False
+            self.imap.unselect()
+            self.selected_folder = None
+        typ, _ = self.imap.enable(extension)
+        if typ == 'OK':
+            self.enabled.add(extension)
+            return True
+        return False
+
+    def select_with(self, folder: str, parameters: Optional[str] = None) -> Dict[str, list]:
+        """
+        SELECTs the folder, optionally with select parameters such as
+        '(CONDSTORE)' or '(QRESYNC (uidvalidity modseq))', which imaplib's
+        select() can't send, and returns the untagged responses it produced
+        (UIDVALIDITY, UIDNEXT...), keyed by type.
+        """
+        self.imap.untagged_responses = {}
+        typ, data = self.imap._simple_command('SELECT', f'"{folder}"', parameters)
+        if typ != 'OK':
+            self.selected_folder = None
+            raise imaplib.IMAP4.error(f"Could not select folder '{folder}': {data}")
+        self.imap.state = 'SELECTED'
+        self.selected_folder = folder
+        responses, self.imap.untagged_responses = self.imap.untagged_responses, {}
+        return responses
+
+    def is_alive(self) -> bool:
+        try:
+            typ, _ = self.imap.noop()
+            return typ == 'OK'
+        except Exception:
+            return False
+
+    def close(self):
+        try:
+            self.imap.logout()
+        except Exception:
+            pass
+
+
+class ImapSessionPool(SessionPool):
+    """
+    Pool of IMAP sessions, so that consecutive actions (read, star, archive...)
+    on an account also skip the SELECT when the folder is still selected.
+    """
+    session_class = ImapSession
+    protocol = "IMAP"
+
+    def session(self, account_id: str, access_token: str, connect: Callable[[], imaplib.IMAP4_SSL]):
+        """Lends out an ImapSession for `account_id`; see SessionPool.lease."""
+        return self.lease(account_id, access_token, connect)
+
+
+imap_pool = ImapSessionPool(
+    max_per_account=settings.IMAP_POOL_MAX_CONNECTIONS_PER_ACCOUNT,
+    idle_timeout=settings.IMAP_POOL_IDLE_TIMEOUT_SECONDS,
+    health_check_interval=settings.IMAP_POOL_HEALTH_CHECK_INTERVAL_SECONDS,
+    acquire_timeout=settings.IMAP_POOL_ACQUIRE_TIMEOUT_SECONDS,
+)
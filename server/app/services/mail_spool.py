@@ -0,0 +1,93 @@
+# app/services/mail_spool.py
+import os
+import tempfile
+import time
+import uuid
+from typing import BinaryIO, Iterable, List, Optional
+
+from fastapi import HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
+
+from app.core.config import settings
+
+
+class MailSpool:
+    """
+    Directory holding the uploaded bodies and attachments of queued messages
+    until the outbox has delivered them. Uploads are copied in `chunk_bytes`
+    pieces and rows refer to them by spool name only, so the directory can
+    move. When API workers run on several hosts it must be shared storage.
+
+    Uploads are written to disk twice: Starlette first spools each multipart
+    file to a temporary file while parsing the form, and `save` then copies it
+    here, where it survives the request until delivery. Files whose message
+    was never queued (the worker died between `save` and the insert) are
+    removed by the outbox's periodic sweep via `names_older_than`.
+    """
+    def __init__(self, directory: str, chunk_bytes: int):
+        self.directory = directory
+        self.chunk_bytes = chunk_bytes
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory, os.path.basename(name))
+
+    def _copy(self, source: BinaryIO, path: str, max_bytes: int) -> int:
+        os.makedirs(self.directory, exist_ok=True)
+        size = 0
+        try:
+            with open(path, 'wb') as target:
+                while True:
+                    data = source.read(self.chunk_bytes)
+                    if not data:
+                        return size
+                    size += len(data)
+                    if size > max_bytes:
+                        raise HTTPException(status_code=413, detail="The message and its attachments are too large.")
+                    target.write(data)
+        except BaseException:
+            self._remove(path)
+            raise
+
+    async def save(self, upload: UploadFile, max_bytes: int) -> dict:
+        """Spools an upload of at most `max_bytes`. Returns its spool name and size."""
+        name = uuid.uuid4().hex
+        size = await run_in_threadpool(self._copy, upload.file, self.path(name), max_bytes)
+        return {"spool": name, "size": size}
+
+    def _remove(self, path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"WARNING: Could not remove spooled file {path}: {e}")
+
+    def _names_older_than(self, age: float) -> List[str]:
+        cutoff = time.time() - age
+        try:
+            entries = list(os.scandir(self.directory))
+        except FileNotFoundError:
+            return []
+        names = []
+        for entry in entries:
+            try:
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    names.append(entry.name)
+            except FileNotFoundError:
+                pass  # Discarded meanwhile.
+        return names
+
+    async def names_older_than(self, age: float) -> List[str]:
+        """Names of spooled files last written more than `age` seconds ago."""
+        return await run_in_threadpool(self._names_older_than, age)
+
+    async def discard(self, names: Iterable[Optional[str]]):
+        paths = [self.path(name) for name in names if name]
+        if paths:
+            await run_in_threadpool(lambda: [self._remove(path) for path in paths])
+
+
+mail_spool = MailSpool(
+    directory=settings.OUTBOX_SPOOL_DIR or os.path.join(tempfile.gettempdir(), "qmail-outbox"),
+    chunk_bytes=settings.OUTBOX_SPOOL_CHUNK_BYTES,
+)
@@ -0,0 +1,147 @@
+# app/services/mime_stream.py
+import base64
+import io
+import os
+import re
+import smtplib
+import uuid
+from email import policy
+from email.message import EmailMessage
+from email.utils import formataddr, formatdate, make_msgid
+from typing import BinaryIO, Iterator, List, Optional
+
+CRLF = b"\r\n"
+# base64.encodebytes turns every 57 input bytes into one full 76-character line,
+# so reading a multiple of 57 keeps the lines of consecutive reads identical to
+# encoding the whole file at once.
+READ_BYTES = 57 * 1024
+CONTENT_TYPE_RE = re.compile(r'^[\w.+-]+/[\w.+-]+$')
+
+
+def _header_block(headers: EmailMessage) -> bytes:
+    return b"".join(policy.SMTP.fold_binary(name, value) for name, value in headers.items()) + CRLF
+
+
+def _base64_size(size: int) -> int:
+    lines = -(-size // 57)
+    return 4 * -(-size // 3) + 2 * lines
+
+
+class SpooledPart:
+    """
+    A leaf part of an outgoing message: either a spooled file on disk or, for
+    a body sent inline, a short string. Always base64-encoded on the wire.
+    """
+    def __init__(self, content_type: str, path: Optional[str] = None, text: Optional[str] = None, filename: Optional[str] = None):
+        self.path = path
+        self.text = text
+        headers = EmailMessage(policy=policy.SMTP)
+        headers['Content-Type'] = content_type if CONTENT_TYPE_RE.match(content_type.split(';')[0].strip()) else 'application/octet-stream'
+        headers['Content-Transfer-Encoding'] = 'base64'
+        if filename:
+            headers.add_header('Content-Disposition', 'attachment', filename=filename)
+        self.header_block = _header_block(headers)
+
+    def content_size(self) -> int:
+        return os.path.getsize(self.path) if self.path is not None else len((self.text or "").encode('utf-8'))
+
+    def _open(self) -> BinaryIO:
+        return open(self.path, 'rb') if self.path is not None else io.BytesIO((self.text or "").encode('utf-8'))
+
+    def encoded(self) -> Iterator[bytes]:
+        with self._open() as source:
+            while True:
+                data = source.read(READ_BYTES)
+                if not data:
+                    return
+                yield base64.encodebytes(data).replace(b"\n", CRLF)
+
+
+class StreamedMessage:
+    """
+    A multipart/mixed message generated on the fly from its parts, for bodies
+    and attachments too large to build as an EmailMessage. `chunks()` yields
+    the wire format one read buffer at a time, and can be called again to
+    resend. Every line starts with a header name, folding whitespace, a
+    boundary or base64, so none needs dot-stuffing in the SMTP DATA.
+    """
+    def __init__(self, from_name: str, from_address: str, recipient: str, subject: str, parts: List[SpooledPart]):
+        self.from_address = from_address
+        self.recipient = recipient
+        self.parts = parts
+        self.boundary = f"=_qmail_{uuid.uuid4().hex}".encode('ascii')
+
+        headers = EmailMessage(policy=policy.SMTP)
+        headers['Subject'] = subject
+        headers['From'] = formataddr((from_name, from_address))
+        headers['To'] = recipient
+        headers['Date'] = formatdate(localtime=True)
+        headers['Message-ID'] = make_msgid(domain=from_address.rpartition('@')[2] or None)
+        headers['MIME-Version'] = '1.0'
+        headers['Content-Type'] = f'multipart/mixed; boundary="{self.boundary.decode()}"'
+        self.header_block = _header_block(headers)
+
+    def _delimiter(self, last: bool = False) -> bytes:
+        return b"--" + self.boundary + (b"--" if last else b"") + CRLF
+
+    def size(self) -> int:
+        """The exact size of `chunks()`, for the SMTP SIZE declaration."""
+        total = len(self.header_block) + len(self._delimiter(last=True))
+        for part in self.parts:
+            total += len(self._delimiter()) + len(part.header_block) + _base64_size(part.content_size())
+        return total
+
+    def chunks(self) -> Iterator[bytes]:
+        yield self.header_block
+        for part in self.parts:
+            yield self._delimiter() + part.header_block
+            yield from part.encoded()
+        yield self._delimiter(last=True)
+
+
+def _reset(smtp: smtplib.SMTP, code: int):
+    if code == 421:
+        smtp.close()
+        return
+    try:
+        smtp.rset()
+    except smtplib.SMTPServerDisconnected:
+        pass
+
+
+def send_streamed(smtp: smtplib.SMTP, message: StreamedMessage):
+    """
+    Sends `message` like SMTP.sendmail, raising the same exceptions, but writes
+    the DATA as it is generated instead of from one bytes object. The size is
+    declared up front when the server supports SIZE, so a message over its
+    limit is refused before anything is uploaded.
+    """
+    smtp.ehlo_or_helo_if_needed()
+    size = message.size()
+    mail_options = []
+    if smtp.has_extn('size'):
+        limit = int(smtp.esmtp_features['size'] or 0)
+        if limit and size > limit:
+            raise smtplib.SMTPSenderRefused(552, f"Message size {size} exceeds the server limit of {limit} bytes".encode(), message.from_address)
+        mail_options.append(f"SIZE={size}")
+
+    code, response = smtp.mail(message.from_address, mail_options)
+    if code != 250:
+        _reset(smtp, code)
+        raise smtplib.SMTPSenderRefused(code, response, message.from_address)
+    code, response = smtp.rcpt(message.recipient)
+    if code not in (250, 251):
+        _reset(smtp, code)
+        raise smtplib.SMTPRecipientsRefused({message.recipient: (code, response)})
+    code, response = smtp.docmd("DATA")
+    if code != 354:
+        _reset(smtp, code)
+        raise smtplib.SMTPDataError(code, response)
+
+    for chunk in message.chunks():
+        smtp.send(chunk)
+    smtp.send(b"." + CRLF)
+    code, response = smtp.getreply()
+    if code != 250:
+        _reset(smtp, code)
+        raise smtplib.SMTPDataError(code, response)
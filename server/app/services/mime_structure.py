@@ -0,0 +1,106 @@
+# app/services/mime_structure.py
+import re
+from typing import List, Optional
+
+LITERAL_RE = re.compile(rb'\{(\d+)\}$')
+
+
+def join_fetch_response(data: list) -> bytes:
+    """
+    Flattens imaplib FETCH data, where literals arrive as (prefix, literal)
+    tuples, back into one line with every literal rewritten as a quoted string.
+    """
+    line = b''
+    for item in data:
+        if isinstance(item, tuple):
+            prefix, literal = item
+            line += LITERAL_RE.sub(b'', prefix)
+            line += b'"' + literal.replace(b'\\', b'\\\\').replace(b'"', b'\\"') + b'"'
+        elif item:
+            line += item
+    return line
+
+
+def parse_imap_list(text: bytes):
+    """Parses an IMAP parenthesized list into nested Python lists of str (NIL becomes None)."""
+    stack: List[list] = [[]]
+    i, length = 0, len(text)
+    while i < length:
+        char = text[i:i + 1]
+        if char == b'(':
+            stack.append([])
+            i += 1
+        elif char == b')':
+            if len(stack) == 1:
+                break  # The end of the enclosing response.
+            finished = stack.pop()
+            stack[-1].append(finished)
+            i += 1
+        elif char == b'"':
+            i += 1
+            value = bytearray()
+            while i < length and text[i:i + 1] != b'"':
+                if text[i:i + 1] == b'\\':
+                    i += 1
+                value += text[i:i + 1]
+                i += 1
+            stack[-1].append(value.decode(errors='replace'))
+            i += 1
+        elif char.isspace():
+            i += 1
+        else:
+            start = i
+            while i < length and text[i:i + 1] not in (b' ', b'(', b')'):
+                i += 1
+            atom = text[start:i].decode(errors='replace')
+            stack[-1].append(None if atom.upper() == 'NIL' else atom)
+    return stack[0]
+
+
+def _params(value) -> dict:
+    if not isinstance(value, list):
+        return {}
+    return {str(value[i]).lower(): value[i + 1] for i in range(0, len(value) - 1, 2)}
+
+
+def bodystructure_parts(structure: list, prefix: str = "") -> List[dict]:
+    """
+    Flattens a parsed BODYSTRUCTURE into its leaf parts, each with the section
+    number to pass to BODY[...] and what a client needs to decide whether to
+    download it: type, size, transfer encoding, disposition and filename.
+    """
+    if structure and isinstance(structure[0], list):
+        # A multipart lists its children first, then its subtype and extension data.
+        parts = []
+        for index, child in enumerate(structure, start=1):
+            if not isinstance(child, list):
+                break
+            parts.extend(bodystructure_parts(child, f"{prefix}.{index}" if prefix else str(index)))
+        return parts
+
+    media_type = f"{(structure[0] or '').lower()}/{(structure[1] or '').lower()}"
+    params = _params(structure[2])
+    # Extension data follows the basic fields, text's line count, and message/rfc822's envelope, body and lines.
+    basic_end = 7
+    if media_type.startswith("text/"):
+        basic_end = 8
+    elif media_type == "message/rfc822":
+        basic_end = 10
+    disposition = structure[basic_end + 1] if len(structure) > basic_end + 1 else None
+    disposition_type: Optional[str] = None
+    disposition_params = {}
+    if isinstance(disposition, list) and disposition:
+        disposition_type = (disposition[0] or '').lower()
+        disposition_params = _params(disposition[1] if len(disposition) > 1 else None)
+
+    size = structure[6] if len(structure) > 6 else None
+    return [{
+        "section": prefix or "1",
+        "type": media_type,
+        "params": params,
+        "id": structure[3],
+        "encoding": (structure[5] or '').lower() or None,
+        "size": int(size) if size and str(size).isdigit() else None,
+        "disposition": disposition_type,
+        "filename": disposition_params.get("filename") or params.get("name"),
+    }]
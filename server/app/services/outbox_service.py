@@ -0,0 +1,323 @@
+# app/services/outbox_service.py
+import asyncio
+import random
+import smtplib
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Set
+
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.db.supabase_client import get_db, execute
+from app.schemas.email import EmailSend
+from app.services import email_service, user_service
+from app.services.mail_spool import mail_spool
+from app.services.presence import user_room
+from app.services.token_cache import token_cache
+
+QUEUED = "queued"
+SENDING = "sending"
+SENT = "sent"
+FAILED = "failed"
+
+
+def _is_permanent(error: Exception) -> bool:
+    """SMTP 5xx replies about the sender, recipients or content won't change on retry."""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    if isinstance(error, (smtplib.SMTPSenderRefused, smtplib.SMTPDataError)):
+        return error.smtp_code >= 500
+    return False
+
+
+class MailOutbox:
+    """
+    Durable queue of outgoing mail. `enqueue` stores the message in the
+    `outbox` table and returns at once; background workers deliver it over
+    pooled SMTP connections and report every status change to the sender's
+    devices with a `mail_delivery_status` event.
+
+    At most `per_provider` messages are in flight per provider on each worker.
+    A worker only claims a row once it holds one of those slots, by bumping
+    its attempt count and pushing its next_attempt_at `lease` seconds out,
+    conditional on the attempt count it read, so two workers never deliver the
+    same row. While the message is being sent the lease is renewed every third
+    of `lease`, so waiting for a pooled SMTP connection or uploading a large
+    message can't outlast it; a row claimed by a worker that died becomes due
+    again once the lease runs out. Failures are retried with exponential
+    backoff up to `max_attempts`; permanent SMTP rejections fail immediately.
+    """
+    def __init__(self, poll_interval: float, batch_size: int, max_attempts: int, backoff: float, lease: int, per_provider: int, spool_orphan_age: float, spool_sweep_interval: float):
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.lease = lease
+        self.per_provider = per_provider
+        self.spool_orphan_age = spool_orphan_age
+        self.spool_sweep_interval = spool_sweep_interval
+        self.sio = None
+        self._wakeup = asyncio.Event()
+        self._provider_slots: Dict[str, asyncio.Semaphore] = {}
+        self._in_flight: Set[str] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._sweep_task: Optional[asyncio.Task] = None
+
+        self._results = {
+            outcome: metrics.counter("outbox_deliveries", outcome=outcome)
+            for outcome in (SENT, "retried", FAILED)
+        }
+        self._latency = metrics.histogram("outbox_delivery_seconds")
+
+    def start(self, sio):
+        self.sio = sio
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            self._sweep_task = asyncio.create_task(self._run_spool_sweep())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._sweep_task.cancel()
+            await asyncio.gather(self._task, self._sweep_task, return_exceptions=True)
+            self._task = self._sweep_task = None
+
+    async def enqueue(self, linked_account: dict, email_data: EmailSend, body_spool: Optional[str] = None, attachments: Optional[List[dict]] = None) -> dict:
+        """
+        Stores a message for delivery and wakes the workers. Returns the queued row.
+        A body uploaded as a file is passed as its `body_spool` name instead of in
+        email_data.body; `attachments` are spooled files with filename and content_type.
+        """
+        profile = await user_service.get_user_by_id(user_id=str(linked_account['user_id']))
+        if not profile:
+            raise HTTPException(status_code=404, detail="Could not find the QMail user profile for this linked account.")
+        if linked_account['provider'] not in email_service.SMTP_SERVERS:
+            raise HTTPException(status_code=500, detail=f"Unsupported provider: {linked_account['provider']}")
+
+        response = await execute(get_db().table('outbox').insert({
+            "user_id": str(linked_account['user_id']),
+            "linked_account_id": str(linked_account['id']),
+            "from_name": profile['name'],
+            "recipient": email_data.recipient,
+            "subject": email_data.subject,
+            "body": "" if body_spool else email_data.body,
+            "body_spool": body_spool,
+            "attachments": attachments or [],
+            "status": QUEUED,
+            "attempts": 0,
+            "next_attempt_at": datetime.now(timezone.utc).isoformat(),
+        }), "outbox.enqueue")
+        self._wakeup.set()
+        return response.data[0]
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.process_due()
+            except Exception as e:
+                print(f"ERROR: Outbox cycle failed: {e}")
+
+    async def _run_spool_sweep(self):
+        # Stagger the first sweep so several workers don't all scan at once.
+        await asyncio.sleep(random.uniform(0, self.spool_sweep_interval))
+        while True:
+            try:
+                await self.sweep_spool()
+            except Exception as e:
+                print(f"ERROR: Outbox spool sweep failed: {e}")
+            await asyncio.sleep(self.spool_sweep_interval)
+
+    async def sweep_spool(self):
+        """Deletes old spool files that no queued or sending message refers to."""
+        candidates = set(await mail_spool.names_older_than(self.spool_orphan_age))
+        if not candidates:
+            return
+        response = await execute(
+            get_db().table('outbox').select('body_spool, attachments').in_('status', [QUEUED, SENDING]),
+            "outbox.spooled_content"
+        )
+        for row in response.data or []:
+            candidates.discard(row.get('body_spool'))
+            candidates.difference_update(attachment['spool'] for attachment in row.get('attachments') or [])
+        if candidates:
+            print(f"INFO: Removing {len(candidates)} orphaned outbox spool file(s).")
+            await mail_spool.discard(candidates)
+
+    async def process_due(self):
+        now = datetime.now(timezone.utc)
+        response = await execute(
+            get_db().table('outbox').select('*')
+                .in_('status', [QUEUED, SENDING])
+                .lte('next_attempt_at', now.isoformat())
+                .order('next_attempt_at')
+                .limit(self.batch_size),
+            "outbox.get_due"
+        )
+        for row in response.data or []:
+            if str(row['id']) in self._in_flight:
+                continue
+            self._in_flight.add(str(row['id']))
+            asyncio.create_task(self._deliver(row))
+
+    async def _claim(self, row: dict) -> bool:
+        response = await execute(
+            get_db().table('outbox').update({
+                "status": SENDING,
+                "attempts": row['attempts'] + 1,
+                "next_attempt_at": (datetime.now(timezone.utc) + timedelta(seconds=self.lease)).isoformat(),
+            }).eq('id', row['id']).eq('attempts', row['attempts']),
+            "outbox.claim"
+        )
+        if not response.data:
+            return False
+        row['attempts'] += 1
+        return True
+
+    async def _keep_lease(self, row: dict):
+        """Pushes the claimed row's lease out while its delivery is still running."""
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                await execute(
+                    get_db().table('outbox').update({
+                        "next_attempt_at": (datetime.now(timezone.utc) + timedelta(seconds=self.lease)).isoformat(),
+                    }).eq('id', row['id']).eq('attempts', row['attempts']).eq('status', SENDING),
+                    "outbox.renew_lease"
+                )
+            except Exception as e:
+                print(f"WARNING: Could not renew the lease of outbox message {row['id']}: {e}")
+
+    def _get_provider_slots(self, provider: str) -> asyncio.Semaphore:
+        slots = self._provider_slots.get(provider)
+        if slots is None:
+            slots = self._provider_slots[provider] = asyncio.Semaphore(self.per_provider)
+        return slots
+
+    async def _deliver(self, row: dict):
+        outbox_id = str(row['id'])
+        claimed = False
+        lease = None
+        try:
+            response = await execute(
+                get_db().table('linked_accounts').select('*').eq('id', row['linked_account_id']).limit(1),
+                "linked_accounts.get_for_outbox"
+            )
+            if not response.data:
+                if await self._claim(row):
+                    await self._finish(row, FAILED, "The linked account was removed.")
+                return
+            linked_account = response.data[0]
+
+            async with self._get_provider_slots(linked_account['provider']):
+                if not await self._claim(row):
+                    return  # Another worker got to it first.
+                claimed = True
+                # Held until the outcome is stored, so the row can't be reclaimed in between.
+                lease = asyncio.create_task(self._keep_lease(row))
+                msg = self._build_message(row, linked_account)
+                started = asyncio.get_running_loop().time()
+                access_token = await email_service._get_valid_access_token_async(linked_account)
+                await run_in_threadpool(email_service.deliver_message, linked_account, access_token, msg)
+                self._latency.observe(asyncio.get_running_loop().time() - started)
+            await self._finish(row, SENT, None)
+        except Exception as e:
+            if claimed:
+                await self._retry_or_fail(row, e)
+            else:
+                print(f"ERROR: Could not start delivery of outbox message {outbox_id}: {e}")
+        finally:
+            if lease is not None:
+                lease.cancel()
+            self._in_flight.discard(outbox_id)
+
+    def _build_message(self, row: dict, linked_account: dict):
+        if not row.get('body_spool') and not row.get('attachments'):
+            return email_service.build_outgoing_message(
+                row['from_name'], linked_account['email_address'], row['recipient'], row['subject'], row['body']
+            )
+        # Spooled content is streamed from disk while sending rather than built in memory.
+        return email_service.build_streamed_message(
+            row['from_name'], linked_account['email_address'], row['recipient'], row['subject'], row['body'],
+            mail_spool.path(row['body_spool']) if row.get('body_spool') else None,
+            [{**attachment, "path": mail_spool.path(attachment['spool'])} for attachment in row.get('attachments') or []],
+        )
+
+    async def _retry_or_fail(self, row: dict, error: Exception):
+        if isinstance(error, smtplib.SMTPAuthenticationError):
+            # Probably a revoked or rotated token; make the next attempt fetch a fresh one.
+            token_cache.invalidate(str(row['linked_account_id']))
+
+        if _is_permanent(error) or row['attempts'] >= self.max_attempts:
+            print(f"ERROR: Giving up on outbox message {row['id']} after {row['attempts']} attempt(s): {error}")
+            await self._finish(row, FAILED, str(error))
+            return
+
+        delay = self.backoff * (2 ** (row['attempts'] - 1)) * random.uniform(0.8, 1.2)
+        print(f"WARNING: Delivery of outbox message {row['id']} failed (attempt {row['attempts']}), retrying in {delay:.0f}s: {error}")
+        try:
+            await execute(get_db().table('outbox').update({
+                "status": QUEUED,
+                "last_error": str(error),
+                "next_attempt_at": (datetime.now(timezone.utc) + timedelta(seconds=delay)).isoformat(),
+            }).eq('id', row['id']), "outbox.reschedule")
+        except Exception as e:
+            # The lease will expire and the row becomes due again anyway.
+            print(f"ERROR: Could not reschedule outbox message {row['id']}: {e}")
+        self._results["retried"].inc()
+        await self._notify(row, QUEUED, str(error))
+
+    async def _finish(self, row: dict, status: str, error: Optional[str]):
+        """
+        Stores a final status, retrying until it sticks: until then the row
+        still looks in flight, so its spooled content is kept and nobody is
+        told, and the caller's lease keeps other workers from reclaiming it.
+        """
+        delay = 1.0
+        while True:
+            try:
+                await execute(get_db().table('outbox').update({
+                    "status": status,
+                    "last_error": error,
+                }).eq('id', row['id']), "outbox.finish")
+                break
+            except Exception as e:
+                print(f"ERROR: Could not record status '{status}' for outbox message {row['id']}, retrying in {delay:.0f}s: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.lease / 3)
+        await mail_spool.discard([row.get('body_spool')] + [attachment['spool'] for attachment in row.get('attachments') or []])
+        self._results[status].inc()
+        await self._notify(row, status, error)
+
+    async def _notify(self, row: dict, status: str, error: Optional[str]):
+        if self.sio is None:
+            return
+        try:
+            await self.sio.emit('mail_delivery_status', {
+                "outbox_id": str(row['id']),
+                "recipient": row['recipient'],
+                "subject": row['subject'],
+                "status": status,
+                "attempts": row['attempts'],
+                "error": error,
+            }, to=user_room(str(row['user_id'])))
+        except Exception as e:
+            print(f"ERROR: Could not report delivery status for outbox message {row['id']}: {e}")
+
+
+mail_outbox = MailOutbox(
+    poll_interval=settings.OUTBOX_POLL_INTERVAL_SECONDS,
+    batch_size=settings.OUTBOX_BATCH_SIZE,
+    max_attempts=settings.OUTBOX_MAX_ATTEMPTS,
+    backoff=settings.OUTBOX_RETRY_BACKOFF_SECONDS,
+    lease=settings.OUTBOX_LEASE_SECONDS,
+    per_provider=settings.OUTBOX_MAX_CONCURRENCY_PER_PROVIDER,
+    spool_orphan_age=settings.OUTBOX_SPOOL_ORPHAN_AGE_SECONDS,
+    spool_sweep_interval=settings.OUTBOX_SPOOL_SWEEP_INTERVAL_SECONDS,
+)
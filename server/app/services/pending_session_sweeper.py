@@ -0,0 +1,61 @@
+# app/services/pending_session_sweeper.py
+import asyncio
+import random
+from typing import Optional
+
+from app.core.config import settings
+from app.services import session_service
+
+
+class PendingSessionSweeper:
+    """
+    Background task that deletes pending handshake requests past their
+    expiry, so abandoned handshakes don't pile up in the table every connect
+    reads from. Each cycle deletes in batches of `batch_size` until no expired
+    rows remain; the reads on connect already ignore expired rows, so the
+    sweeper only has to keep the table small, not be prompt.
+    """
+    def __init__(self, interval: float, batch_size: int):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        # Stagger the first cycle so several workers don't all sweep at once.
+        await asyncio.sleep(random.uniform(0, self.interval))
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                print(f"ERROR: Pending session sweep failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def sweep(self) -> int:
+        total = 0
+        while True:
+            deleted = await session_service.delete_expired_pending_sessions(self.batch_size)
+            total += deleted
+            if deleted < self.batch_size:
+                break
+        if total:
+            print(f"INFO: Deleted {total} expired pending session(s).")
+        return total
+
+
+pending_session_sweeper = PendingSessionSweeper(
+    interval=settings.PENDING_SESSION_SWEEP_INTERVAL_SECONDS,
+    batch_size=settings.PENDING_SESSION_SWEEP_BATCH_SIZE,
+)
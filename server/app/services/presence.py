@@ -0,0 +1,147 @@
+# app/services/presence.py
+import asyncio
+import time
+from typing import Dict, Optional, Set
+
+import socketio
+
+from app.core.config import settings
+
+
+def user_room(user_id: str) -> str:
+    """Socket.IO room holding every connected device of a user."""
+    return f"user:{user_id}"
+
+
+class LocalPresenceStore:
+    """
+    In-process presence table (user_id -> connected sids). Only correct with a
+    single worker, which also makes it the stand-in for tests and local development.
+    """
+    # Every socket of every user is on this worker.
+    shared = False
+
+    def __init__(self):
+        self._sids: Dict[str, Set[str]] = {}
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def add_sid(self, user_id: str, sid: str) -> int:
+        """Registers a device for the user and returns how many they now have."""
+        sids = self._sids.setdefault(user_id, set())
+        sids.add(sid)
+        return len(sids)
+
+    async def remove_sid(self, user_id: str, sid: str) -> int:
+        """Unregisters a device and returns how many the user still has connected."""
+        sids = self._sids.get(user_id)
+        if sids is None:
+            return 0
+        sids.discard(sid)
+        if not sids:
+            del self._sids[user_id]
+            return 0
+        return len(sids)
+
+    async def device_count(self, user_id: str) -> int:
+        return len(self._sids.get(user_id, ()))
+
+
+class RedisPresenceStore:
+    """
+    Presence table shared by every worker and host through Redis (or anything
+    speaking the Redis protocol), stored as one sorted set per user of sids
+    scored by their last heartbeat. A sid whose worker stopped refreshing it
+    for `ttl` seconds no longer counts and is pruned on the next write, so a
+    crashed worker cannot leave its sockets online forever, even while other
+    workers keep the same user's set alive.
+    """
+    shared = True
+    KEY_PREFIX = "qmail:presence:z:"
+    # Removes the sid, prunes expired ones and returns the remaining device count atomically.
+    _REMOVE_AND_COUNT = """
+    redis.call('zrem', KEYS[1], ARGV[1])
+    redis.call('zremrangebyscore', KEYS[1], '-inf', ARGV[2])
+    return redis.call('zcard', KEYS[1])
+    """
+
+    def __init__(self, url: str, ttl: int):
+        import redis.asyncio as redis_asyncio
+        self._redis = redis_asyncio.from_url(url, decode_responses=True)
+        self.ttl = ttl
+        # user_id -> sids connected to this worker
+        self._owned: Dict[str, Set[str]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._heartbeat())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._redis.aclose()
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            if not self._owned:
+                continue
+            try:
+                now = time.time()
+                async with self._redis.pipeline(transaction=False) as pipe:
+                    for user_id, sids in self._owned.items():
+                        # Re-adds, too, in case the set expired while Redis was unreachable.
+                        pipe.zadd(self.KEY_PREFIX + user_id, {sid: now for sid in sids})
+                        pipe.expire(self.KEY_PREFIX + user_id, self.ttl)
+                    await pipe.execute()
+            except Exception as e:
+                print(f"ERROR: Could not refresh presence entries in Redis: {e}")
+
+    async def add_sid(self, user_id: str, sid: str) -> int:
+        self._owned.setdefault(user_id, set()).add(sid)
+        now = time.time()
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.zadd(self.KEY_PREFIX + user_id, {sid: now})
+            pipe.zremrangebyscore(self.KEY_PREFIX + user_id, '-inf', now - self.ttl)
+            pipe.expire(self.KEY_PREFIX + user_id, self.ttl)
+            pipe.zcard(self.KEY_PREFIX + user_id)
+            *_, count = await pipe.execute()
+        return int(count)
+
+    async def remove_sid(self, user_id: str, sid: str) -> int:
+        owned = self._owned.get(user_id)
+        if owned is not None:
+            owned.discard(sid)
+            if not owned:
+                del self._owned[user_id]
+        return int(await self._redis.eval(self._REMOVE_AND_COUNT, 1, self.KEY_PREFIX + user_id, sid, time.time() - self.ttl))
+
+    async def device_count(self, user_id: str) -> int:
+        return int(await self._redis.zcount(self.KEY_PREFIX + user_id, time.time() - self.ttl, '+inf'))
+
+
+def create_client_manager() -> Optional[socketio.AsyncManager]:
+    """
+    Socket.IO client manager for the configured backplane. With a Redis URL,
+    emits are published to every worker so a relay reaches the socket wherever
+    it is connected; without one, the default in-process manager is used.
+    """
+    if settings.SOCKETIO_BACKPLANE_URL:
+        return socketio.AsyncRedisManager(settings.SOCKETIO_BACKPLANE_URL, channel=settings.SOCKETIO_BACKPLANE_CHANNEL)
+    return None
+
+
+def create_presence_store():
+    if settings.SOCKETIO_BACKPLANE_URL:
+        return RedisPresenceStore(settings.SOCKETIO_BACKPLANE_URL, ttl=settings.PRESENCE_TTL_SECONDS)
+    return LocalPresenceStore()
@@ -0,0 +1,89 @@
+# app/services/presence_subscriptions.py
+import asyncio
+from typing import Dict, List, Optional, Set
+
+
+def presence_room(user_id: str) -> str:
+    """Socket.IO room of the sockets subscribed to a user's presence."""
+    return f"presence:{user_id}"
+
+
+class PresenceSubscriptions:
+    """
+    Lets a socket subscribe to the presence of many users in one message and
+    pushes `presence_changed` events when those users come online or go offline.
+
+    Subscribers join one room per watched user, so a change is a single emit
+    that also reaches subscribers on other workers through the backplane.
+    Changes are debounced: a burst of connects and disconnects for the same
+    user (a reconnect, a flapping network) is pushed once, with the state read
+    at the end of the burst. Every flush pushes, even a state that looks
+    unchanged: the device count comes from the shared store and other workers
+    push changes too, so what this worker pushed last is no guide to what
+    subscribers last saw.
+    """
+    def __init__(self, sio, presence, max_per_connection: int, debounce: float):
+        self.sio = sio
+        self.presence = presence
+        self.max_per_connection = max_per_connection
+        self.debounce = debounce
+        self._subscriptions: Dict[str, Set[str]] = {}
+        self._pending: Set[str] = set()
+        self._flush_task: Optional[asyncio.Task] = None
+
+    async def _state(self, user_id: str) -> dict:
+        device_count = await self.presence.device_count(user_id)
+        return {"user_id": user_id, "is_online": device_count > 0, "device_count": device_count}
+
+    async def subscribe(self, sid: str, user_ids: List[str]):
+        """
+        Subscribes the socket to each user and answers with the current state of
+        every requested user (including ones it was already watching) in one
+        `presence_changed` event. Ids beyond the per-connection cap are returned
+        under "rejected".
+        """
+        current = self._subscriptions.setdefault(sid, set())
+        requested = list(dict.fromkeys(user_ids))
+        new_ids = [user_id for user_id in requested if user_id not in current]
+        accepted = new_ids[:max(self.max_per_connection - len(current), 0)]
+        rejected = new_ids[len(accepted):]
+
+        for user_id in accepted:
+            await self.sio.enter_room(sid, presence_room(user_id))
+            current.add(user_id)
+
+        watched = [user_id for user_id in requested if user_id in current]
+        payload = {"users": await asyncio.gather(*(self._state(user_id) for user_id in watched))}
+        if rejected:
+            payload["rejected"] = rejected
+        await self.sio.emit('presence_changed', payload, to=sid)
+
+    async def unsubscribe(self, sid: str, user_ids: List[str]):
+        current = self._subscriptions.get(sid)
+        if not current:
+            return
+        for user_id in user_ids:
+            if user_id in current:
+                await self.sio.leave_room(sid, presence_room(user_id))
+                current.discard(user_id)
+
+    def forget(self, sid: str):
+        """Drops a disconnected socket's subscriptions (Socket.IO already removed it from the rooms)."""
+        self._subscriptions.pop(sid, None)
+
+    def notify(self, user_id: str):
+        """Records that a user's presence may have changed; pushed after the debounce delay."""
+        self._pending.add(user_id)
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush())
+
+    async def _flush(self):
+        await asyncio.sleep(self.debounce)
+        pending, self._pending = self._pending, set()
+        self._flush_task = None
+        for user_id in pending:
+            try:
+                state = await self._state(user_id)
+                await self.sio.emit('presence_changed', {"users": [state]}, to=presence_room(user_id))
+            except Exception as e:
+                print(f"ERROR: Could not push presence change for {user_id}: {e}")
@@ -0,0 +1,49 @@
+# app/services/principal_cache.py
+import time
+from typing import Optional
+
+from cachetools import TLRUCache
+
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.schemas.user import User
+
+
+class PrincipalCache:
+    """
+    Bounded LRU cache of validated `User` models keyed by user id, so that
+    authenticated requests and socket handshakes skip the Supabase lookup.
+
+    An entry lives for at most `ttl` seconds and never outlives the JWT that
+    loaded it. Profile writes must call `invalidate` for the user.
+    """
+    def __init__(self, maxsize: int, ttl: float):
+        self.ttl = ttl
+        # Each value is (user, expires_at) on the monotonic clock.
+        self._cache = TLRUCache(maxsize=maxsize, ttu=lambda _key, value, _now: value[1])
+        self._hits = metrics.counter("principal_cache_hits")
+        self._misses = metrics.counter("principal_cache_misses")
+
+    def get(self, user_id: str) -> Optional[User]:
+        entry = self._cache.get(user_id)
+        if entry is None:
+            self._misses.inc()
+            return None
+        self._hits.inc()
+        return entry[0]
+
+    def put(self, user_id: str, user: User, token_exp: Optional[float] = None):
+        lifetime = self.ttl
+        if token_exp is not None:
+            lifetime = min(lifetime, token_exp - time.time())
+        if lifetime > 0:
+            self._cache[user_id] = (user, time.monotonic() + lifetime)
+
+    def invalidate(self, user_id: str):
+        self._cache.pop(user_id, None)
+
+
+principal_cache = PrincipalCache(
+    maxsize=settings.PRINCIPAL_CACHE_MAX_SIZE,
+    ttl=settings.PRINCIPAL_CACHE_TTL_SECONDS,
+)
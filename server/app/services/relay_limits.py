@@ -0,0 +1,92 @@
+# app/services/relay_limits.py
+import time
+from typing import Dict, List, Tuple
+
+from app.core.config import settings
+from app.core.metrics import metrics
+
+
+class _Bucket:
+    __slots__ = ("tokens", "stamp")
+
+    def __init__(self, tokens: float, stamp: float):
+        self.tokens = tokens
+        self.stamp = stamp
+
+
+class EventRateLimiter:
+    """
+    Token buckets per (user, event class), refilled lazily when the user next
+    sends an event, so idle users cost nothing but a dict entry. `limits` maps
+    each class to (tokens per second, burst). A user's buckets are shared by
+    all of their devices on this worker and dropped when the last one leaves.
+    """
+    def __init__(self, limits: Dict[str, Tuple[float, int]]):
+        self.limits = limits
+        self._buckets: Dict[Tuple[str, str], _Bucket] = {}
+        self._throttled = {event_class: metrics.counter("ws_throttled", event_class=event_class) for event_class in limits}
+
+    def allow(self, user_id: str, event_class: str) -> bool:
+        rate, burst = self.limits[event_class]
+        now = time.monotonic()
+        key = (user_id, event_class)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket(burst, now)
+        else:
+            bucket.tokens = min(burst, bucket.tokens + (now - bucket.stamp) * rate)
+            bucket.stamp = now
+
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            return True
+        self._throttled[event_class].inc()
+        return False
+
+    def forget(self, user_id: str):
+        for event_class in self.limits:
+            self._buckets.pop((user_id, event_class), None)
+
+
+class SendQueueGuard:
+    """
+    Watches the outgoing packet queue of every local socket a relay is about
+    to reach. A socket with `high_watermark` or more packets still waiting is a
+    slow consumer: with the "drop" policy it is skipped for this message, with
+    "disconnect" it is also disconnected so it stops holding memory. Sockets on
+    other workers are left to their own worker's guard.
+    """
+    def __init__(self, sio, high_watermark: int, policy: str):
+        self.sio = sio
+        self.high_watermark = high_watermark
+        self.policy = policy
+        self._dropped = metrics.counter("ws_backpressure", action="dropped")
+        self._disconnected = metrics.counter("ws_backpressure", action="disconnected")
+
+    async def slow_consumers(self, room: str, namespace: str = "/") -> List[str]:
+        """Returns the sids in `room` that must not be sent to, disconnecting them if configured."""
+        slow = []
+        for sid, eio_sid in self.sio.manager.get_participants(namespace, room):
+            socket = self.sio.eio.sockets.get(eio_sid)
+            if socket is not None and socket.queue.qsize() >= self.high_watermark:
+                slow.append(sid)
+        if not slow:
+            return slow
+
+        self._dropped.inc(len(slow))
+        for sid in slow:
+            print(f"WARNING: SID '{sid}' has a send queue at its high-watermark ({self.high_watermark}). Policy: {self.policy}.")
+            if self.policy == "disconnect":
+                await self.sio.disconnect(sid, namespace=namespace)
+                self._disconnected.inc()
+        return slow
+
+
+def default_rate_limits() -> Dict[str, Tuple[float, int]]:
+    return {
+        "handshake": (settings.WS_RATE_HANDSHAKE_PER_SECOND, settings.WS_RATE_HANDSHAKE_BURST),
+        "store": (settings.WS_RATE_STORE_PER_SECOND, settings.WS_RATE_STORE_BURST),
+        "notify": (settings.WS_RATE_NOTIFY_PER_SECOND, settings.WS_RATE_NOTIFY_BURST),
+        "presence": (settings.WS_RATE_PRESENCE_PER_SECOND, settings.WS_RATE_PRESENCE_BURST),
+        "control": (settings.WS_RATE_CONTROL_PER_SECOND, settings.WS_RATE_CONTROL_BURST),
+    }
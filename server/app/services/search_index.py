@@ -0,0 +1,477 @@
+# app/services/search_index.py
+import asyncio
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.core.constants import EmailProvider
+from app.core.metrics import metrics
+from app.db.supabase_client import get_db, execute
+from app.services import email_service
+from app.services.imap_pool import ImapSession
+
+SENT_FOLDERS = {EmailProvider.GMAIL: "[Gmail]/Sent Mail", EmailProvider.YAHOO: "Sent"}
+# UIDs per FETCH while indexing.
+FETCH_BATCH_SIZE = 200
+# Terms of a search query, optionally restricted to a column ("from:alice").
+QUERY_TERM_RE = re.compile(r'(?:(from|to|subject):)?"([^"]*)"|(?:(from|to|subject):)?(\S+)', re.IGNORECASE)
+QUERY_COLUMNS = {"from": "sender", "to": "recipients", "subject": "subject"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS accounts (
+    account_id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    enabled_at INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS folders (
+    account_id TEXT NOT NULL,
+    folder TEXT NOT NULL,
+    uidvalidity INTEGER,
+    highestmodseq INTEGER,
+    uidnext INTEGER,
+    PRIMARY KEY (account_id, folder)
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    account_id TEXT NOT NULL,
+    folder TEXT NOT NULL,
+    uid INTEGER NOT NULL,
+    sender TEXT NOT NULL,
+    recipients TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    sent_at INTEGER NOT NULL,
+    flags TEXT NOT NULL,
+    session_id TEXT,
+    snippet TEXT,
+    UNIQUE (account_id, folder, uid)
+);
+CREATE INDEX IF NOT EXISTS messages_account_date ON messages (account_id, sent_at DESC, id DESC);
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    sender, recipients, subject, snippet,
+    content='messages', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, sender, recipients, subject, snippet)
+    VALUES (new.id, new.sender, new.recipients, new.subject, new.snippet);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, sender, recipients, subject, snippet)
+    VALUES ('delete', old.id, old.sender, old.recipients, old.subject, old.snippet);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_au AFTER UPDATE OF sender, recipients, subject, snippet ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, sender, recipients, subject, snippet)
+    VALUES ('delete', old.id, old.sender, old.recipients, old.subject, old.snippet);
+    INSERT INTO messages_fts (rowid, sender, recipients, subject, snippet)
+    VALUES (new.id, new.sender, new.recipients, new.subject, new.snippet);
+END;
+"""
+
+
+def parse_uid_set(uid_set: str) -> List[Tuple[int, int]]:
+    """Parses a sequence set such as '3:5,9' into inclusive (low, high) ranges."""
+    ranges = []
+    for item in filter(None, uid_set.split(',')):
+        low, _, high = item.partition(':')
+        low, high = int(low), int(high or low)
+        ranges.append((min(low, high), max(low, high)))
+    return ranges
+
+
+def build_match_query(query: str) -> Optional[str]:
+    """
+    Turns what the user typed into an FTS5 query: every word must match as a
+    prefix, "quoted phrases" match as phrases, and from:/to:/subject: restrict
+    a term to that field. FTS5 operators in the input are treated as text.
+    """
+    terms = []
+    for match in QUERY_TERM_RE.finditer(query):
+        column = (match.group(1) or match.group(3) or "").lower()
+        phrase, word = match.group(2), match.group(4)
+        text = (phrase if phrase is not None else word).replace('"', '""').strip()
+        if not text:
+            continue
+        term = f'"{text}"' if phrase is not None else f'"{text}"*'
+        terms.append(f"{QUERY_COLUMNS[column]} : {term}" if column else term)
+    return " AND ".join(terms) or None
+
+
+class HeaderIndex:
+    """
+    SQLite FTS5 index of the headers of indexed accounts' messages: sender,
+    recipients, subject, date, flags, the session_id of QMail-encrypted mail
+    and a plaintext snippet of the rest. Alongside, each folder's UIDVALIDITY,
+    HIGHESTMODSEQ and UIDNEXT as of its last sync, which is what lets the
+    indexer ask the server only for what changed since.
+
+    The database is a local file shared by the workers on one host; calls are
+    blocking and serialized on one connection, so run them in the threadpool.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def open(self):
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        self._conn = conn
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def is_enabled(self, account_id: str) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM accounts WHERE account_id = ?", (account_id,)).fetchone() is not None
+
+    def enabled_accounts(self) -> Dict[str, str]:
+        with self._lock:
+            return dict(self._conn.execute("SELECT account_id, user_id FROM accounts"))
+
+    def enable(self, account_id: str, user_id: str):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO accounts (account_id, user_id, enabled_at) VALUES (?, ?, ?)",
+                (account_id, user_id, int(time.time()))
+            )
+
+    def disable(self, account_id: str):
+        """Forgets the account and everything indexed for it."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM messages WHERE account_id = ?", (account_id,))
+            self._conn.execute("DELETE FROM folders WHERE account_id = ?", (account_id,))
+            self._conn.execute("DELETE FROM accounts WHERE account_id = ?", (account_id,))
+
+    def folder_state(self, account_id: str, folder: str) -> Optional[Tuple[Optional[int], Optional[int], Optional[int]]]:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT uidvalidity, highestmodseq, uidnext FROM folders WHERE account_id = ? AND folder = ?",
+                (account_id, folder)
+            ).fetchone()
+
+    def _has_account(self, account_id: str) -> bool:
+        return self._conn.execute("SELECT 1 FROM accounts WHERE account_id = ?", (account_id,)).fetchone() is not None
+
+    def save_folder_state(self, account_id: str, folder: str, uidvalidity: Optional[int], highestmodseq: Optional[int], uidnext: Optional[int]) -> bool:
+        """Returns False, saving nothing, if the account is no longer indexed."""
+        with self._lock, self._conn:
+            if not self._has_account(account_id):
+                return False
+            self._conn.execute(
+                "INSERT OR REPLACE INTO folders (account_id, folder, uidvalidity, highestmodseq, uidnext) VALUES (?, ?, ?, ?, ?)",
+                (account_id, folder, uidvalidity, highestmodseq, uidnext)
+            )
+            return True
+
+    def reset_folder(self, account_id: str, folder: str):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM messages WHERE account_id = ? AND folder = ?", (account_id, folder))
+
+    def indexed_uids(self, account_id: str, folder: str) -> Set[int]:
+        with self._lock:
+            return {uid for (uid,) in self._conn.execute(
+                "SELECT uid FROM messages WHERE account_id = ? AND folder = ?", (account_id, folder)
+            )}
+
+    def add(self, account_id: str, folder: str, records: List[dict]) -> bool:
+        """
+        Adds or updates the records. Returns False, adding nothing, if the
+        account is no longer indexed; the check shares the insert's transaction
+        so a worker can't write after another one disabled the account.
+        """
+        with self._lock, self._conn:
+            if not self._has_account(account_id):
+                return False
+            self._conn.executemany(
+                "INSERT INTO messages (account_id, folder, uid, sender, recipients, subject, sent_at, flags, session_id, snippet)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (account_id, folder, uid) DO UPDATE SET sender = excluded.sender, recipients = excluded.recipients,"
+                " subject = excluded.subject, sent_at = excluded.sent_at, flags = excluded.flags,"
+                " session_id = excluded.session_id, snippet = excluded.snippet",
+                [
+                    (account_id, folder, r["uid"], r["sender"], r["recipients"], r["subject"], r["sent_at"],
+                     " ".join(r["flags"]), r["session_id"], r["snippet"])
+                    for r in records
+                ]
+            )
+            return True
+
+    def update_flags(self, account_id: str, folder: str, changes: List[Tuple[int, List[str]]]):
+        # Flags aren't in the FTS table, so this skips the FTS triggers.
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE messages SET flags = ? WHERE account_id = ? AND folder = ? AND uid = ?",
+                [(" ".join(flags), account_id, folder, uid) for uid, flags in changes]
+            )
+
+    def remove(self, account_id: str, folder: str, uids: Iterable[int]):
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "DELETE FROM messages WHERE account_id = ? AND folder = ? AND uid = ?",
+                [(account_id, folder, uid) for uid in uids]
+            )
+
+    def remove_ranges(self, account_id: str, folder: str, ranges: List[Tuple[int, int]]):
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "DELETE FROM messages WHERE account_id = ? AND folder = ? AND uid BETWEEN ? AND ?",
+                [(account_id, folder, low, high) for low, high in ranges]
+            )
+
+    def purge_orphans(self):
+        """Deletes messages and folder states left behind by accounts no longer indexed."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM messages WHERE account_id NOT IN (SELECT account_id FROM accounts)")
+            self._conn.execute("DELETE FROM folders WHERE account_id NOT IN (SELECT account_id FROM accounts)")
+
+    def search(self, account_id: str, match: str, folder: Optional[str], limit: int, after: Optional[Tuple[int, int]]) -> Tuple[List[dict], Optional[Tuple[int, int]]]:
+        """
+        Returns a page of matching messages, newest first, and the (sent_at, id)
+        key to continue after, or None on the last page.
+        """
+        sql = (
+            "SELECT m.id, m.folder, m.uid, m.sender, m.recipients, m.subject, m.sent_at, m.flags, m.session_id, m.snippet"
+            " FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid"
+            " WHERE messages_fts MATCH ? AND m.account_id = ?"
+        )
+        params: list = [match, account_id]
+        if folder is not None:
+            sql += " AND m.folder = ?"
+            params.append(folder)
+        if after is not None:
+            sql += " AND (m.sent_at, m.id) < (?, ?)"
+            params.extend(after)
+        sql += " ORDER BY m.sent_at DESC, m.id DESC LIMIT ?"
+        params.append(limit + 1)
+
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        page = [
+            {
+                "folder": folder, "uid": str(uid), "sender": sender, "recipients": recipients, "subject": subject,
+                "sent_at": sent_at or None, "flags": flags.split(), "session_id": session_id, "snippet": snippet,
+                "is_qumail_encrypted": session_id is not None,
+            }
+            for _, folder, uid, sender, recipients, subject, sent_at, flags, session_id, snippet in rows[:limit]
+        ]
+        next_key = (rows[limit - 1][6], rows[limit - 1][0]) if len(rows) > limit else None
+        return page, next_key
+
+
+class SearchIndexer:
+    """
+    Keeps the header index of opted-in accounts up to date and answers searches
+    from it, so search latency doesn't depend on the provider's IMAP SEARCH.
+
+    A folder sync reuses the delta-sync path: with CONDSTORE/QRESYNC only the
+    messages changed since the stored HIGHESTMODSEQ are fetched, and expunges
+    come from VANISHED or the list of present UIDs. A new folder, or one whose
+    UIDVALIDITY changed, is backfilled with its newest `backfill_max` messages.
+    Syncs are triggered by IDLE pushes and client delta syncs, and every
+    `interval` seconds for all indexed accounts. A refresh requested while the
+    same folder is syncing runs once more afterwards instead of in parallel.
+    A pooled IMAP session is borrowed once to compute the changes and then
+    once per FETCH batch, so a long backfill doesn't keep the account's
+    interactive requests waiting for a connection.
+    """
+    def __init__(self, index: HeaderIndex, enabled: bool, interval: float, backfill_max: int, concurrency: int):
+        self.index = index
+        self.enabled = enabled
+        self.interval = interval
+        self.backfill_max = backfill_max
+        self._slots = asyncio.Semaphore(concurrency)
+        self._accounts: Dict[str, str] = {}
+        self._running: Dict[Tuple[str, str], asyncio.Task] = {}
+        self._dirty: Set[Tuple[str, str]] = set()
+        self._task: Optional[asyncio.Task] = None
+
+        self._syncs = {outcome: metrics.counter("search_index_syncs", outcome=outcome) for outcome in ("ok", "failed")}
+        self._indexed = metrics.counter("search_index_messages_indexed")
+        self._query_latency = metrics.histogram("search_index_query_seconds")
+
+    async def start(self):
+        if not self.enabled or self._task is not None:
+            return
+        await run_in_threadpool(self.index.open)
+        self._accounts = await run_in_threadpool(self.index.enabled_accounts)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        for task in list(self._running.values()):
+            task.cancel()
+        await asyncio.gather(self._task, *self._running.values(), return_exceptions=True)
+        self._task = None
+        await run_in_threadpool(self.index.close)
+
+    async def is_indexed(self, account_id: str) -> bool:
+        # Asks the database rather than self._accounts, which another worker may have changed.
+        return self._task is not None and await run_in_threadpool(self.index.is_enabled, account_id)
+
+    async def enable(self, linked_account: dict):
+        account_id = str(linked_account['id'])
+        await run_in_threadpool(self.index.enable, account_id, str(linked_account['user_id']))
+        self._accounts[account_id] = str(linked_account['user_id'])
+        self.refresh_account(linked_account)
+
+    async def disable(self, account_id: str):
+        # A sync in progress, on any worker, stops at its next batch: the index refuses its writes from now on.
+        self._accounts.pop(account_id, None)
+        await run_in_threadpool(self.index.disable, account_id)
+
+    def refresh_account(self, linked_account: dict):
+        folders = ["INBOX", SENT_FOLDERS.get(linked_account['provider'])]
+        for folder in filter(None, folders):
+            self.refresh(linked_account, folder)
+
+    def refresh(self, linked_account: dict, folder: str):
+        """Schedules a sync of the folder if the account is indexed. Returns at once."""
+        account_id = str(linked_account['id'])
+        if self._task is None or account_id not in self._accounts:
+            return
+        key = (account_id, folder)
+        if key in self._running:
+            self._dirty.add(key)
+            return
+        self._running[key] = asyncio.create_task(self._refresh(key, linked_account))
+
+    async def _refresh(self, key: Tuple[str, str], linked_account: dict):
+        try:
+            while True:
+                self._dirty.discard(key)
+                async with self._slots:
+                    try:
+                        await self._sync_folder(linked_account, key[0], key[1])
+                        self._syncs["ok"].inc()
+                    except Exception as e:
+                        self._syncs["failed"].inc()
+                        print(f"WARNING: Search index sync of {key[1]} for account {key[0]} failed: {e}")
+                if key not in self._dirty:
+                    break
+        finally:
+            self._running.pop(key, None)
+
+    async def _sync_folder(self, linked_account: dict, account_id: str, folder: str):
+        new_uids, folder_state = await email_service.run_imap_command(
+            linked_account, None, self._plan_sync, account_id, folder
+        )
+        for start in range(0, len(new_uids), FETCH_BATCH_SIZE):
+            # Asks the database, as the account may have been disabled on another worker.
+            if not await run_in_threadpool(self.index.is_enabled, account_id):
+                return
+            records = await email_service.run_imap_command(
+                linked_account, folder, email_service.imap_fetch_index_records, new_uids[start:start + FETCH_BATCH_SIZE]
+            )
+            if not await run_in_threadpool(self.index.add, account_id, folder, records):
+                return
+            self._indexed.inc(len(records))
+        await run_in_threadpool(self.index.save_folder_state, account_id, folder, *folder_state)
+
+    def _plan_sync(self, session: ImapSession, account_id: str, folder: str) -> Tuple[List[int], Tuple[Optional[int], Optional[int], Optional[int]]]:
+        """
+        Applies expunges and flag changes since the last sync. Returns the UIDs
+        still to fetch and the folder state to save once they are indexed.
+        """
+        state = self.index.folder_state(account_id, folder)
+        uidvalidity, highestmodseq, uidnext = state or (None, None, None)
+        delta = email_service.imap_delta_sync(session, folder, uidvalidity, highestmodseq)
+        mode = delta["mode"]
+
+        if state is None or mode == "reset" or delta.get("uidvalidity") != uidvalidity:
+            # New folder, or its UIDs were renumbered: what's indexed no longer matches.
+            self.index.reset_folder(account_id, folder)
+            present = email_service.imap_search_all(session)
+            new_uids = present[-self.backfill_max:] if self.backfill_max else []
+            uidnext = None
+        else:
+            if mode == "qresync":
+                self.index.remove_ranges(account_id, folder, parse_uid_set(delta["vanished"]))
+                present = None
+            else:
+                # Without QRESYNC expunges are found by diffing against the UIDs still present.
+                present = (
+                    [uid for low, high in parse_uid_set(delta["present"]) for uid in range(low, high + 1)]
+                    if mode == "condstore" else email_service.imap_search_all(session)
+                )
+                indexed = self.index.indexed_uids(account_id, folder)
+                self.index.remove(account_id, folder, indexed.difference(present))
+
+            changed = delta.get("changed", [])
+            indexed = self.index.indexed_uids(account_id, folder)
+            self.index.update_flags(account_id, folder, [(uid, flags) for uid, flags, _ in changed if uid in indexed])
+            # Only messages that arrived since the last sync are new; older unindexed ones are past the backfill.
+            candidates = [uid for uid, _, _ in changed] if mode in ("qresync", "condstore") else present
+            new_uids = sorted(uid for uid in candidates if uid not in indexed and uid >= (uidnext or 0))
+
+        if delta.get("uidnext") is None and present:
+            delta["uidnext"] = max(present) + 1
+        return new_uids, (delta.get("uidvalidity"), delta.get("highestmodseq"), delta.get("uidnext") or uidnext)
+
+    async def search(self, account_id: str, query: str, folder: Optional[str], limit: int, cursor: Optional[str]) -> Tuple[List[dict], Optional[str]]:
+        """Returns a page of results and the cursor for the next page. Raises ValueError on a bad cursor."""
+        match = build_match_query(query)
+        if match is None:
+            return [], None
+        after = None
+        if cursor:
+            sent_at, _, row_id = cursor.partition(':')
+            after = (int(sent_at), int(row_id))
+
+        started = time.perf_counter()
+        page, next_key = await run_in_threadpool(self.index.search, account_id, match, folder, limit, after)
+        self._query_latency.observe(time.perf_counter() - started)
+        return page, f"{next_key[0]}:{next_key[1]}" if next_key else None
+
+    async def _run(self):
+        # Stagger the first cycle so several workers don't all sync at once.
+        await asyncio.sleep(random.uniform(0, self.interval))
+        while True:
+            try:
+                await self.refresh_all()
+            except Exception as e:
+                print(f"ERROR: Search index refresh cycle failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def refresh_all(self):
+        # Also sweeps up rows a sync on another worker wrote while the account was being disabled.
+        await run_in_threadpool(self.index.purge_orphans)
+        self._accounts = await run_in_threadpool(self.index.enabled_accounts)
+        account_ids = list(self._accounts)
+        if not account_ids:
+            return
+        response = await execute(
+            get_db().table('linked_accounts').select('*').in_('id', account_ids),
+            "linked_accounts.get_for_search_index"
+        )
+        found = {str(account['id']): account for account in response.data or []}
+        for account_id in account_ids:
+            if account_id not in found:
+                # The account was unlinked; drop its index.
+                print(f"INFO: Removing search index of unlinked account {account_id}.")
+                await self.disable(account_id)
+            else:
+                self.refresh_account(found[account_id])
+
+
+search_indexer = SearchIndexer(
+    index=HeaderIndex(settings.SEARCH_INDEX_PATH),
+    enabled=settings.SEARCH_INDEX_ENABLED,
+    interval=settings.SEARCH_INDEX_REFRESH_INTERVAL_SECONDS,
+    backfill_max=settings.SEARCH_INDEX_BACKFILL_MAX_MESSAGES,
+    concurrency=settings.SEARCH_INDEX_SYNC_CONCURRENCY,
+)
@@ -0,0 +1,169 @@
+# app/services/session_pool.py
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+
+class PooledSession:
+    """
+    An authenticated connection held by a SessionPool, with the access token it
+    logged in with and when it was last used. Subclasses wrap the protocol's
+    connection object and implement `is_alive` and `close`.
+    """
+    def __init__(self, access_token: str):
+        self.access_token = access_token
+        self.last_used = time.monotonic()
+
+    def is_alive(self) -> bool:
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+
+class _AccountSlots:
+    """The connection slots of one account and how many callers hold or await one."""
+    __slots__ = ("semaphore", "users")
+
+    def __init__(self, max_per_account: int):
+        self.semaphore = threading.BoundedSemaphore(max_per_account)
+        self.users = 0
+
+
+class SessionPool:
+    """
+    Keeps authenticated sessions per linked account so that consecutive
+    operations skip the TLS handshake and the XOAUTH2 exchange.
+
+    Sessions are handed out one caller at a time, the number of open
+    connections per account is bounded, sessions idle for longer than
+    `health_check_interval` are probed before reuse and a session is
+    re-authenticated whenever the account's access token has rotated.
+    Sessions idle for `idle_timeout` seconds are closed by a reaper thread
+    (see `start`), and an account's bookkeeping is dropped once it has neither
+    callers nor idle sessions. Subclasses set `session_class`, which is built
+    from the connection that `connect` returns and the access token.
+    """
+    session_class: Callable[[Any, str], PooledSession] = PooledSession
+    protocol = "session"
+
+    def __init__(self, max_per_account: int, idle_timeout: float, health_check_interval: float, acquire_timeout: float):
+        self.max_per_account = max_per_account
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.acquire_timeout = acquire_timeout
+        self._lock = threading.Lock()
+        self._idle: Dict[str, List[PooledSession]] = {}
+        self._slots: Dict[str, _AccountSlots] = {}
+        self._stopping = threading.Event()
+        self._reaper: Optional[threading.Thread] = None
+
+    def start(self):
+        """Starts the reaper that closes sessions left idle for `idle_timeout`."""
+        if self._reaper is None:
+            self._stopping.clear()
+            self._reaper = threading.Thread(target=self._reap_loop, name=f"{self.protocol}-pool-reaper", daemon=True)
+            self._reaper.start()
+
+    def _reap_loop(self):
+        while not self._stopping.wait(max(self.idle_timeout / 4, 1.0)):
+            try:
+                self.reap()
+            except Exception as e:
+                print(f"ERROR: {self.protocol} pool reaper failed: {e}")
+
+    def reap(self):
+        """Closes every idle session that has expired and forgets accounts left with nothing."""
+        expired: List[PooledSession] = []
+        cutoff = time.monotonic() - self.idle_timeout
+        with self._lock:
+            for account_id in list(self._idle):
+                sessions = self._idle[account_id]
+                expired.extend(s for s in sessions if s.last_used <= cutoff)
+                sessions[:] = [s for s in sessions if s.last_used > cutoff]
+                self._forget_if_unused(account_id)
+        for session in expired:
+            session.close()
+
+    def _forget_if_unused(self, account_id: str):
+        """Drops the account's entries once nobody uses them. Call with the lock held."""
+        if not self._idle.get(account_id, True):
+            del self._idle[account_id]
+        slots = self._slots.get(account_id)
+        if slots is not None and slots.users == 0 and account_id not in self._idle:
+            del self._slots[account_id]
+
+    def _take_idle(self, account_id: str) -> Optional[PooledSession]:
+        """Pops the account's most recently used idle session, closing its expired ones."""
+        cutoff = time.monotonic() - self.idle_timeout
+        with self._lock:
+            sessions = self._idle.get(account_id, [])
+            expired = [s for s in sessions if s.last_used <= cutoff]
+            sessions[:] = [s for s in sessions if s.last_used > cutoff]
+            session = sessions.pop() if sessions else None
+        for stale in expired:
+            stale.close()
+        return session
+
+    def _release(self, account_id: str, session: PooledSession):
+        session.last_used = time.monotonic()
+        with self._lock:
+            self._idle.setdefault(account_id, []).append(session)
+
+    @contextmanager
+    def lease(self, account_id: str, access_token: str, connect: Callable[[], Any]):
+        """
+        Lends out an authenticated session for `account_id`, opening one with
+        `connect` when no reusable session is available. The session goes back
+        to the pool on success and is closed if the caller raised.
+        """
+        with self._lock:
+            slots = self._slots.get(account_id)
+            if slots is None:
+                slots = self._slots[account_id] = _AccountSlots(self.max_per_account)
+            slots.users += 1
+        try:
+            if not slots.semaphore.acquire(timeout=self.acquire_timeout):
+                raise TimeoutError(f"Timed out waiting for a free {self.protocol} connection for account {account_id}")
+            try:
+                session = self._take_idle(account_id)
+
+                if session and session.access_token != access_token:
+                    # The token rotated since this session logged in; start over with the new one.
+                    session.close()
+                    session = None
+
+                if session and time.monotonic() - session.last_used >= self.health_check_interval and not session.is_alive():
+                    session.close()
+                    session = None
+
+                if session is None:
+                    session = self.session_class(connect(), access_token)
+
+                try:
+                    yield session
+                except BaseException:
+                    session.close()
+                    raise
+                self._release(account_id, session)
+            finally:
+                slots.semaphore.release()
+        finally:
+            with self._lock:
+                slots.users -= 1
+                self._forget_if_unused(account_id)
+
+    def close_all(self):
+        """Stops the reaper and closes every idle session. Used on application shutdown."""
+        self._stopping.set()
+        if self._reaper is not None:
+            self._reaper.join(timeout=5)
+            self._reaper = None
+        with self._lock:
+            sessions = [s for group in self._idle.values() for s in group]
+            self._idle.clear()
+            for account_id in [a for a, slots in self._slots.items() if slots.users == 0]:
+                del self._slots[account_id]
+        for session in sessions:
+            session.close()
@@ -1,42 +1,117 @@
-from app.db.supabase_client import supabase
+from app.db.supabase_client import get_db, execute
+from app.core.config import settings
+from datetime import datetime, timedelta, timezone
+from postgrest import CountMethod, ReturnMethod
 from uuid import UUID
+from typing import List, Optional, Tuple
 
 async def create_pending_session(session_id: UUID, initiator_id: UUID, recipient_id: UUID, initiator_email: str, recipient_email: str):
     """
     Creates a record of a pending handshake request in the database.
+
+    Every offline email has its own session_id and its own record, which
+    expires after PENDING_SESSION_TTL_SECONDS. A recipient already holding
+    PENDING_SESSIONS_MAX_PER_RECIPIENT live requests gets no more, and None is
+    returned. Storing the same session_id again is a no-op that returns the
+    existing record, as long as it belongs to the same initiator.
     """
-    try: 
-        response = supabase.table('pending_sessions').insert({
+    try:
+        now = datetime.now(timezone.utc)
+        count_response = await execute(
+            get_db().table('pending_sessions').select('session_id', count=CountMethod.exact, head=True)
+                .eq('recipient_id', str(recipient_id)).eq('status', 'pending')
+                .gt('expires_at', now.isoformat()),
+            "pending_sessions.count_for_recipient"
+        )
+        if (count_response.count or 0) >= settings.PENDING_SESSIONS_MAX_PER_RECIPIENT:
+            print(f"WARNING: Recipient {recipient_id} already has {count_response.count} pending session(s). Not storing another.")
+            return None
+
+        expires_at = now + timedelta(seconds=settings.PENDING_SESSION_TTL_SECONDS)
+        response = await execute(get_db().table('pending_sessions').upsert({
             "session_id": str(session_id),
             "initiator_id": str(initiator_id),
             "recipient_id": str(recipient_id),
             "initiator_email": initiator_email,
             "recipient_email": recipient_email,
-        }).execute()
-        return response.data[0] if response.data else None
+            "status": "pending",
+            "expires_at": expires_at.isoformat(),
+        }, on_conflict="session_id", ignore_duplicates=True), "pending_sessions.insert")
+        if response.data:
+            return response.data[0]
+
+        # The session_id exists already: a retry of the same store, or someone else's session.
+        existing = await execute(
+            get_db().table('pending_sessions').select('*').eq('session_id', str(session_id)).limit(1),
+            "pending_sessions.get_by_id"
+        )
+        if existing.data and str(existing.data[0]['initiator_id']) == str(initiator_id):
+            return existing.data[0]
+        print(f"WARNING: Pending session {session_id} already belongs to another initiator. Not storing it.")
+        return None
     except Exception as e:
         print(f"ERROR: Could not create pending session: {e}")
         return None
 
-async def get_pending_sessions_for_recipient(recipient_id: UUID):
+# Only what the recipient's client needs to show and accept a request.
+PENDING_SESSION_COLUMNS = "session_id, initiator_id, initiator_email"
+
+async def get_pending_sessions_for_recipient(recipient_id: UUID, limit: int, after: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
     """
-    Fetches all pending handshake requests for a user who has just come online.
+    Fetches one page of pending handshake requests for a user who has just come
+    online, ordered by session_id (served by the (recipient_id, status, session_id)
+    index). Returns the page and the cursor of the next one, or None if this is the last.
     """
     try:
-        response = supabase.table('pending_sessions').select("*").eq('recipient_id', str(recipient_id)).eq('status', 'pending').execute()
-        return response.data
+        query = (
+            get_db().table('pending_sessions').select(PENDING_SESSION_COLUMNS)
+            .eq('recipient_id', str(recipient_id)).eq('status', 'pending')
+            .gt('expires_at', datetime.now(timezone.utc).isoformat())
+        )
+        if after:
+            query = query.gt('session_id', after)
+        # One extra row tells us whether another page follows without a count query.
+        response = await execute(query.order('session_id').limit(limit + 1), "pending_sessions.get_for_recipient")
+        rows = response.data or []
+        if len(rows) > limit:
+            rows = rows[:limit]
+            return rows, str(rows[-1]['session_id'])
+        return rows, None
     except Exception as e:
         print(f"ERROR: Could not fetch pending sessions: {e}")
-        return []
+        return [], None
 
-async def delete_pending_session(session_id: UUID):
+async def delete_pending_session(session_id: UUID, recipient_id: str):
     """
     Removes a pending session from the database, usually after it has been
-    successfully completed or acknowledged.
+    successfully completed or acknowledged. Only the recipient's own row is
+    deleted, so knowing a session_id isn't enough to remove someone else's.
     """
     try:
-        supabase.table('pending_sessions').delete().eq('session_id', str(session_id)).execute()
+        await execute(
+            get_db().table('pending_sessions').delete().eq('session_id', str(session_id)).eq('recipient_id', recipient_id),
+            "pending_sessions.delete"
+        )
         return True
     except Exception as e:
         print(f"ERROR: Could not delete pending session {session_id}: {e}")
-        return False
\ No newline at end of file
+        return False
+
+async def delete_expired_pending_sessions(batch_size: int) -> int:
+    """
+    Deletes up to `batch_size` expired pending sessions in one statement and
+    returns how many were removed.
+    """
+    now = datetime.now(timezone.utc).isoformat()
+    response = await execute(
+        get_db().table('pending_sessions').select('session_id').lt('expires_at', now).limit(batch_size),
+        "pending_sessions.get_expired"
+    )
+    session_ids = [row['session_id'] for row in (response.data or [])]
+    if not session_ids:
+        return 0
+    await execute(
+        get_db().table('pending_sessions').delete(returning=ReturnMethod.minimal).in_('session_id', session_ids).lt('expires_at', now),
+        "pending_sessions.delete_expired"
+    )
+    return len(session_ids)
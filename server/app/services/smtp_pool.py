@@ -0,0 +1,53 @@
+# app/services/smtp_pool.py
+import smtplib
+from contextlib import contextmanager
+from typing import Callable
+
+from app.core.config import settings
+from app.services.session_pool import PooledSession, SessionPool
+
+
+class SmtpSession(PooledSession):
+    """An authenticated SMTP connection in the pool."""
+    def __init__(self, smtp: smtplib.SMTP, access_token: str):
+        super().__init__(access_token)
+        self.smtp = smtp
+
+    def is_alive(self) -> bool:
+        try:
+            code, _ = self.smtp.noop()
+            return code == 250
+        except Exception:
+            return False
+
+    def close(self):
+        try:
+            self.smtp.quit()
+        except Exception:
+            try:
+                self.smtp.close()
+            except Exception:
+                pass
+
+
+class SmtpConnectionPool(SessionPool):
+    """
+    Pool of SMTP connections, so that queued messages are delivered without a
+    TLS handshake and XOAUTH2 exchange each.
+    """
+    session_class = SmtpSession
+    protocol = "SMTP"
+
+    @contextmanager
+    def connection(self, account_id: str, access_token: str, connect: Callable[[], smtplib.SMTP]):
+        """Lends out the smtplib connection of a pooled session; see SessionPool.lease."""
+        with self.lease(account_id, access_token, connect) as session:
+            yield session.smtp
+
+
+smtp_pool = SmtpConnectionPool(
+    max_per_account=settings.SMTP_POOL_MAX_CONNECTIONS_PER_ACCOUNT,
+    idle_timeout=settings.SMTP_POOL_IDLE_TIMEOUT_SECONDS,
+    health_check_interval=settings.SMTP_POOL_HEALTH_CHECK_INTERVAL_SECONDS,
+    acquire_timeout=settings.SMTP_POOL_ACQUIRE_TIMEOUT_SECONDS,
+)
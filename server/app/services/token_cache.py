@@ -0,0 +1,58 @@
+# app/services/token_cache.py
+import asyncio
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from app.core.config import settings
+
+
+class AccessTokenCache:
+    """
+    In-process cache of decrypted OAuth access tokens keyed by linked-account id.
+
+    Tokens are served until `refresh_margin` before they expire, so callers
+    skip the Fernet decrypt on every action. Refreshes are single-flight:
+    concurrent callers for the same account all await the one in-flight
+    refresh instead of each hitting the provider and the database.
+    """
+    def __init__(self, refresh_margin: timedelta):
+        self.refresh_margin = refresh_margin
+        self._lock = threading.Lock()
+        self._tokens: Dict[str, Tuple[str, datetime]] = {}
+        # Only touched from the event loop.
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    def is_fresh(self, expiry: Optional[datetime]) -> bool:
+        return expiry is not None and expiry > datetime.now(timezone.utc) + self.refresh_margin
+
+    def get(self, account_id: str) -> Optional[str]:
+        with self._lock:
+            entry = self._tokens.get(account_id)
+        if entry and self.is_fresh(entry[1]):
+            return entry[0]
+        return None
+
+    def store(self, account_id: str, access_token: str, expiry: datetime):
+        with self._lock:
+            self._tokens[account_id] = (access_token, expiry)
+
+    def invalidate(self, account_id: str):
+        with self._lock:
+            self._tokens.pop(account_id, None)
+
+    async def refresh(self, account_id: str, refresh: Callable[[], Awaitable[str]]) -> str:
+        """
+        Runs `refresh` for the account unless one is already in flight, in which
+        case the caller simply waits for that result.
+        """
+        future = self._inflight.get(account_id)
+        if future is None:
+            future = asyncio.ensure_future(refresh())
+            self._inflight[account_id] = future
+            future.add_done_callback(lambda _: self._inflight.pop(account_id, None))
+        # Shield so one cancelled caller doesn't abort the refresh for everyone else.
+        return await asyncio.shield(future)
+
+
+token_cache = AccessTokenCache(refresh_margin=timedelta(seconds=settings.TOKEN_REFRESH_MARGIN_SECONDS))
@@ -0,0 +1,123 @@
+# app/services/token_refresher.py
+import asyncio
+import random
+import httpx
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from app.core.config import settings
+from app.db.supabase_client import get_db, execute
+from app.services import email_service
+from app.services.token_cache import token_cache
+
+
+class TokenRefresher:
+    """
+    Background task that refreshes linked-account OAuth tokens before they
+    expire, so user requests almost never wait on a round trip to the provider.
+
+    Every cycle it loads the accounts whose tokens expire within `window`,
+    refreshes them in batches with bounded concurrency and a little random
+    jitter, and records failures on the account row. Accounts whose refresh
+    token was revoked are marked `needs_reauth` and skipped until the user
+    re-links them; other failures back off exponentially via `refresh_retry_at`.
+    Both are filtered out in the query, so they never fill its window.
+    """
+    def __init__(self, interval: float, window: timedelta, batch_size: int, concurrency: int, jitter: float):
+        self.interval = interval
+        self.window = window
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.jitter = jitter
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        # Stagger the first cycle so several workers don't all scan at once.
+        await asyncio.sleep(random.uniform(0, self.jitter))
+        while True:
+            try:
+                await self.refresh_due_accounts()
+            except Exception as e:
+                print(f"ERROR: Token refresher cycle failed: {e}")
+            await asyncio.sleep(self.interval + random.uniform(0, self.jitter))
+
+    async def refresh_due_accounts(self):
+        now = datetime.now(timezone.utc)
+        horizon = now + self.window
+        response = await execute(
+            get_db().table('linked_accounts').select('*')
+                .lt('token_expiry', horizon.isoformat())
+                .eq('needs_reauth', False)
+                .or_(f'refresh_retry_at.is.null,refresh_retry_at.lte."{now.isoformat()}"')
+                .order('token_expiry')
+                .limit(self.batch_size * self.concurrency),
+            "linked_accounts.due_for_refresh"
+        )
+        accounts = response.data or []
+        if not accounts:
+            return
+
+        print(f"INFO: Proactively refreshing {len(accounts)} OAuth token(s).")
+        semaphore = asyncio.Semaphore(self.concurrency)
+        for start in range(0, len(accounts), self.batch_size):
+            batch = accounts[start:start + self.batch_size]
+            await asyncio.gather(*(self._refresh_one(account, semaphore) for account in batch))
+
+    async def _refresh_one(self, account: dict, semaphore: asyncio.Semaphore):
+        account_id = str(account['id'])
+        async with semaphore:
+            await asyncio.sleep(random.uniform(0, self.jitter / 10))
+            try:
+                # A successful refresh also clears the failure columns.
+                await token_cache.refresh(account_id, lambda: email_service._refresh_and_update_tokens(account))
+            except Exception as e:
+                try:
+                    await self._record_failure(account, e)
+                except Exception as db_error:
+                    print(f"ERROR: Could not record the token refresh failure of {account['email_address']}: {db_error}")
+
+    async def _record_failure(self, account: dict, error: Exception):
+        attempts = (account.get('refresh_failures') or 0) + 1
+        revoked = (
+            isinstance(error, httpx.HTTPStatusError)
+            and error.response.status_code in (400, 401)
+            and 'invalid_grant' in error.response.text
+        )
+        backoff = min(self.interval * (2 ** attempts), 3600)
+        now = datetime.now(timezone.utc)
+        # Conditional on the refresh token, so a re-link that raced this attempt isn't marked failed.
+        await execute(
+            get_db().table('linked_accounts').update({
+                'needs_reauth': revoked,
+                'refresh_failures': attempts,
+                'refresh_failed_at': now.isoformat(),
+                'refresh_retry_at': (now + timedelta(seconds=backoff)).isoformat(),
+            }).eq('id', account['id']).eq('encrypted_refresh_token', account['encrypted_refresh_token']),
+            "linked_accounts.record_refresh_failure"
+        )
+        if revoked:
+            print(f"WARNING: Refresh token for {account['email_address']} was revoked. The account must be re-linked.")
+        else:
+            print(f"ERROR: Proactive token refresh failed for {account['email_address']} (attempt {attempts}): {error}")
+
+
+token_refresher = TokenRefresher(
+    interval=settings.TOKEN_REFRESHER_INTERVAL_SECONDS,
+    window=timedelta(seconds=settings.TOKEN_REFRESHER_WINDOW_SECONDS),
+    batch_size=settings.TOKEN_REFRESHER_BATCH_SIZE,
+    concurrency=settings.TOKEN_REFRESHER_CONCURRENCY,
+    jitter=settings.TOKEN_REFRESHER_JITTER_SECONDS,
+)
@@ -1,6 +1,7 @@
-from app.db.supabase_client import supabase
-from app.core.security import get_password_hash, verify_password
+from app.db.supabase_client import get_db, execute
+from app.core.security import get_password_hash_async, verify_and_update_password_async
 from typing import Optional
+from app.services.principal_cache import principal_cache
 
 async def get_user_by_email(email: str) -> Optional[dict]:
     """
@@ -9,7 +10,7 @@ async def get_user_by_email(email: str) -> Optional[dict]:
     """
     try:
         # The .execute() call is a network operation and MUST be awaited.
-        response = supabase.table('users').select("*").eq('email', email).single().execute()
+        response = await execute(get_db().table('users').select("*").eq('email', email).single(), "users.get_by_email")
         return response.data
     except Exception:
         return None
@@ -21,18 +22,32 @@ async def get_user_by_id(user_id: str) -> Optional[dict]:
     Returns the user data dict or None if not found.
     """
     try:
-        response = supabase.table('users').select("*").eq('id', user_id).single().execute()
+        response = await execute(get_db().table('users').select("*").eq('id', user_id).single(), "users.get_by_id")
         return response.data
     except Exception:
         return None
 
+async def update_user(user_id: str, updates: dict) -> Optional[dict]:
+    """
+    Updates fields on a user record. All profile writes should go through here
+    so the cached principal for the user is invalidated.
+    """
+    try:
+        response = await execute(get_db().table('users').update(updates).eq('id', user_id), "users.update")
+        return response.data[0] if response.data else None
+    except Exception as e:
+        print(f"Error updating user {user_id}: {e}")
+        return None
+    finally:
+        principal_cache.invalidate(user_id)
+
 async def create_user(name: str, email: str, password: str):
     """
     Asynchronously creates a new user in the 'users' table.
     Takes primitive types as arguments for better separation of concerns.
     Returns the newly created user data (without the password hash).
     """
-    hashed_password = get_password_hash(password)
+    hashed_password = await get_password_hash_async(password)
     
     # We now correctly include the 'name' field as required by your register endpoint.
     new_user_data = {
@@ -43,7 +58,7 @@ async def create_user(name: str, email: str, password: str):
     }
     
     try:
-        response = supabase.table('users').insert(new_user_data).execute()
+        response = await execute(get_db().table('users').insert(new_user_data), "users.create")
         
         if response.data:
             created_user = response.data[0]
@@ -69,7 +84,7 @@ async def create_social_user(name: str, email: str, provider: str):
     }
     
     try:
-        response = supabase.table('users').insert(new_user_data).execute()
+        response = await execute(get_db().table('users').insert(new_user_data), "users.create_social")
         return response.data[0] if response.data else None
     except Exception as e:
         print(f"Error creating social user: {e}")
@@ -79,7 +94,8 @@ async def authenticate_user(email: str, password: str):
     """
     Asynchronously authenticates a user.
     1. Fetches the user by email.
-    2. Verifies the provided password against the stored hash.
+    2. Verifies the provided password against the stored hash, rehashing it
+       if it was made with a different bcrypt cost.
     Returns the user data dict if successful, otherwise None.
     """
     user = await get_user_by_email(email=email)
@@ -92,8 +108,13 @@ async def authenticate_user(email: str, password: str):
         return None
     
     # If the password does not match the hash, authentication fails.
-    if not verify_password(password, user['password_hash']):
+    is_valid, new_hash = await verify_and_update_password_async(password, user['password_hash'])
+    if not is_valid:
         return None
+
+    # The configured bcrypt cost changed since this hash was made; upgrade it transparently.
+    if new_hash:
+        await update_user(str(user['id']), {"password_hash": new_hash})
         
     # Authentication successful
     return user
\ No newline at end of file
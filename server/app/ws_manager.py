@@ -1,125 +1,235 @@
 # app/ws_manager.py
 
-from typing import Dict
+import asyncio
+from typing import Dict, Optional
 from app.services import session_service
+from app.core.config import settings
+from app.schemas.ws import (
+    CheckUserStatusPayload, PresenceSubscriptionPayload, StorePendingSessionPayload,
+    NewMailNotificationPayload, PendingAckPayload, QkdRelayPayload
+)
+from app.ws_dispatcher import EventContext, EventRegistry, RELAYED, DROPPED_OFFLINE, HANDLED, REJECTED
+from app.services.presence import LocalPresenceStore, user_room
+from app.services.presence_subscriptions import PresenceSubscriptions
+from app.services.handshake_sessions import handshake_table
+from app.services.relay_limits import EventRateLimiter, SendQueueGuard, default_rate_limits
 
 class ConnectionManager:
     """
     Manages real-time user connections and orchestrates the QKD handshake relay,
     including the store-and-forward mechanism for offline users.
+    Presence lives in a pluggable store so that relays work across workers.
+    A user may be connected from several devices at once: every socket joins
+    the user's room and relays are emitted to that room, reaching all of them.
+    Incoming events are routed through a table of handlers (see `events`).
     """
-    def __init__(self, sio):
+
+    # Handshake messages relayed verbatim (plus a trusted 'from') to the other
+    # participant, in the order enforced by the handshake table.
+    RELAYED_QKD_EVENTS = (
+        "qkd_initiate", "qkd_bob_bases", "qkd_alice_bases",
+        "qkd_alice_sample", "qkd_handshake_complete", "qkd_alice_pa_choice",
+    )
+
+    def __init__(self, sio, presence=None, handshakes=None):
         self.sio = sio  
-        self.active_users: Dict[str, str] = {}
+        self.presence = presence if presence is not None else LocalPresenceStore()
+        self.handshakes = handshakes if handshakes is not None else handshake_table
+        self.subscriptions = PresenceSubscriptions(
+            sio, self.presence,
+            max_per_connection=settings.PRESENCE_MAX_SUBSCRIPTIONS,
+            debounce=settings.PRESENCE_DEBOUNCE_SECONDS
+        )
+        # sid -> sender, filled on connect so events don't need sio.get_session.
+        self.connections: Dict[str, EventContext] = {}
+
+        self.limiter = EventRateLimiter(default_rate_limits())
+        self.send_guard = SendQueueGuard(sio, settings.WS_SEND_QUEUE_HIGH_WATERMARK, settings.WS_SLOW_CONSUMER_POLICY)
+
+        self.events = EventRegistry(self.limiter)
+        self.events.register("check_user_status", self._on_check_user_status, CheckUserStatusPayload, "presence")
+        self.events.register("subscribe_presence", self._on_subscribe_presence, PresenceSubscriptionPayload, "presence")
+        self.events.register("unsubscribe_presence", self._on_unsubscribe_presence, PresenceSubscriptionPayload, "presence")
+        self.events.register("store_pending_session", self._on_store_pending_session, StorePendingSessionPayload, "store")
+        self.events.register("new_mail_notification", self._on_new_mail_notification, NewMailNotificationPayload, "notify")
+        self.events.register("qkd_pending_ack", self._on_qkd_pending_ack, PendingAckPayload, "control")
+        self.events.register("qkd_accept_pending", self._on_qkd_accept_pending, QkdRelayPayload, "control")
+        for event in self.RELAYED_QKD_EVENTS:
+            self.events.register(event, self._make_qkd_relay(event), QkdRelayPayload, "handshake")
 
     async def connect(self, sid: str, user_id: str, user_email: str):
         """
-        Handles a new user connecting. Associates their user_id with their sid
-        and checks for any pending handshake requests for them.
+        Handles a new device connecting. Adds the sid to the user's room and
+        presence entry and checks for any pending handshake requests for them.
+        """
+        self.connections[sid] = EventContext(sid, user_id, user_email)
+        # The first page of pending requests is fetched while the socket joins its room and presence.
+        pending_page, _ = await asyncio.gather(
+            session_service.get_pending_sessions_for_recipient(user_id, settings.PENDING_SESSIONS_PAGE_SIZE),
+            self._register_device(sid, user_id, user_email)
+        )
+        await self._send_pending_page(sid, user_id, *pending_page)
+
+    async def _register_device(self, sid: str, user_id: str, user_email: str):
+        await self.sio.enter_room(sid, user_room(user_id))
+        device_count = await self.presence.add_sid(user_id, sid)
+        print(f"INFO: User '{user_email}' ({user_id}) connected with SID '{sid}' ({device_count} device(s))")
+        self.subscriptions.notify(user_id)
+
+    async def _send_pending_page(self, sid: str, user_id: str, sessions: list, next_cursor: Optional[str]):
+        """
+        Sends one page of pending requests as a single `qkd_pending_batch` event.
+        The client acknowledges the page with `qkd_pending_ack` to pull the next one.
         """
-        self.active_users[user_id] = sid
-        print(f"INFO: User '{user_email}' ({user_id}) connected with SID '{sid}'")
-        
-        pending_sessions = await session_service.get_pending_sessions_for_recipient(user_id)
-        if pending_sessions:
-            print(f"INFO: Found {len(pending_sessions)} pending session(s) for user {user_id}")
-            for session in pending_sessions:
-                await self.sio.emit(
-                    'qkd_pending_request',
-                    {
-                        "from_email": session['initiator_email'],
-                        "session_id": str(session['session_id']),
-                        "from_id": str(session['initiator_id'])
-                    },
-                    to=sid 
-                )
-
-    async def disconnect(self, user_id: str):
-        """Handles a user disconnecting."""
-        if user_id in self.active_users:
-            del self.active_users[user_id]
+        if not sessions:
+            return
+        print(f"INFO: Delivering {len(sessions)} pending session(s) to user {user_id}" + (" (more to follow)" if next_cursor else ""))
+        await self.sio.emit('qkd_pending_batch', {
+            "requests": [
+                {
+                    "from_email": session['initiator_email'],
+                    "session_id": str(session['session_id']),
+                    "from_id": str(session['initiator_id'])
+                }
+                for session in sessions
+            ],
+            "next_cursor": next_cursor
+        }, to=sid)
+
+    async def disconnect(self, user_id: str, sid: str):
+        """Handles a device disconnecting. The user stays online while any other device is connected."""
+        self.connections.pop(sid, None)
+        remaining = await self.presence.remove_sid(user_id, sid)
+        self.subscriptions.forget(sid)
+        self.subscriptions.notify(user_id)
+        if remaining == 0:
+            self.limiter.forget(user_id)
             print(f"INFO: User '{user_id}' disconnected.")
+        else:
+            print(f"INFO: User '{user_id}' closed SID '{sid}'; {remaining} device(s) still connected.")
 
-    async def handle_message(self, event: str, data: dict, sender_id: str, sender_email: str):
+    async def handle_message(self, event: str, data, sid: str) -> str:
         """
-        The central message handler. It decides whether to relay a message
-        directly or to store it as a pending session.
+        The central message handler. Looks up the sender cached for this
+        connection and dispatches the event to its registered handler.
         """
+        ctx = self.connections.get(sid)
+        if ctx is None:
+            return REJECTED
+        return await self.events.dispatch(event, ctx, data)
 
-        if event == "check_user_status":
-            user_to_check_id = data.get("user_id")
-            if not user_to_check_id:
-                return
+    def _has_local_device(self, user_id: str) -> bool:
+        return any(True for _ in self.sio.manager.get_participants('/', user_room(user_id)))
 
-            is_online = user_to_check_id in self.active_users
-            print(f"INFO: User {sender_id} is checking status of {user_to_check_id}. Online: {is_online}")
+    async def _is_online(self, user_id: str) -> bool:
+        # A device connected to this worker answers without asking the presence store.
+        return self._has_local_device(user_id) or await self.presence.device_count(user_id) > 0
 
-            sender_sid = self.active_users.get(sender_id)
-            if sender_sid:
-                await self.sio.emit('user_status_response', {
-                    "user_id": user_to_check_id,
-                    "is_online": is_online
-                }, to=sender_sid)
-            return
-        
-        if event == "store_pending_session":
-            print(f"INFO: Received request from {sender_id} to store a pending session.")
-            await session_service.create_pending_session(
-                session_id=data.get("session_id"),
-                initiator_id=data.get("initiator_id"),
-                recipient_id=data.get("recipient_id"),
-                initiator_email=data.get("initiator_email"),
-                recipient_email=data.get("recipient_email")
-            )
-            return
+    async def _emit_to_user(self, event: str, data: dict, user_id: str) -> bool:
+        """
+        Relays to every device of a user, skipping local sockets whose send
+        queue is backed up. Returns False, without emitting, when the user has
+        no device in their room on this worker and the presence store isn't
+        shared, i.e. they are offline. With a shared store the emit goes out
+        through the backplane, which drops it if nobody is in the room, so
+        relays don't pay a presence round trip each.
+        """
+        room = user_room(user_id)
+        if not self.presence.shared and not self._has_local_device(user_id):
+            return False
+        slow = await self.send_guard.slow_consumers(room)
+        await self.sio.emit(event, data, to=room, skip_sid=slow or None)
+        return True
 
-        recipient_id = data.get("to")
-        if not recipient_id:
-            return
+    async def _on_check_user_status(self, ctx: EventContext, payload: CheckUserStatusPayload) -> str:
+        device_count = await self.presence.device_count(payload.user_id)
+        print(f"INFO: User {ctx.user_id} is checking status of {payload.user_id}. Devices online: {device_count}")
+
+        await self.sio.emit('user_status_response', {
+            "user_id": payload.user_id,
+            "is_online": device_count > 0,
+            "device_count": device_count
+        }, to=ctx.sid)
+        return HANDLED
+
+    async def _on_subscribe_presence(self, ctx: EventContext, payload: PresenceSubscriptionPayload) -> str:
+        await self.subscriptions.subscribe(ctx.sid, payload.user_ids)
+        return HANDLED
+
+    async def _on_unsubscribe_presence(self, ctx: EventContext, payload: PresenceSubscriptionPayload) -> str:
+        await self.subscriptions.unsubscribe(ctx.sid, payload.user_ids)
+        return HANDLED
+
+    async def _on_store_pending_session(self, ctx: EventContext, payload: StorePendingSessionPayload) -> str:
+        print(f"INFO: Received request from {ctx.user_id} to store a pending session.")
+        if payload.initiator_id != ctx.user_id:
+            print(f"WARNING: User {ctx.user_id} tried to store a pending session as {payload.initiator_id}. Rejecting.")
+            return REJECTED
+        stored = await session_service.create_pending_session(
+            session_id=payload.session_id,
+            initiator_id=ctx.user_id,
+            recipient_id=payload.recipient_id,
+            initiator_email=ctx.user_email,
+            recipient_email=payload.recipient_email
+        )
+        return HANDLED if stored else REJECTED
+
+    async def _on_new_mail_notification(self, ctx: EventContext, payload: NewMailNotificationPayload) -> str:
+        if not await self._emit_to_user('force_sync', {"folder": payload.folder}, payload.to):
+            return DROPPED_OFFLINE
+        print(f"INFO: Relayed new mail notification to {payload.to}. Triggering sync for folder '{payload.folder}'.")
+        return RELAYED
+
+    async def _on_qkd_pending_ack(self, ctx: EventContext, payload: PendingAckPayload) -> str:
+        sessions, next_cursor = await session_service.get_pending_sessions_for_recipient(
+            ctx.user_id, settings.PENDING_SESSIONS_PAGE_SIZE, after=payload.cursor
+        )
+        await self._send_pending_page(ctx.sid, ctx.user_id, sessions, next_cursor)
+        return HANDLED
 
-        if event == "qkd_initiate":
-            if recipient_id in self.active_users:
-                recipient_sid = self.active_users[recipient_id]
-                print(f"INFO: Relaying live QKD initiation from {sender_id} to {recipient_id}")
-                await self.sio.emit('qkd_initiate', data, to=recipient_sid)
+    async def _on_qkd_accept_pending(self, ctx: EventContext, payload: QkdRelayPayload) -> str:
+        # This event is sent by a recipient (Bob) who has just come online.
+        # 'to' in this context is the original sender (Alice).
+        # Tell Alice's client: "Bob is ready for this session. You can start now."
+        if not await self._emit_to_user('initiate_from_pending', {
+            "session_id": payload.session_id,
+            "to": ctx.user_id # The ID of Bob, who is now ready
+        }, payload.to):
+            return DROPPED_OFFLINE
+
+        print(f"INFO: Recipient {ctx.user_id} accepted pending session {payload.session_id}.")
+        print(f"INFO: Nudged original sender {payload.to} to re-initiate handshake.")
+        return RELAYED
+
+    def _make_qkd_relay(self, event: str):
+        async def relay(ctx: EventContext, payload: QkdRelayPayload) -> str:
+            if not payload.session_id:
+                return REJECTED
+
+            if event == "qkd_initiate":
+                if not await self._is_online(payload.to):
+                    print(f"WARNING: Received a 'qkd_initiate' for an offline user ({payload.to}). Ignoring. The client should have checked status first.")
+                    return DROPPED_OFFLINE
+                recipient_id = await self.handshakes.begin(payload.session_id, ctx.user_id, payload.to)
             else:
-                print(f"WARNING: Received a 'qkd_initiate' for an offline user ({recipient_id}). Ignoring. The client should have checked status first.")
-                
-        elif event == "new_mail_notification":
-            if recipient_id in self.active_users:
-                recipient_sid = self.active_users[recipient_id]
-                folder_to_sync = data.get("folder", "INBOX") # Default to INBOX
-                print(f"INFO: Relaying new mail notification to {recipient_id}. Triggering sync for folder '{folder_to_sync}'.")
-                await self.sio.emit('force_sync', {"folder": folder_to_sync}, to=recipient_sid)
-        # For all other messages in an ongoing handshake, just relay them
-        elif event == "qkd_accept_pending":
-            # This event is sent by a recipient (Bob) who has just come online.
-            # 'recipient_id' in this context is the original sender (Alice).
-            if recipient_id in self.active_users:
-                original_sender_sid = self.active_users[recipient_id]
-                session_id = data.get("session_id")
-                
-                print(f"INFO: Recipient {sender_id} accepted pending session {session_id}.")
-                print(f"INFO: Nudging original sender {recipient_id} to re-initiate handshake.")
-
-                # Tell Alice's client: "Bob is ready for this session. You can start now."
-                await self.sio.emit('initiate_from_pending', {
-                    "session_id": session_id,
-                    "to": sender_id # The ID of Bob, who is now ready
-                }, to=original_sender_sid)
-        elif event.startswith('qkd_'):
-            if recipient_id in self.active_users:
-                recipient_sid = self.active_users[recipient_id]
-
-                relay_payload = data.copy()
-                # 2. Add the 'from' field so the recipient knows who it's from.
-                relay_payload['from'] = sender_id
-
-                await self.sio.emit(event, relay_payload, to=recipient_sid)
-                
-                # Clean up the pending session record once the handshake is fully complete
-                if event == "qkd_handshake_complete":
-                    session_id = data.get("session_id")
-                    if session_id:
-                        print(f"INFO: Handshake for session {session_id} complete. Deleting pending record.")
-                        await session_service.delete_pending_session(session_id)
\ No newline at end of file
+                # Later steps go to the other participant of the session, whatever 'to' says.
+                recipient_id = await self.handshakes.advance(payload.session_id, event, ctx.user_id)
+            if recipient_id is None:
+                print(f"WARNING: Rejected '{event}' from {ctx.user_id} for session {payload.session_id}.")
+                return REJECTED
+
+            # Forward the client's fields untouched, with a 'from' the recipient can trust.
+            relay_payload = dict(payload.model_extra or {})
+            relay_payload['to'] = recipient_id
+            relay_payload['session_id'] = payload.session_id
+            relay_payload['from'] = ctx.user_id
+
+            if not await self._emit_to_user(event, relay_payload, recipient_id):
+                return DROPPED_OFFLINE
+
+            # Clean up the pending session record once the handshake is fully complete
+            if event == "qkd_handshake_complete":
+                print(f"INFO: Handshake for session {payload.session_id} complete. Deleting pending record.")
+                await session_service.delete_pending_session(payload.session_id, recipient_id=ctx.user_id)
+            return RELAYED
+        return relay